@@ -15,22 +15,44 @@ import os
 import re
 import html
 import logging
+import time
 import asyncio
-from dataclasses import dataclass
+import functools
+import gc
+import heapq
+import uuid
+from bisect import bisect_left
+from collections import deque
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
-from telegram import Update
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     ApplicationBuilder,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
 
+import index_cache
+import metrics
+from chunk_store import ChunkStore, ChunkStoreBuilder, ChunkView
+from passages import MAX_WINDOW, Passages, PassageView
+from prefix_index import PrefixIndex, PrefixIndexBuilder
+from query_cache import QueryCache
+from rate_limit import Limit, RateLimiter
+from analyzer import analyze, analyze_positions
+from term_index import TermIndex, TermIndexBuilder
+
 # ─────────────────────────────────────────
 # Logging
 # ─────────────────────────────────────────
@@ -48,6 +70,8 @@ BOT_DISPLAY = "MAESTRO ANACLETO"
 BOT_USERNAME = os.getenv("BOT_USERNAME", "@MaestroAnacletoBot")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "").strip()
+# Bot API alternativa (server Bot API locale, o lo stub di bench/load.py).
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").strip().rstrip("/")
 
 ALLOWED_GROUP_ID = os.getenv("ALLOWED_GROUP_ID", "").strip()
 ALLOWED_GROUP_ID_INT: Optional[int] = None
@@ -66,6 +90,146 @@ PDF_DIR = Path(os.getenv("PDF_DIR", str(BASE_DIR / "data" / "pdfs"))).resolve()
 logger.info("▶ BASE_DIR=%s", BASE_DIR)
 logger.info("▶ PDF_DIR=%s (env override: %s)", PDF_DIR, bool(os.getenv("PDF_DIR")))
 
+# Testi OCR già puliti (ocr_gui.py -> <libro>_clean.txt): se c'è il sidecar di un
+# libro, il bot indicizza quello e non apre il PDF.
+OCR_DIR = Path(os.getenv("OCR_DIR", str(PDF_DIR.parent / "pdfs_ocr"))).resolve()
+logger.info("▶ OCR_DIR=%s", OCR_DIR)
+
+# Snapshot binario dell'indice accanto a PDF_DIR (es. data/.pdfs.index.bin),
+# aperto con mmap e condiviso da tutti i worker uvicorn.
+INDEX_CACHE_PATH = Path(
+    os.getenv("INDEX_CACHE_PATH", str(PDF_DIR.parent / f".{PDF_DIR.name}.index.bin"))
+).resolve()
+logger.info("▶ INDEX_CACHE_PATH=%s", INDEX_CACHE_PATH)
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        logger.warning("%s non è un intero valido: %r — uso %d", name, raw, default)
+        return default
+
+
+# Estrazione PDF: 1 = sequenziale (default, adatto all'istanza Render),
+# N > 1 = pool di N processi, 0 = un processo per core.
+EXTRACT_WORKERS = _env_int("EXTRACT_WORKERS", 1)
+# I libri più lunghi di così vengono spezzati in più task (per intervallo di pagine).
+EXTRACT_PAGES_PER_TASK = _env_int("EXTRACT_PAGES_PER_TASK", 200)
+
+# Passaggi (unità di ricerca): finestre di PASSAGE_TOKENS token che avanzano di
+# PASSAGE_STRIDE, quindi sovrapposte. ~64 token ≈ 400 caratteri di risposta.
+PASSAGE_TOKENS = min(MAX_WINDOW, max(8, _env_int("PASSAGE_TOKENS", 64)))
+PASSAGE_STRIDE = min(PASSAGE_TOKENS, max(1, _env_int("PASSAGE_STRIDE", 32)))
+
+# Cache delle risposte a /ask (0 voci = disattivata). TTL in secondi.
+QUERY_CACHE = QueryCache(
+    max_entries=_env_int("QUERY_CACHE_SIZE", 256),
+    max_bytes=_env_int("QUERY_CACHE_BYTES", 2_000_000),
+    ttl=_env_int("QUERY_CACHE_TTL", 600),
+)
+
+# Inline mode (@bot <testo>): le query arrivano a ogni tasto premuto. I
+# suggerimenti oltre il primo si aggiungono solo entro INLINE_BUDGET_MS;
+# INLINE_CACHE_TIME = secondi per cui Telegram può riusare la risposta.
+INLINE_MIN_CHARS = 2
+INLINE_BUDGET_MS = _env_int("INLINE_BUDGET_MS", 150)
+INLINE_CACHE_TIME = _env_int("INLINE_CACHE_TIME", 60)
+# Cache a parte per le risposte ai completamenti inline: quelli di ogni tasto
+# premuto non devono scalzare le risposte di /ask né falsarne hit/miss.
+INLINE_QUERY_CACHE = QueryCache(
+    max_entries=_env_int("INLINE_QUERY_CACHE_SIZE", 64),
+    max_bytes=500_000,
+    ttl=QUERY_CACHE.ttl,
+)
+
+# /reindex: ogni quanti secondi il messaggio di avanzamento viene modificato.
+REINDEX_PROGRESS_EVERY = max(1, _env_int("REINDEX_PROGRESS_EVERY", 5))
+
+# Rate limiting (token bucket): richieste al minuto e raffica massima per
+# utente e per chat di gruppo (0 al minuto = nessun limite su quel livello).
+# /reindex costa RATE_REINDEX_COST richieste ed è limitato anche globalmente a
+# RATE_REINDEX_PER_HOUR (0 = nessun limite globale); una inline query (una per
+# tasto premuto) costa poco.
+RATE_REINDEX_COST = max(1, _env_int("RATE_REINDEX_COST", 5))
+RATE_INLINE_COST = 0.25
+
+
+def _rate_limit(per_min: int, burst: int) -> Optional[Limit]:
+    return Limit.per_minute(per_min, max(burst, RATE_REINDEX_COST)) if per_min > 0 else None
+
+
+def _command_limit(per_hour: int, burst: int) -> Optional[Limit]:
+    return Limit(rate=per_hour / 3600.0, burst=burst) if per_hour > 0 else None
+
+
+RATE_LIMITER = RateLimiter(
+    user=_rate_limit(_env_int("RATE_USER_PER_MIN", 10), _env_int("RATE_USER_BURST", 5)),
+    chat=_rate_limit(_env_int("RATE_CHAT_PER_MIN", 30), _env_int("RATE_CHAT_BURST", 15)),
+    commands={"reindex": _command_limit(_env_int("RATE_REINDEX_PER_HOUR", 6), 2)},
+    costs={"reindex": float(RATE_REINDEX_COST), "inline": RATE_INLINE_COST},
+    max_keys=_env_int("RATE_LIMIT_KEYS", 10_000),
+)
+
+# ─────────────────────────────────────────
+# Metriche (GET /metrics, vedi metrics.py)
+# ─────────────────────────────────────────
+COMMAND_SECONDS = metrics.Histogram("anacleto_command_seconds", "Durata degli handler per comando", ["command"])
+SEARCH_SECONDS = metrics.Histogram("anacleto_search_seconds", "Durata di search_index")
+RENDER_SECONDS = metrics.Histogram("anacleto_render_seconds", "Snippet e HTML dei blocchi di una risposta")
+TELEGRAM_SECONDS = metrics.Histogram("anacleto_telegram_request_seconds", "Chiamate alla Bot API", ["method"])
+TELEGRAM_REQUESTS = metrics.Counter(
+    "anacleto_telegram_requests_total", "Chiamate alla Bot API per esito (codice HTTP o eccezione)", ["method", "status"],
+)
+INDEX_BUILD_SECONDS = metrics.Histogram(
+    "anacleto_index_build_seconds", "Durata dei rebuild dell'indice", ["mode"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+INDEX_BUILDS = metrics.Counter("anacleto_index_builds_total", "Rebuild dell'indice per esito", ["mode", "result"])
+
+
+def _index_gauge(name: str, help: str, fn: Callable[["Cf77Index"], float]) -> None:
+    metrics.Computed(name, help, lambda: fn(INDEX) if INDEX is not None else None)
+
+
+_index_gauge("anacleto_index_books", "Libri nell'indice", lambda idx: idx.books)
+_index_gauge("anacleto_index_pages", "Pagine nell'indice", lambda idx: idx.pages)
+_index_gauge("anacleto_index_chunks", "Chunk (pagine con testo) nell'indice", lambda idx: len(idx.chunks))
+_index_gauge("anacleto_index_chars", "Caratteri di testo indicizzati", lambda idx: idx.chars)
+_index_gauge("anacleto_index_passages", "Passaggi di ricerca", lambda idx: len(idx.passages or ()))
+_index_gauge("anacleto_index_terms", "Termini distinti", lambda idx: len(idx.terms or ()))
+_index_gauge("anacleto_index_generation", "Generazione dell'indice corrente", lambda idx: idx.generation)
+metrics.Computed(
+    "anacleto_index_snapshot_bytes", "Dimensione dello snapshot su disco",
+    lambda: INDEX_CACHE_PATH.stat().st_size if INDEX_CACHE_PATH.exists() else None,
+)
+metrics.Computed(
+    "anacleto_query_cache_requests_total", "Lookup nella cache risposte di /ask",
+    lambda: {("hit",): QUERY_CACHE.hits, ("miss",): QUERY_CACHE.misses}, ["result"], kind="counter",
+)
+metrics.Computed(
+    "anacleto_inline_cache_requests_total", "Lookup nella cache dei completamenti inline",
+    lambda: {("hit",): INLINE_QUERY_CACHE.hits, ("miss",): INLINE_QUERY_CACHE.misses}, ["result"], kind="counter",
+)
+metrics.Computed(
+    "anacleto_rate_limited_total", "Richieste fermate dal rate limiting, per livello",
+    lambda: {(scope,): n for scope, n in RATE_LIMITER.throttled.items()}, ["scope"], kind="counter",
+)
+
+
+def _timed(command: str):
+    """Decoratore degli handler: durata in anacleto_command_seconds{command=...}."""
+    def wrap(handler):
+        @functools.wraps(handler)
+        async def timed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            with COMMAND_SECONDS.time(command):
+                await handler(update, context)
+        return timed
+    return wrap
+
 # ─────────────────────────────────────────
 # pypdf
 # ─────────────────────────────────────────
@@ -82,19 +246,182 @@ except ImportError as e:
 # ─────────────────────────────────────────
 # Index structures
 # ─────────────────────────────────────────
+# Forma "logica" di una pagina. Nell'indice le pagine stanno in un ChunkStore
+# colonnare (chunk_store.py); gli handler ricevono ChunkView con gli stessi campi.
 @dataclass
 class PageChunk:
     book: str
     page: int   # 1-based
     text: str
 
+@dataclass
+class BookMeta:
+    fingerprint: Dict[str, Any]
+    pages: int = 0
+    text_pages: int = 0
+    chars: int = 0
+    ok: bool = True    # False = estrazione fallita (anche a metà), riprovata al prossimo reindex
+
+
 @dataclass
 class Cf77Index:
     books: int
     pages: int
     text_pages: int
     chars: int
-    chunks: List[PageChunk]
+    chunks: ChunkStore
+    passages: Optional[Passages] = field(default=None, repr=False)
+    terms: Optional[TermIndex] = field(default=None, repr=False)    # postings sui passaggi
+    prefixes: Optional[PrefixIndex] = field(default=None, repr=False)  # autocomplete inline
+    book_meta: Dict[str, BookMeta] = field(default_factory=dict, repr=False)
+    generation: int = 0    # assegnata da _swap_index() quando l'indice diventa INDEX
+
+
+@dataclass
+class ReindexReport:
+    mode: str          # "full" | "incremental"
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        def names(xs: List[str]) -> str:
+            return ", ".join(xs) if xs else "—"
+        return (
+            f"modalità {self.mode} in {self.seconds:.1f}s\n"
+            f"• aggiunti: {names(self.added)}\n"
+            f"• aggiornati: {names(self.updated)}\n"
+            f"• rimossi: {names(self.removed)}"
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "added": self.added,
+            "updated": self.updated,
+            "removed": self.removed,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+@dataclass
+class ReindexJob:
+    """
+    Un rebuild dell'indice (load/incremental/full) con il suo avanzamento per
+    libro. I contatori vengono aggiornati dal thread del build e letti dagli
+    handler: sono solo assegnazioni di int/str, non serve un lock.
+    """
+    mode: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    state: str = "queued"      # queued | running | done | failed | merged
+    started_at: float = 0.0    # time.time()
+    finished_at: float = 0.0
+    books_total: int = 0
+    books_done: int = 0
+    bytes_total: int = 0       # dimensione delle sorgenti da estrarre: base dell'ETA
+    bytes_done: int = 0
+    pages_done: int = 0
+    current: str = ""
+    error: str = ""
+    merged_into: str = ""      # job già in corso che ha assorbito questo
+    report: Optional[ReindexReport] = None
+    _t0: float = field(default=0.0, repr=False)
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    # ── chiamati dal build (thread dell'executor) ──
+    def begin(self, sources: List[Path]) -> None:
+        self.books_total = len(sources)
+        self.bytes_total = sum(_file_size(p) for p in sources)
+
+    def book_started(self, src: Path) -> None:
+        self.current = book_name(src)
+
+    def page_done(self) -> None:
+        self.pages_done += 1
+
+    def book_done(self, src: Path) -> None:
+        self.books_done += 1
+        self.bytes_done += _file_size(src)
+        self.current = ""
+
+    # ── chiamati dall'event loop ──
+    def start(self) -> None:
+        self.state = "running"
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+
+    def finish(self, report: Optional[ReindexReport] = None, error: str = "", merged_into: str = "") -> None:
+        self.state = "merged" if merged_into else ("failed" if error else "done")
+        self.report, self.error, self.merged_into = report, error, merged_into
+        self.finished_at = time.time()
+        self.current = ""
+        self._done.set()
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("queued", "running")
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """True se il job è finito (entro `timeout` secondi)."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @property
+    def elapsed(self) -> float:
+        if not self._t0:
+            return 0.0
+        end = self.finished_at - self.started_at if self.finished_at else time.perf_counter() - self._t0
+        return max(end, 0.0)
+
+    @property
+    def pages_per_sec(self) -> float:
+        return self.pages_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Secondi mancanti stimati dai byte delle sorgenti già estratte."""
+        if not self.running or not self.bytes_done or self.bytes_done >= self.bytes_total:
+            return None
+        return self.elapsed * (self.bytes_total - self.bytes_done) / self.bytes_done
+
+    def progress_line(self) -> str:
+        if self.state == "queued":
+            return f"job {self.id} ({self.mode}) in coda"
+        line = (
+            f"job {self.id} ({self.mode}): {self.books_done}/{self.books_total} libri · "
+            f"{self.pages_done} pag · {self.pages_per_sec:.0f} pag/s · {self.elapsed:.0f}s"
+        )
+        if self.eta is not None:
+            line += f" · ETA {self.eta:.0f}s"
+        if self.current:
+            line += f" · ora: {self.current}"
+        elif self.state == "running" and self.books_done == self.books_total:
+            line += " · finalizzo indice e snapshot"
+        return line
+
+    def as_dict(self) -> Dict[str, Any]:
+        eta = self.eta
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "state": self.state,
+            "started_at": round(self.started_at, 3),
+            "finished_at": round(self.finished_at, 3),
+            "elapsed": round(self.elapsed, 3),
+            "books_done": self.books_done,
+            "books_total": self.books_total,
+            "pages_done": self.pages_done,
+            "pages_per_sec": round(self.pages_per_sec, 1),
+            "eta": round(eta, 1) if eta is not None else None,
+            "current": self.current,
+            "error": self.error,
+            "merged_into": self.merged_into,
+            "report": self.report.as_dict() if self.report else None,
+        }
 
 # ✅ Global index — scritto da build_and_store_index(), letto da handler
 INDEX: Optional[Cf77Index] = None
@@ -118,41 +445,314 @@ def list_pdfs(pdf_dir: Path) -> List[Path]:
     except Exception:
         return []
 
-def _extract_one_pdf(path: Path) -> Tuple[int, int, int, List[str]]:
+SIDECAR_SUFFIX = "_clean.txt"
+# Senza form-feed né numeri di pagina riconoscibili, il sidecar viene diviso in
+# "pagine" di circa questa lunghezza (a confine di paragrafo).
+SIDECAR_PAGE_CHARS = 2500
+
+def _is_sidecar(path: Path) -> bool:
+    return path.name.endswith(SIDECAR_SUFFIX)
+
+def book_name(path: Path) -> str:
+    """Nome del libro citato nelle risposte: per un sidecar è il PDF da cui è nato."""
+    if _is_sidecar(path):
+        return path.name[: -len(SIDECAR_SUFFIX)] + ".pdf"
+    return path.name
+
+def list_sources(pdf_dir: Path, ocr_dir: Optional[Path] = None) -> List[Path]:
+    """
+    Sorgenti da indicizzare, una per libro, ordinate per nome del libro:
+    il sidecar OCR se esiste, altrimenti il PDF.
+    """
+    by_book = {p.name: p for p in list_pdfs(pdf_dir)}
+    if ocr_dir is not None:
+        try:
+            for p in ocr_dir.glob("*" + SIDECAR_SUFFIX):
+                if p.is_file():
+                    by_book[book_name(p)] = p
+        except Exception:
+            pass
+    return [by_book[n] for n in sorted(by_book)]
+
+_PAGE_NUMBER_LINE_RE = re.compile(r"^[ \t]*(\d{1,4})[ \t]*$", flags=re.MULTILINE)
+
+def _split_sidecar_pages(text: str) -> Iterator[str]:
+    # 1) ocrmypdf --sidecar separa le pagine con un form-feed
+    if "\f" in text:
+        a = 0
+        while (z := text.find("\f", a)) != -1:
+            yield text[a:z]
+            a = z + 1
+        yield text[a:]
+        return
+
+    # 2) righe con il solo numero di pagina, in sequenza crescente
+    cuts: List[int] = []
+    last = None
+    for m in _PAGE_NUMBER_LINE_RE.finditer(text):
+        n = int(m.group(1))
+        if last is None or n == last + 1:
+            cuts.append(m.end())
+            last = n
+    if len(cuts) >= 3:
+        bounds = [0] + cuts
+        for a, b in zip(bounds, bounds[1:]):
+            yield text[a:b]
+        if text[cuts[-1]:].strip():
+            yield text[cuts[-1]:]
+        return
+
+    # 3) pseudo-pagine di ~SIDECAR_PAGE_CHARS caratteri, senza spezzare i paragrafi
+    cur, size = [], 0
+    for para in text.split("\n\n"):
+        if cur and size + len(para) > SIDECAR_PAGE_CHARS:
+            yield "\n\n".join(cur)
+            cur, size = [], 0
+        cur.append(para)
+        size += len(para) + 2
+    if cur:
+        yield "\n\n".join(cur)
+
+# ─────────────────────────────────────────
+# Extraction (streaming)
+# ─────────────────────────────────────────
+# Le pagine escono una alla volta dal lettore PDF (o dal sidecar), passano da
+# _clean_ws e vanno dritte in _IndexBuilder: nessuna lista con il testo di
+# tutto il corpus esiste mai in memoria.
+def _iter_pdf_pages(path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Testo pulito delle pagine [start, stop), una alla volta."""
     if not HAVE_PYPDF or PdfReader is None:
         raise RuntimeError("pypdf non disponibile")
 
-    reader = PdfReader(str(path))
-    page_texts: List[str] = []
-    text_pages = 0
-    chars = 0
-    empty_pages = 0
+    # File aperto e non percorso: con un percorso pypdf copia tutto il PDF in
+    # un BytesIO, e il picco crescerebbe con la dimensione del file.
+    with open(path, "rb") as fh:
+        reader = PdfReader(fh)
+        n = len(reader.pages)
+        stop = n if stop is None else min(stop, n)
+        for i in range(start, stop):
+            try:
+                txt = reader.pages[i].extract_text() or ""
+            except Exception as e:
+                logger.debug("Errore extract_text pagina: %s", e)
+                txt = ""
+            yield _clean_ws(txt)
+
 
-    for page in reader.pages:
+def _extract_page_range(path: str, start: int, stop: Optional[int] = None) -> List[str]:
+    """Un blocco di pagine per un task del pool (il risultato torna al processo principale)."""
+    pages = list(_iter_pdf_pages(path, start, stop))
+    gc.collect()  # vedi _iter_pdf_book
+    return pages
+
+
+def _pdf_page_ranges(path: Path) -> List[Tuple[int, int]]:
+    """Blocchi di EXTRACT_PAGES_PER_TASK pagine (uno solo se <= 0)."""
+    if not HAVE_PYPDF or PdfReader is None:
+        raise RuntimeError("pypdf non disponibile")
+    with open(path, "rb") as fh:
+        n = len(PdfReader(fh).pages)
+    step = EXTRACT_PAGES_PER_TASK if EXTRACT_PAGES_PER_TASK > 0 else max(n, 1)
+    return [(a, a + step) for a in range(0, n, step)]
+
+
+def _iter_pdf_book(path: Path) -> Iterator[str]:
+    # Un PdfReader nuovo per blocco: pypdf tiene in cache gli oggetti già letti,
+    # così la cache non cresce con la lunghezza del libro. Gli oggetti pypdf
+    # formano cicli con il reader: senza un gc esplicito le cache dei blocchi
+    # finiti restano in memoria fino alla prossima raccolta di generazione 2.
+    for a, b in _pdf_page_ranges(path):
+        yield from _iter_pdf_pages(str(path), a, b)
+        gc.collect()
+
+
+def _iter_text_pages(path: Path) -> Iterator[str]:
+    raw = path.read_text(encoding="utf-8", errors="replace")
+    for t in _split_sidecar_pages(raw):
+        yield _clean_ws(t)
+
+
+def _extract_pdfs_parallel(pdfs: List[Path], workers: int) -> Iterator[Iterator[str]]:
+    """
+    Un iteratore di pagine per PDF, nell'ordine di `pdfs`, estratte da un pool di
+    processi: un task per blocco di EXTRACT_PAGES_PER_TASK pagine. Al massimo
+    2 * workers task sono in volo o in attesa di essere consumati, quindi in
+    memoria ci sono pochi blocchi alla volta, qualunque sia la dimensione del corpus.
+    Ogni libro va consumato (o abbandonato) prima di chiedere il successivo.
+    """
+    plan: List[Tuple[int, int, int]] = []
+    broken: Dict[int, Exception] = {}
+    for bi, pdf in enumerate(pdfs):
         try:
-            txt = page.extract_text() or ""
+            plan.extend((bi, a, b) for a, b in _pdf_page_ranges(pdf))
         except Exception as e:
-            logger.debug("Errore extract_text pagina: %s", e)
-            txt = ""
-        txt = _clean_ws(txt)
-        if txt:
-            text_pages += 1
-            chars += len(txt)
-        else:
-            empty_pages += 1
-        page_texts.append(txt)
+            broken[bi] = e
+
+    logger.info("⚙️ estrazione parallela: %d task su %d processi", len(plan), workers)
+    # spawn e non fork: build_index gira in un thread dell'executor di asyncio.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        todo = iter(plan)
+        inflight: Deque[Tuple[int, Any]] = deque()
+
+        def fill() -> None:
+            while len(inflight) < 2 * workers:
+                task = next(todo, None)
+                if task is None:
+                    return
+                bi, a, b = task
+                try:
+                    fut = ex.submit(_extract_page_range, str(pdfs[bi]), a, b)
+                except Exception as e:
+                    # Pool rotto (un processo è morto): l'errore esce dal libro, non dal build.
+                    fut = Future()
+                    fut.set_exception(e)
+                inflight.append((bi, fut))
+
+        def book_pages(bi: int) -> Iterator[str]:
+            if bi in broken:
+                raise broken[bi]
+            while True:
+                fill()
+                if not inflight or inflight[0][0] != bi:
+                    return
+                yield from inflight.popleft()[1].result()
+
+        for bi in range(len(pdfs)):
+            yield book_pages(bi)
+            # Libro abbandonato a metà (errore): i suoi blocchi rimasti non servono più.
+            while True:
+                fill()
+                if not inflight or inflight[0][0] != bi:
+                    break
+                inflight.popleft()[1].cancel()
+
+
+def _extract_books(sources: List[Path], workers: Optional[int] = None) -> Iterator[Tuple[Path, Iterator[str]]]:
+    """
+    (sorgente, pagine) per ogni sorgente, nell'ordine di `sources`. Le pagine
+    (testo pulito, "" = pagina senza testo) escono una alla volta; gli errori di
+    estrazione escono dall'iteratore delle pagine del libro.
+    """
+    workers = EXTRACT_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    pdfs = [s for s in sources if not _is_sidecar(s)]
+    pooled = _extract_pdfs_parallel(pdfs, workers) if workers > 1 and pdfs else None
+    try:
+        for src in sources:
+            if _is_sidecar(src):
+                yield src, _iter_text_pages(src)
+            elif pooled is not None:
+                yield src, next(pooled)
+            else:
+                yield src, _iter_pdf_book(src)
+    finally:
+        if pooled is not None:
+            pooled.close()
 
-    logger.info(
-        "  📄 %s: %d pag totali / %d con testo / %d vuote / %d chars",
-        path.name, len(reader.pages), text_pages, empty_pages, chars,
-    )
-    return len(reader.pages), text_pages, chars, page_texts
+
+def _fingerprint(path: Path) -> Dict[str, Any]:
+    try:
+        return index_cache.fingerprint_file(path)
+    except Exception:
+        return {"name": path.name}
+
+
+def _file_size(path: Path) -> int:
+    # Solo per avanzamento/ETA dei job: stat, non l'impronta (che legge tutto il file).
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+class _IndexBuilder:
+    """
+    Indice costruito in streaming: ogni pagina estratta entra subito nello
+    ChunkStore, viene divisa in passaggi che finiscono nelle postings, le sue
+    parole nel conteggio dei prefissi, e poi non serve più. Il picco di memoria
+    di un build è una pagina (o un blocco del pool) più le strutture dell'indice.
+    """
+
+    def __init__(self, job: Optional[ReindexJob] = None) -> None:
+        self.job = job
+        self.chunks = ChunkStoreBuilder()
+        self.passages = Passages()
+        self.terms = TermIndexBuilder()
+        self.prefixes = PrefixIndexBuilder()
+
+    def add_page(self, book: str, page: int, text: str) -> None:
+        cid = self.chunks.append(book, page, text)
+        for pid, terms in self.passages.add_page(cid, text, PASSAGE_TOKENS, PASSAGE_STRIDE):
+            self.terms.add(pid, terms)
+        self.prefixes.add(text)
+
+    def copy_page(self, store: ChunkStore, cid: int, passages: Passages, pids: List[int], premap: List[int]) -> None:
+        """Pagina di un libro invariato (reindex incrementale): testo e passaggi copiati, non ri-analizzati."""
+        new_cid = self.chunks.append_from(store, cid)
+        for old, new in zip(pids, self.passages.copy_page(new_cid, passages, pids)):
+            premap[old] = new
+        self.prefixes.add(store.text(cid))
+
+    def add_book(self, src: Path, pages: Iterable[str], fingerprint: Optional[Dict[str, Any]] = None) -> BookMeta:
+        """
+        Consuma le pagine di un libro. Se l'estrazione si interrompe a metà le
+        pagine già lette restano nell'indice, ma il libro è segnato ok=False e
+        verrà riestratto al prossimo reindex. `fingerprint`: impronta già
+        calcolata dal chiamante (altrimenti il file viene letto qui).
+        """
+        name = book_name(src)
+        meta = BookMeta(fingerprint=fingerprint or _fingerprint(src))
+        job = self.job
+        if job:
+            job.book_started(src)
+        try:
+            for n, text in enumerate(pages, start=1):
+                meta.pages = n
+                if job:
+                    job.page_done()
+                if text:
+                    meta.text_pages += 1
+                    meta.chars += len(text)
+                    self.add_page(name, n, text)
+        except Exception:
+            logger.exception("❌ Errore estrazione testo da %s (dopo %d pagine)", src.name, meta.pages)
+            meta.ok = False
+        logger.info(
+            "  📄 %s: %d pag totali / %d con testo / %d vuote / %d chars",
+            src.name, meta.pages, meta.text_pages, meta.pages - meta.text_pages, meta.chars,
+        )
+        if job:
+            job.book_done(src)
+        return meta
+
+
+def _passage_index(chunks: ChunkStore) -> Tuple[Passages, TermIndex]:
+    passages, terms = Passages(), TermIndexBuilder()
+    for cid in range(len(chunks)):
+        for pid, tp in passages.add_page(cid, chunks.text(cid), PASSAGE_TOKENS, PASSAGE_STRIDE):
+            terms.add(pid, tp)
+    return passages, terms.build()
 
 
-def build_index(pdf_dir: Path) -> Cf77Index:
-    pdfs = list_pdfs(pdf_dir)
+def build_index(
+    pdf_dir: Path,
+    workers: Optional[int] = None,
+    ocr_dir: Optional[Path] = None,
+    job: Optional[ReindexJob] = None,
+    fingerprints: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Cf77Index:
+    """`fingerprints`: impronte già calcolate, per nome file (evita di rileggere i libri)."""
+    pdfs = list_sources(pdf_dir, ocr_dir)
+    fingerprints = fingerprints or {}
+    n_text = sum(1 for p in pdfs if _is_sidecar(p))
     logger.info("═" * 60)
-    logger.info("🔍 build_index START | PDF_DIR=%s | trovati %d PDF", pdf_dir, len(pdfs))
+    logger.info(
+        "🔍 build_index START | PDF_DIR=%s | OCR_DIR=%s | trovati %d libri (%d da sidecar OCR)",
+        pdf_dir, ocr_dir, len(pdfs), n_text,
+    )
     for p in pdfs:
         try:
             logger.info("  • %s (%d bytes)", p.name, p.stat().st_size)
@@ -161,78 +761,601 @@ def build_index(pdf_dir: Path) -> Cf77Index:
 
     if not pdfs:
         logger.warning("⚠ Nessun PDF trovato in %s", pdf_dir)
-        return Cf77Index(books=0, pages=0, text_pages=0, chars=0, chunks=[])
+        return Cf77Index(books=0, pages=0, text_pages=0, chars=0, chunks=ChunkStore())
 
-    if not HAVE_PYPDF:
+    if not HAVE_PYPDF and not n_text:
         logger.error("❌ pypdf non disponibile — indice vuoto (books count-only)")
-        return Cf77Index(books=len(pdfs), pages=0, text_pages=0, chars=0, chunks=[])
-
-    chunks: List[PageChunk] = []
-    total_pages = 0
-    total_text_pages = 0
-    total_chars = 0
+        return Cf77Index(books=len(pdfs), pages=0, text_pages=0, chars=0, chunks=ChunkStore())
+    if not HAVE_PYPDF:
+        logger.error("❌ pypdf non disponibile — indicizzo solo i sidecar OCR")
 
-    for pdf in pdfs:
-        try:
-            pages, text_pages, chars, page_texts = _extract_one_pdf(pdf)
-            total_pages += pages
-            total_text_pages += text_pages
-            total_chars += chars
-            bookname = pdf.name
-            for idx, txt in enumerate(page_texts, start=1):
-                if txt:
-                    chunks.append(PageChunk(book=bookname, page=idx, text=txt))
-        except Exception:
-            logger.exception("❌ Errore estrazione testo da %s", pdf.name)
+    if job:
+        job.begin(pdfs)
+    ib = _IndexBuilder(job)
+    book_meta: Dict[str, BookMeta] = {}
+    for src, pages in _extract_books(pdfs, workers):
+        book_meta[book_name(src)] = ib.add_book(src, pages, fingerprints.get(src.name))
 
+    passages = ib.passages
+    terms = ib.terms.build()
     result = Cf77Index(
         books=len(pdfs),
-        pages=total_pages,
-        text_pages=total_text_pages,
-        chars=total_chars,
-        chunks=chunks,
+        pages=sum(m.pages for m in book_meta.values()),
+        text_pages=sum(m.text_pages for m in book_meta.values()),
+        chars=sum(m.chars for m in book_meta.values()),
+        chunks=ib.chunks.build(),
+        passages=passages,
+        terms=terms,
+        prefixes=ib.prefixes.build(),
+        book_meta=book_meta,
     )
     logger.info(
-        "✅ build_index DONE | books=%d pages=%d text_pages=%d chars=%d chunks=%d",
+        "✅ build_index DONE | books=%d pages=%d text_pages=%d chars=%d chunks=%d passages=%d terms=%d",
         result.books, result.pages, result.text_pages, result.chars, len(result.chunks),
+        len(passages), len(terms),
     )
     logger.info("═" * 60)
     return result
 
 
-async def build_and_store_index() -> Cf77Index:
-    global INDEX
+def update_index(
+    idx: Cf77Index,
+    pdf_dir: Path,
+    workers: Optional[int] = None,
+    ocr_dir: Optional[Path] = None,
+    job: Optional[ReindexJob] = None,
+) -> Tuple[Cf77Index, ReindexReport]:
+    """
+    Reindex incrementale: confronta le impronte dei PDF su disco con book_meta,
+    estrae solo i libri nuovi o modificati, scarta i chunk dei libri rimossi e
+    aggiorna i contatori per differenza. L'indice di partenza non viene toccato.
+    """
+    t0 = time.perf_counter()
+    pdfs = list_sources(pdf_dir, ocr_dir)
+    if idx.chunks and not idx.book_meta:
+        # Indice senza metadati per libro: solo rebuild completo.
+        new_idx = build_index(pdf_dir, workers, ocr_dir, job)
+        return new_idx, ReindexReport(mode="full", added=sorted(new_idx.book_meta), seconds=time.perf_counter() - t0)
+
+    on_disk = {book_name(p): p for p in pdfs}
+    fps = {n: index_cache.fingerprint_file(p) for n, p in on_disk.items()}
+    old = idx.book_meta
+    added = [n for n in fps if n not in old]
+    updated = [n for n in fps if n in old and (old[n].fingerprint != fps[n] or not old[n].ok)]
+    removed = sorted(n for n in old if n not in fps)
+    report = ReindexReport(mode="incremental", added=added, updated=updated, removed=removed)
+
+    if not (added or updated or removed):
+        report.seconds = time.perf_counter() - t0
+        logger.info("🔁 update_index: nessun PDF cambiato (%.2fs)", report.seconds)
+        return idx, report
+
+    logger.info(
+        "🔁 update_index START | aggiunti=%s aggiornati=%s rimossi=%s",
+        added, updated, removed,
+    )
+    dropped = set(updated) | set(removed)
+    books, pages, text_pages, chars = idx.books, idx.pages, idx.text_pages, idx.chars
+    book_meta = {n: m for n, m in old.items() if n not in dropped}
+    for n in dropped:
+        m = old[n]
+        pages -= m.pages
+        text_pages -= m.text_pages
+        chars -= m.chars
+    books += len(added) - len(removed)
+
+    # Ricompone i chunk nello stesso ordine libro/pagina di un build_index completo:
+    # le pagine dei libri invariati vengono copiate byte per byte dal vecchio store
+    # (con i loro passaggi), quelle dei libri nuovi arrivano in streaming dall'estrazione.
+    old_store = idx.chunks
+    kept: Dict[str, List[int]] = {}
+    for cid in range(len(old_store)):
+        b = old_store.book_of(cid)
+        if b not in dropped:
+            kept.setdefault(b, []).append(cid)
+    reuse = idx.passages is not None and idx.terms is not None
+    old_pids = idx.passages.by_chunk() if reuse else {}
+    premap = [-1] * (len(idx.passages) if reuse else 0)
+
+    fresh_names = set(added) | set(updated)
+    fresh_sources = [p for n, p in on_disk.items() if n in fresh_names]
+    if job:
+        job.begin(fresh_sources)
+    fresh = _extract_books(fresh_sources, workers)
+    ib = _IndexBuilder(job)
     try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.get_event_loop()
+        for n in on_disk:
+            if n in fresh_names:
+                src, book_pages = next(fresh)
+                m = book_meta[n] = ib.add_book(src, book_pages, fps[n])
+                pages += m.pages
+                text_pages += m.text_pages
+                chars += m.chars
+                continue
+            for cid in kept.get(n, []):
+                if reuse:
+                    ib.copy_page(old_store, cid, idx.passages, old_pids.get(cid, []), premap)
+                else:
+                    ib.add_page(n, old_store.pages[cid], old_store.text(cid))
+    finally:
+        fresh.close()
+
+    chunks = ib.chunks.build()
+    passages = ib.passages
+    terms = idx.terms.patched(premap, ib.terms) if reuse else ib.terms.build()
+    result = Cf77Index(
+        books=books,
+        pages=pages,
+        text_pages=text_pages,
+        chars=chars,
+        chunks=chunks,
+        passages=passages,
+        terms=terms,
+        prefixes=ib.prefixes.build(),
+        book_meta=book_meta,
+    )
+    report.seconds = time.perf_counter() - t0
+    logger.info(
+        "✅ update_index DONE in %.2fs | books=%d pages=%d text_pages=%d chars=%d chunks=%d",
+        report.seconds, result.books, result.pages, result.text_pages, result.chars, len(result.chunks),
+    )
+    return result, report
+
+
+def _index_sections(idx: Cf77Index) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    meta = {
+        "books": idx.books,
+        "pages": idx.pages,
+        "text_pages": idx.text_pages,
+        "chars": idx.chars,
+        "book_names": idx.chunks.books,
+        "book_meta": {n: vars(m) for n, m in idx.book_meta.items()},
+        "passage_window": [PASSAGE_TOKENS, PASSAGE_STRIDE],
+    }
+    passages, terms = idx.passages, idx.terms
+    if passages is None or terms is None:
+        passages, terms = _passage_index(idx.chunks)
+    sections = dict(idx.chunks.sections())
+    sections.update(passages.sections())
+    sections.update(terms.sections())
+    prefixes = idx.prefixes if idx.prefixes is not None else PrefixIndex.from_store(idx.chunks)
+    sections.update(prefixes.sections())
+    return meta, sections
+
+
+def _index_from_file(f: index_cache.IndexFile) -> Cf77Index:
+    meta = f.meta
+    chunks = ChunkStore.from_sections(meta["book_names"], f.section)
+    return Cf77Index(
+        books=meta["books"],
+        pages=meta["pages"],
+        text_pages=meta["text_pages"],
+        chars=meta["chars"],
+        chunks=chunks,
+        passages=Passages.from_sections(f.section),
+        terms=TermIndex.from_sections(f.section),
+        prefixes=PrefixIndex.from_sections(f.section),
+        book_meta={n: BookMeta(**m) for n, m in meta["book_meta"].items()},
+    )
+
+
+def _open_snapshot(cache_path: Path, fps: List[Dict[str, Any]]) -> Optional[Cf77Index]:
+    t0 = time.perf_counter()
+    f = index_cache.load_snapshot(cache_path, fps)
+    if f is None:
+        return None
+    if f.meta.get("passage_window") != [PASSAGE_TOKENS, PASSAGE_STRIDE]:
+        logger.info("💾 snapshot indice con passaggi diversi da PASSAGE_TOKENS/STRIDE — lo ricostruisco")
+        return None
     try:
-        INDEX = await loop.run_in_executor(None, build_index, PDF_DIR)
-        return INDEX
+        idx = _index_from_file(f)
     except Exception:
-        logger.exception("❌ build_and_store_index fallita")
-        INDEX = Cf77Index(books=0, pages=0, text_pages=0, chars=0, chunks=[])
-        return INDEX
+        logger.exception("💾 snapshot indice corrotto — lo ricostruisco")
+        return None
+    logger.info(
+        "💾 indice mappato da snapshot in %.1f ms (%d bytes) | books=%d pages=%d chunks=%d",
+        (time.perf_counter() - t0) * 1000, f.nbytes, idx.books, idx.pages, len(idx.chunks),
+    )
+    return idx
+
+
+def _write_snapshot(cache_path: Path, fps: List[Dict[str, Any]], idx: Cf77Index) -> Cf77Index:
+    """Salva lo snapshot e ritorna l'indice riaperto dal file (memoria condivisa tra worker)."""
+    meta, sections = _index_sections(idx)
+    if not index_cache.save_snapshot(cache_path, fps, meta, sections):
+        return idx
+    mapped = _open_snapshot(cache_path, fps)
+    return mapped if mapped is not None else idx
+
+
+def load_or_build_index(
+    pdf_dir: Path,
+    cache_path: Optional[Path] = None,
+    force: bool = False,
+    ocr_dir: Optional[Path] = None,
+    job: Optional[ReindexJob] = None,
+) -> Cf77Index:
+    """
+    Apre lo snapshot su disco se i PDF non sono cambiati, altrimenti esegue
+    build_index() e salva un nuovo snapshot. force=True salta la lettura.
+    Con più processi, uno solo ricostruisce: gli altri aspettano il lock e
+    poi mappano il file appena scritto.
+    """
+    if cache_path is None:
+        return build_index(pdf_dir, ocr_dir=ocr_dir, job=job)
+
+    try:
+        fps = index_cache.fingerprints(list_sources(pdf_dir, ocr_dir))
+    except Exception:
+        logger.exception("❌ impossibile calcolare l'impronta dei PDF — niente snapshot")
+        return build_index(pdf_dir, ocr_dir=ocr_dir, job=job)
+
+    with index_cache.build_lock(cache_path):
+        if not force:
+            idx = _open_snapshot(cache_path, fps)
+            if idx is not None:
+                return idx
+
+        idx = build_index(pdf_dir, ocr_dir=ocr_dir, job=job, fingerprints={fp["name"]: fp for fp in fps})
+        if _snapshot_worthy(idx) and fps:
+            idx = _write_snapshot(cache_path, fps, idx)
+        return idx
+
+
+def _snapshot_worthy(idx: Cf77Index) -> bool:
+    # Libri falliti solo perché manca pypdf: non vanno congelati nello snapshot.
+    return bool(idx.book_meta) and (HAVE_PYPDF or all(m.ok for m in idx.book_meta.values()))
+
+
+def _save_index_snapshot(idx: Cf77Index) -> Cf77Index:
+    if not _snapshot_worthy(idx):
+        return idx
+    fps = [idx.book_meta[n].fingerprint for n in sorted(idx.book_meta)]
+    return _write_snapshot(INDEX_CACHE_PATH, fps, idx)
+
+
+# ─────────────────────────────────────────
+# Rebuild single-flight + swap atomico
+# ─────────────────────────────────────────
+# Un solo rebuild alla volta: chi arriva mentre è in corso un rebuild "almeno
+# altrettanto forte" ne attende il risultato invece di avviarne un altro.
+# Ogni rebuild è un ReindexJob: gli ultimi restano consultabili per id.
+_REBUILD_RANK = {"load": 0, "incremental": 1, "full": 2}
+_REBUILD_TASK: Optional["asyncio.Task[Tuple[Cf77Index, ReindexReport]]"] = None
+_REBUILD_JOB: Optional[ReindexJob] = None
+_INDEX_GENERATION = 0
+_JOBS_KEPT = 20
+_JOBS: Dict[str, ReindexJob] = {}
+_BACKGROUND: set = set()    # riferimenti ai task avviati con start_reindex()
+
+
+def _swap_index(idx: Cf77Index) -> Cf77Index:
+    """
+    Pubblica il nuovo indice con un'unica assegnazione di INDEX. Gli handler
+    leggono INDEX una volta sola all'inizio, quindi una query già partita
+    continua a usare la generazione precedente fino alla fine.
+    """
+    global INDEX, _INDEX_GENERATION
+    if idx is INDEX:
+        return idx
+    _INDEX_GENERATION += 1
+    idx.generation = _INDEX_GENERATION
+    INDEX = idx
+    logger.info("🔀 INDEX -> generazione %d (chunks=%d)", idx.generation, len(idx.chunks))
+    return idx
+
+
+def _rebuild(mode: str, current: Optional[Cf77Index], job: ReindexJob) -> Tuple[Cf77Index, ReindexReport]:
+    """Costruisce il nuovo indice "a lato" (nell'executor), senza toccare `current`."""
+    t0 = time.perf_counter()
+    if mode == "load":
+        idx = load_or_build_index(PDF_DIR, INDEX_CACHE_PATH, ocr_dir=OCR_DIR, job=job)
+        return idx, ReindexReport(mode="load", seconds=time.perf_counter() - t0)
+    if mode == "full" or current is None:
+        idx = build_index(PDF_DIR, ocr_dir=OCR_DIR, job=job)
+        report = ReindexReport(mode="full", added=sorted(idx.book_meta), seconds=time.perf_counter() - t0)
+    else:
+        idx, report = update_index(current, PDF_DIR, ocr_dir=OCR_DIR, job=job)
+    if idx is not current:
+        idx = _save_index_snapshot(idx)
+    return idx, report
+
+
+async def _rebuild_and_swap(mode: str, job: ReindexJob) -> Tuple[Cf77Index, ReindexReport]:
+    loop = asyncio.get_running_loop()
+    current = INDEX
+    job.start()
+    t0 = time.perf_counter()
+    try:
+        idx, report = await loop.run_in_executor(None, _rebuild, mode, current, job)
+    except Exception as e:
+        INDEX_BUILDS.inc(mode, "failed")
+        INDEX_BUILD_SECONDS.observe(time.perf_counter() - t0, mode)
+        logger.exception("❌ rebuild indice (%s) fallito — tengo l'indice corrente", mode)
+        if INDEX is None:
+            _swap_index(Cf77Index(books=0, pages=0, text_pages=0, chars=0, chunks=ChunkStore()))
+        report = ReindexReport(mode=mode)
+        job.finish(report, error=f"{type(e).__name__}: {e}")
+        return INDEX, report
+    INDEX_BUILDS.inc(mode, "ok")
+    INDEX_BUILD_SECONDS.observe(time.perf_counter() - t0, mode)
+    idx = _swap_index(idx)
+    job.finish(report)
+    return idx, report
+
+
+def _remember_job(job: ReindexJob) -> None:
+    _JOBS[job.id] = job
+    while len(_JOBS) > _JOBS_KEPT:
+        del _JOBS[next(iter(_JOBS))]
+
+
+def get_job(job_id: str) -> Optional[ReindexJob]:
+    return _JOBS.get(job_id)
+
+
+def latest_job() -> Optional[ReindexJob]:
+    """Il job in corso, altrimenti l'ultimo avviato."""
+    if _REBUILD_JOB is not None and _REBUILD_JOB.running:
+        return _REBUILD_JOB
+    return next(reversed(_JOBS.values()), None)
+
+
+async def _single_flight(mode: str, job: Optional[ReindexJob] = None) -> Tuple[Cf77Index, ReindexReport]:
+    global _REBUILD_TASK, _REBUILD_JOB
+    if job is None:
+        job = ReindexJob(mode=mode)
+        _remember_job(job)
+    while _REBUILD_TASK is not None and not _REBUILD_TASK.done():
+        task, running = _REBUILD_TASK, _REBUILD_JOB
+        if running is not None and _REBUILD_RANK[running.mode] >= _REBUILD_RANK[mode]:
+            logger.info("🔁 rebuild %s già in corso: attendo quello (richiesto: %s)", running.mode, mode)
+            job.finish(merged_into=running.id)
+            return await asyncio.shield(task)
+        # Rebuild in corso più "debole" di quello richiesto: aspetto che finisca e riparto.
+        await asyncio.wait({task})
+    _REBUILD_JOB = job
+    _REBUILD_TASK = asyncio.create_task(_rebuild_and_swap(mode, job))
+    # shield: se il chiamante viene cancellato (es. richiesta HTTP chiusa) il rebuild prosegue.
+    return await asyncio.shield(_REBUILD_TASK)
+
+
+def start_reindex(full: bool = False) -> ReindexJob:
+    """
+    Avvia un reindex in background e ritorna subito il job da seguire. Se è già
+    in corso un rebuild almeno altrettanto forte, ritorna quello.
+    """
+    mode = "full" if full else "incremental"
+    # Anche i job appena avviati e ancora in coda: due /reindex di fila = un solo rebuild.
+    for other in reversed(list(_JOBS.values())):
+        if other.running and _REBUILD_RANK[other.mode] >= _REBUILD_RANK[mode]:
+            return other
+    job = ReindexJob(mode=mode)
+    _remember_job(job)
+    task = asyncio.create_task(_single_flight(mode, job))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+    return job
+
+
+async def reindex_and_store(full: bool = False) -> Tuple[Cf77Index, ReindexReport]:
+    return await _single_flight("full" if full else "incremental")
+
+
+async def build_and_store_index(force: bool = False) -> Cf77Index:
+    idx, _ = await _single_flight("full" if force else "load")
+    return idx
 
 
 # ─────────────────────────────────────────
 # Search helpers
 # ─────────────────────────────────────────
-def search_index(question: str, idx: Cf77Index, top_k: int = 3) -> List[Tuple[PageChunk, int]]:
+def _query_terms(q: str) -> List[str]:
+    # Stessa pipeline delle pagine (analyzer.py): la domanda viene analizzata
+    # qui, le pagine una volta sola a build_index.
+    return analyze(q)
+
+
+# Frasi tra virgolette (dritte, tipografiche o caporali): "corpo astrale"
+_PHRASE_RE = re.compile(r'["“”«»„]([^"“”«»„]+)["“”«»„]')
+# Bonus di prossimità: k termini distinti in uno span minimo di `span` token
+# valgono PROXIMITY_BOOST * k² / span (k² / k = k per termini adiacenti).
+PROXIMITY_BOOST = 2.0
+
+# Ricerca fuzzy (errori OCR, refusi): ogni termine della domanda si espande ai
+# termini del vocabolario a distanza di edit 1..FUZZY_MAX_EDITS (0 = spenta),
+# pesati per distanza. Parole corte: 3-5 lettere al massimo 1 edit, <= 2 nessuno.
+FUZZY_MAX_EDITS = min(2, max(0, _env_int("FUZZY_MAX_EDITS", 2)))
+FUZZY_WEIGHTS = (1.0, 0.5, 0.25)
+# Se il termine esiste, le varianti ammesse sono solo quelle rare rispetto a lui
+# (df <= 10% del suo, o una sola occorrenza): tipico delle parole storpiate
+# dall'OCR, mentre parole vere vicine ("morte"/"forte") restano fuori.
+FUZZY_DF_RATIO = 0.1
+
+
+@dataclass
+class ParsedQuery:
+    terms: List[str]                        # tutti i termini, anche quelli delle frasi
+    phrases: List[List[Tuple[int, str]]]    # (offset dal primo termine, termine)
+
+
+def parse_query(q: str) -> ParsedQuery:
+    phrases = []
+    for m in _PHRASE_RE.finditer(q):
+        pos = analyze_positions(m.group(1))
+        if len(pos) > 1:  # una parola sola tra virgolette è un termine normale
+            phrases.append([(p - pos[0][0], t) for p, t in pos])
+    return ParsedQuery(terms=_query_terms(q), phrases=phrases)
+
+
+def _min_span(lists: List[Sequence[int]]) -> int:
+    """Lunghezza (in token) della finestra più corta con una posizione di ogni lista."""
+    heap = [(lst[0], i, 0) for i, lst in enumerate(lists)]
+    heapq.heapify(heap)
+    hi = max(lst[0] for lst in lists)
+    best = hi - heap[0][0] + 1
+    while True:
+        lo, i, k = heapq.heappop(heap)
+        best = min(best, hi - lo + 1)
+        if k + 1 == len(lists[i]):
+            return best
+        nxt = lists[i][k + 1]
+        hi = max(hi, nxt)
+        heapq.heappush(heap, (nxt, i, k + 1))
+
+
+def _has_phrase(phrase: List[Tuple[int, str]], positions: Dict[str, Sequence[int]]) -> bool:
+    if any(t not in positions for _, t in phrase):
+        return False
+    first_off, first = phrase[0]
+    rest = [(off - first_off, set(positions[t])) for off, t in phrase[1:]]
+    return any(all(p + d in ps for d, ps in rest) for p in positions[first])
+
+
+def _term_variants(terms: TermIndex, t: str) -> List[Tuple[int, int]]:
+    """(id, distanza) dei termini del vocabolario usati per `t`: prima quello esatto."""
+    tid = terms.lookup(t)
+    out = [(tid, 0)] if tid >= 0 else []
+    max_edits = 0 if len(t) <= 2 else 1 if len(t) <= 5 else 2
+    max_edits = min(max_edits, FUZZY_MAX_EDITS)
+    if max_edits:
+        limit = max(1, int(terms.df(tid) * FUZZY_DF_RATIO)) if tid >= 0 else None
+        out.extend((v, d) for v, d in terms.fuzzy(t, max_edits) if limit is None or terms.df(v) <= limit)
+    return out
+
+
+def score_passage(
+    pq: ParsedQuery, weights: Dict[str, int], found: Dict[str, List[Tuple[int, Sequence[int]]]],
+) -> float:
+    """
+    Punteggio di un passaggio. `found`: per ogni termine della domanda presente,
+    (distanza di edit, posizioni) delle sue varianti nel passaggio (distanza 0 =
+    termine esatto). Somma delle frequenze pesate per distanza + bonus di
+    prossimità; 0 se manca una frase obbligatoria (le frasi vogliono i termini esatti).
+    """
+    if pq.phrases:
+        exact = {t: ps for t, vs in found.items() for d, ps in vs if d == 0}
+        for ph in pq.phrases:
+            if not _has_phrase(ph, exact):
+                return 0.0
+    score = 0.0
+    for t, vs in found.items():
+        score += weights[t] * sum(FUZZY_WEIGHTS[d] * len(ps) for d, ps in vs)
+    if len(found) > 1:
+        k = len(found)
+        merged = [vs[0][1] if len(vs) == 1 else sorted(p for _, ps in vs for p in ps) for vs in found.values()]
+        # max(k, …): termini diversi sulla stessa posizione non superano l'adiacenza
+        score += PROXIMITY_BOOST * k * k / max(k, _min_span(merged))
+    return score
+
+
+def _scan_index(q: str, terms: List[str], idx: Cf77Index, top_k: int) -> List[Tuple[ChunkView, int]]:
+    # Fallback: domande fatte solo di stopword (o indice senza postings).
+    # Una sola scansione del buffer normalizzato, niente copie lower() per pagina.
+    scores = idx.chunks.count_norm(terms)
+    best = heapq.nlargest(top_k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+    return [(idx.chunks[cid], sc) for cid, sc in best]
+
+
+def _rank_passages(pq: ParsedQuery, idx: Cf77Index, top_k: int) -> List[Tuple[int, float]]:
+    """
+    (passaggio, punteggio) dei migliori passaggi, uno per pagina, ordinati per
+    punteggio e poi per id. Il punteggio completo (posizioni) viene calcolato
+    solo finché può ancora cambiare la classifica: il bonus di prossimità di un
+    passaggio con k termini della domanda non supera PROXIMITY_BOOST * k, quindi
+    quando la somma delle frequenze più quel massimo scende sotto il punteggio
+    della top_k-esima pagina ci si ferma. Senza frasi, un passaggio con un solo
+    termine vale esattamente la somma delle frequenze.
+    """
+    terms, chunk_of = idx.terms, idx.passages.chunk
+    weights: Dict[str, int] = {}
+    for t in pq.terms:
+        weights[t] = weights.get(t, 0) + 1
+    # termine della domanda -> [(distanza, a, z)] delle postings delle sue varianti
+    spans: Dict[str, List[Tuple[int, int, int]]] = {}
+    for t in weights:
+        vs = [(d, *terms.span(tid)) for tid, d in _term_variants(terms, t)]
+        if vs:
+            spans[t] = vs
+    phrase_terms = {t for ph in pq.phrases for _, t in ph}
+    if not spans or any(t not in spans or spans[t][0][0] != 0 for t in phrase_terms):
+        return []
+    ids, tfs = terms.ids, terms.tfs
+
+    # Frasi: prima si intersecano le liste di postings dei loro termini esatti
+    # (dalla più corta); solo i passaggi che li contengono tutti restano candidati.
+    allowed: Optional[set] = None
+    for t in sorted(phrase_terms, key=lambda t: spans[t][0][2] - spans[t][0][1]):
+        _, a, z = spans[t][0]
+        allowed = set(ids[a:z]) if allowed is None else allowed.intersection(ids[a:z])
+
+    exact = len(spans) == 1 and not pq.phrases
+    base: Dict[int, float] = {}
+    n_terms: Dict[int, int] = {}  # passaggio -> termini distinti della domanda presenti
+    for t, vs in spans.items():
+        seen: set = set()
+        for d, a, z in vs:
+            w = weights[t] * FUZZY_WEIGHTS[d]
+            for pid, tf in zip(ids[a:z], tfs[a:z]):
+                if allowed is None or pid in allowed:
+                    base[pid] = base.get(pid, 0.0) + w * tf
+                    seen.add(pid)
+        if not exact:
+            for pid in seen:
+                n_terms[pid] = n_terms.get(pid, 0) + 1
+
+    def full_score(pid: int) -> float:
+        found: Dict[str, List[Tuple[int, Sequence[int]]]] = {}
+        for t, vs in spans.items():
+            for d, a, z in vs:
+                j = bisect_left(ids, pid, a, z)
+                if j < z and ids[j] == pid:
+                    found.setdefault(t, []).append((d, terms.positions(j)))
+        return score_passage(pq, weights, found)
+
+    # (-limite superiore del punteggio, passaggio)
+    heap = [(-(sc + PROXIMITY_BOOST * n_terms.get(pid, 1) if n_terms.get(pid, 1) > 1 else sc), pid)
+            for pid, sc in base.items()]
+    heapq.heapify(heap)
+    best: Dict[int, Tuple[float, int]] = {}  # pagina -> (punteggio, -pid) del suo passaggio migliore
+    # Min-heap delle top_k pagine (punteggio, -pid, pagina): top[0] è la soglia da battere.
+    top: List[Tuple[float, int, int]] = []
+    while heap:
+        neg, pid = heap[0]
+        if len(top) >= top_k and -neg < top[0][0]:
+            break
+        heapq.heappop(heap)
+        sc = base[pid] if exact or (n_terms[pid] == 1 and not pq.phrases) else full_score(pid)
+        if sc <= 0:
+            continue
+        cid = chunk_of[pid]
+        cur = best.get(cid)
+        if cur is not None and (sc, -pid) <= cur:
+            continue
+        best[cid] = (sc, -pid)
+        entry = (sc, -pid, cid)
+        if cur is not None and (cur[0], cur[1], cid) in top:
+            # la pagina è già tra le migliori: si aggiorna il suo punteggio (top_k è piccolo)
+            top[top.index((cur[0], cur[1], cid))] = entry
+            heapq.heapify(top)
+        elif len(top) < top_k:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+    return [(-neg_pid, sc) for sc, neg_pid, _ in sorted(top, reverse=True)]
+
+
+def search_index(
+    question: str, idx: Cf77Index, top_k: int = 3,
+) -> List[Tuple[Union[PassageView, ChunkView], float]]:
     q = _clean_ws(question).lower()
     if not q or not idx.chunks:
         return []
-    terms = [t for t in re.findall(r"[a-zàèéìòù0-9']+", q, flags=re.IGNORECASE) if len(t) >= 4]
-    if not terms:
-        terms = [q]
-    scored = []
-    for ch in idx.chunks:
-        text_l = ch.text.lower()
-        score = sum(text_l.count(t) for t in terms)
-        if score > 0:
-            scored.append((score, ch))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [(ch, sc) for sc, ch in scored[:top_k]]
+    with SEARCH_SECONDS.time():
+        pq = parse_query(q)
+        if not pq.terms or idx.terms is None or idx.passages is None:
+            return _scan_index(q, pq.terms or [q], idx, top_k)
+        return [(PassageView(idx.chunks, idx.passages, pid), sc) for pid, sc in _rank_passages(pq, idx, top_k)]
 
 
 def snippet(text: str, terms: List[str], max_len: int = 420) -> str:
@@ -253,6 +1376,99 @@ def snippet(text: str, terms: List[str], max_len: int = 420) -> str:
     return s
 
 
+def _hit_excerpt(hit: Union[PassageView, ChunkView], terms: List[str]) -> str:
+    # Passaggio: già tagliato all'indicizzazione. Pagina intera (fallback): snippet.
+    return hit.excerpt() if isinstance(hit, PassageView) else snippet(hit.text, terms, max_len=420)
+
+
+def _render_block(hit: Union[PassageView, ChunkView], excerpt: str) -> str:
+    return (
+        f"<b>📖 {_escape_html(hit.book)}</b> — pag. <b>{hit.page}</b>\n"
+        f"{_escape_html(excerpt)}"
+    )
+
+
+def answer_blocks(question: str, idx: Cf77Index, top_k: int = 3, cache: QueryCache = QUERY_CACHE) -> List[str]:
+    """
+    Blocchi HTML (libro, pagina, snippet) della risposta a /ask, passando per
+    `cache` (QUERY_CACHE): la chiave è la domanda normalizzata, la generazione
+    dell'indice invalida le risposte calcolate su un indice precedente.
+    """
+    key = f"{top_k}|{_clean_ws(question).lower()}"
+    cached = cache.get(key, idx.generation)
+    if cached is not None:
+        return cached
+
+    terms = _query_terms(question)
+    hits = search_index(question, idx, top_k=top_k)
+    with RENDER_SECONDS.time():
+        blocks = [_render_block(hit, _hit_excerpt(hit, terms)) for hit, sc in hits]
+    cache.put(key, idx.generation, blocks)
+    return blocks
+
+
+# ─────────────────────────────────────────
+# Inline mode (@bot <testo>)
+# ─────────────────────────────────────────
+def inline_completions(query: str, idx: Cf77Index, n: int = 5) -> List[str]:
+    """
+    Domande da proporre mentre l'utente scrive: le parole già complete più i
+    completamenti più frequenti dell'ultima. Se l'ultima parola è chiusa da
+    uno spazio (o non ha completamenti) si propone la query così com'è.
+    """
+    q = _clean_ws(query)
+    if not q or idx.prefixes is None or query[-1:].isspace():
+        return [q] if q else []
+    head, _, last = q.rpartition(" ")
+    out = [f"{head} {w}".strip() for w, _ in idx.prefixes.complete(last, n)]
+    return out or [q]
+
+
+def _inline_article(rid: str, title: str, description: str, question: str, blocks: List[str]) -> InlineQueryResultArticle:
+    return InlineQueryResultArticle(
+        id=rid,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(
+            f"📌 <i>{_escape_html(question)}</i>\n\n" + "\n\n— — —\n\n".join(blocks),
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        ),
+    )
+
+
+def inline_results(query: str, idx: Cf77Index) -> List[InlineQueryResultArticle]:
+    """
+    Risultati inline: i passaggi migliori per il primo completamento, poi un
+    articolo "🔎" per ogni altro completamento (la risposta intera di /ask,
+    dalla cache inline). Ogni ricerca parte solo se si è ancora entro
+    INLINE_BUDGET_MS, perché Telegram scarta le risposte arrivate tardi.
+    """
+    deadline = time.perf_counter() + INLINE_BUDGET_MS / 1000
+    completions = inline_completions(query, idx)
+    if not completions or time.perf_counter() > deadline:
+        return []
+
+    best = completions[0]
+    terms = _query_terms(best)
+    results = []
+    for hit, _ in search_index(best, idx, top_k=3):
+        excerpt = _hit_excerpt(hit, terms)
+        kind = "p" if isinstance(hit, PassageView) else "c"
+        results.append(_inline_article(
+            f"{kind}{hit.id}", f"📖 {hit.book} — pag. {hit.page}", excerpt[:160],
+            best, [_render_block(hit, excerpt)],
+        ))
+
+    for i, c in enumerate(completions[1:], 1):
+        if time.perf_counter() > deadline:
+            break
+        blocks = answer_blocks(c, idx, cache=INLINE_QUERY_CACHE)
+        if blocks:
+            results.append(_inline_article(f"q{i}", f"🔎 {c}", f"{len(blocks)} passaggi", c, blocks))
+    return results
+
+
 # ─────────────────────────────────────────
 # Access control
 # ─────────────────────────────────────────
@@ -264,26 +1480,46 @@ def is_allowed_chat(update: Update) -> bool:
     return True
 
 
+async def check_rate(update: Update, command: str, notify: bool = True) -> bool:
+    """
+    True se la richiesta rientra nei limiti. Altrimenti False: l'utente riceve
+    un breve avviso (al massimo uno ogni tanto), le richieste successive si scartano.
+    """
+    user, chat = update.effective_user, update.effective_chat
+    uid = user.id if user else None
+    wait = RATE_LIMITER.check(command, uid, chat.id if chat else None)
+    if not wait:
+        return True
+    logger.info("🚦 /%s limitato per utente=%s chat=%s (attesa %.0fs)", command, uid, chat.id if chat else None, wait)
+    if notify and update.effective_message is not None and RATE_LIMITER.should_notify(uid):
+        when = f"tra {int(wait) + 1}s" if wait < 3600 else "più tardi"
+        await update.effective_message.reply_text(f"🚦 Piano, troppe richieste: riprova {when}.")
+    return False
+
+
 # ─────────────────────────────────────────
 # Command handlers
 # ─────────────────────────────────────────
+@_timed("help")
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "help"):
         return
     msg = (
         f"<b>{_escape_html(BOT_DISPLAY)}</b> 📚\n\n"
         "Comandi:\n"
         "• /status — stato bot + PDF\n"
         "• /sources — lista PDF\n"
-        "• /ask &lt;domanda&gt; — cerca nei testi\n"
+        "• /ask &lt;domanda&gt; — cerca nei testi (frase esatta tra virgolette: /ask \"corpo astrale\")\n"
         "• /quote — citazione casuale dai testi\n"
-        "• /reindex — ricostruisce l'indice (se hai cambiato PDF)\n"
+        "• /reindex — aggiorna l'indice coi PDF cambiati (/reindex full = da zero)\n"
+        "\nIn qualsiasi chat: scrivi @bot seguito da una parola per cercare al volo.\n"
     )
     await update.effective_message.reply_text(msg, parse_mode=ParseMode.HTML)
 
 
+@_timed("status")
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "status"):
         return
     idx = INDEX
     pdf_ok = idx is not None and idx.books > 0 and idx.pages > 0 and idx.text_pages > 0
@@ -292,7 +1528,8 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         f"{idx.books if idx else 0} libri / "
         f"{idx.pages if idx else 0} pagine / "
         f"testo:{idx.text_pages if idx else 0} / "
-        f"chars:{idx.chars if idx else 0}"
+        f"chars:{idx.chars if idx else 0} / "
+        f"gen:{idx.generation if idx else 0}"
     )
     msg = (
         "<b>📌 Status</b>\n"
@@ -301,33 +1538,82 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         f"• PDF: {pdf_line}\n"
         f"• pypdf: {'✅' if HAVE_PYPDF else '❌'}\n"
         f"• PDF_DIR: <code>{_escape_html(str(PDF_DIR))}</code>\n"
+        f"• OCR_DIR: <code>{_escape_html(str(OCR_DIR))}</code>\n"
     )
+    job = latest_job()
+    if job is not None and job.running:
+        msg += f"• 🔁 Reindex: {_escape_html(job.progress_line())}\n"
+    elif job is not None:
+        msg += f"• 🔁 Ultimo reindex: {job.id} ({job.mode}) {job.state} in {job.elapsed:.1f}s\n"
     await update.effective_message.reply_text(msg, parse_mode=ParseMode.HTML)
 
 
+@_timed("sources")
 async def cmd_sources(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "sources"):
         return
-    pdfs = list_pdfs(PDF_DIR)
-    if not pdfs:
+    sources = list_sources(PDF_DIR, OCR_DIR)
+    if not sources:
         await update.effective_message.reply_text("📚 Nessun PDF trovato in data/pdfs.")
         return
-    lines = ["📚 Libri caricati:"] + [f"• {p.name}" for p in pdfs]
+    lines = ["📚 Libri caricati:"] + [
+        f"• {book_name(p)}" + (" (testo OCR)" if _is_sidecar(p) else "") for p in sources
+    ]
     await update.effective_message.reply_text("\n".join(lines))
 
 
+@_timed("reindex")
 async def cmd_reindex(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "reindex"):
         return
-    await update.effective_message.reply_text("⏳ Ricostruisco l'indice…")
-    idx = await build_and_store_index()
-    await update.effective_message.reply_text(
-        f"✅ Indice pronto: {idx.books} libri / {idx.pages} pagine / testo:{idx.text_pages} / chars:{idx.chars}"
+    full = bool(context.args) and context.args[0].lower() in ("full", "tutto")
+    job = start_reindex(full=full)
+    head = "⏳ Ricostruisco l'indice da zero…" if full else "⏳ Aggiorno l'indice (solo PDF cambiati)…"
+    if job.mode != ("full" if full else "incremental"):
+        head = "⏳ Reindex già in corso, seguo quello…"
+    msg = await update.effective_message.reply_text(f"{head}\n{job.progress_line()}")
+    # Il messaggio viene aggiornato in background: l'handler ritorna subito.
+    context.application.create_task(_follow_reindex(msg, job, head))
+
+
+def _reindex_done_text(job: ReindexJob) -> str:
+    idx = INDEX
+    if job.state == "failed" or idx is None:
+        return f"❌ Reindex {job.id} fallito ({job.error or 'errore sconosciuto'}): tengo l'indice corrente."
+    text = (
+        f"✅ Indice pronto (gen {idx.generation}): {idx.books} libri / {idx.pages} pagine / "
+        f"testo:{idx.text_pages} / chars:{idx.chars}"
     )
+    if job.report is not None:
+        text += "\n" + job.report.summary()
+    return text
 
 
+async def _follow_reindex(msg: Any, job: ReindexJob, head: str) -> None:
+    """Modifica il messaggio di /reindex ogni REINDEX_PROGRESS_EVERY secondi fino alla fine del job."""
+    last = f"{head}\n{job.progress_line()}"
+    while True:
+        done = await job.wait(REINDEX_PROGRESS_EVERY)
+        while job.state == "merged" and get_job(job.merged_into) is not None:
+            job = get_job(job.merged_into)  # type: ignore[assignment]
+            done = not job.running
+        text = _reindex_done_text(job) if done else f"{head}\n{job.progress_line()}"
+        if text != last:
+            try:
+                await msg.edit_text(text)
+                last = text
+            except BadRequest as e:
+                # "message is not modified", messaggio cancellato…: si riprova al giro dopo.
+                logger.debug("✏️ edit avanzamento reindex fallito: %s", e)
+            except Exception:
+                logger.exception("✏️ edit avanzamento reindex fallito")
+        if done:
+            return
+
+
+@_timed("quote")
 async def cmd_quote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "quote"):
         return
     idx = INDEX
     if idx and idx.chunks:
@@ -340,8 +1626,9 @@ async def cmd_quote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text('📜 "Conosci te stesso." — (indice non pronto)')
 
 
+@_timed("ask")
 async def cmd_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_allowed_chat(update):
+    if not is_allowed_chat(update) or not await check_rate(update, "ask"):
         return
     idx = INDEX
     q = " ".join(context.args).strip() if context.args else ""
@@ -354,22 +1641,14 @@ async def cmd_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
-    terms = [t for t in re.findall(r"[a-zàèéìòù0-9']+", q, flags=re.IGNORECASE) if len(t) >= 4]
-    results = search_index(q, idx, top_k=3)
-    if not results:
+    blocks = answer_blocks(q, idx)
+    if not blocks:
         await update.effective_message.reply_text(
             "😤 Non ho trovato un passaggio chiaro.\n"
             "Prova con parole chiave più specifiche (es: “piano astrale”, “corpo astrale”, “trapasso”)."
         )
         return
 
-    blocks = []
-    for ch, sc in results:
-        sn = snippet(ch.text, terms, max_len=420)
-        blocks.append(
-            f"<b>📖 {_escape_html(ch.book)}</b> — pag. <b>{ch.page}</b>\n"
-            f"{_escape_html(sn)}"
-        )
     header = (
         f"Salve, <b>@{_escape_html(update.effective_user.username or 'utente')}</b>. "
         f"Hai chiamato il {_escape_html(BOT_DISPLAY)} 📚\n"
@@ -383,10 +1662,31 @@ async def cmd_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@_timed("inline")
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    iq = update.inline_query
+    # Oltre il limite la query resta senza risposta: Telegram la fa scadere da solo.
+    if iq is None or not await check_rate(update, "inline", notify=False):
+        return
+    idx = INDEX
+    q = iq.query or ""
+    results: List[InlineQueryResultArticle] = []
+    if len(q.strip()) >= INLINE_MIN_CHARS and idx and idx.chunks:
+        t0 = time.perf_counter()
+        results = inline_results(q, idx)
+        logger.debug("🔎 inline %r: %d risultati in %.1f ms", q, len(results), (time.perf_counter() - t0) * 1e3)
+    try:
+        await iq.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+    except BadRequest as e:
+        # L'utente ha già scritto altro: la query è scaduta, nessuno aspetta più la risposta.
+        logger.debug("🔎 inline %r non inviata: %s", q, e)
+
+
+@_timed("text")
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not is_allowed_chat(update):
         return
-    if update.effective_chat and update.effective_chat.type == "private":
+    if update.effective_chat and update.effective_chat.type == "private" and await check_rate(update, "text", notify=False):
         await update.effective_message.reply_text("Scrivi /help oppure usa /ask <domanda> 🙂")
 
 
@@ -402,16 +1702,36 @@ async def post_init(app: Application) -> None:
 # ─────────────────────────────────────────
 # Application factory
 # ─────────────────────────────────────────
+class _MeteredRequest(HTTPXRequest):
+    """HTTPXRequest che conta e cronometra ogni chiamata alla Bot API."""
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        api = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_REQUESTS.inc(api, type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - t0, api)
+        TELEGRAM_REQUESTS.inc(api, str(code))
+        return code, payload
+
+
 def build_application() -> Application:
     if not TELEGRAM_TOKEN:
         raise RuntimeError("TELEGRAM_TOKEN mancante nelle env vars")
 
-    app = (
+    builder = (
         ApplicationBuilder()
         .token(TELEGRAM_TOKEN)
+        .request(_MeteredRequest(connection_pool_size=256))
         .post_init(post_init)
-        .build()
     )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", cmd_help))
     app.add_handler(CommandHandler("help", cmd_help))
@@ -420,6 +1740,7 @@ def build_application() -> Application:
     app.add_handler(CommandHandler("reindex", cmd_reindex))
     app.add_handler(CommandHandler("quote", cmd_quote))
     app.add_handler(CommandHandler("ask", cmd_ask))
+    app.add_handler(InlineQueryHandler(on_inline_query))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     return app
 
@@ -6,19 +6,32 @@ Routes:
   GET  /             -> 200 ok
   GET  /health       -> 200 ok  (Render + UptimeRobot)
   HEAD /health       -> 200 ok
-  POST /telegram     -> Telegram webhook
-  GET  /debug/pdfs   -> lista PDF su disco (usa PDF_DIR da anacleto_bot)
-  GET  /debug/index  -> stato indice
-  GET/POST /debug/reindex -> forza rebuild indice
+  POST /telegram     -> Telegram webhook (scarta i duplicati per update_id, valida,
+                        mette in coda, risponde subito; 503 se la coda è piena)
+  GET  /debug/pdfs   -> lista PDF su disco + sorgenti indicizzate (PDF_DIR / OCR_DIR)
+  GET  /debug/index  -> stato indice (+ job di reindex in corso / ultimo)
+  GET/POST /debug/reindex -> avvia un reindex in background e ritorna il job
+                            (?full=1 = rebuild completo, ?wait=1 = attende la fine)
+  GET  /debug/reindex/{job_id} -> avanzamento di un job di reindex
+  GET  /metrics      -> metriche Prometheus (webhook, comandi, ricerca, Bot API, indice)
+  GET  /debug/profile -> profila i prossimi ?updates=N update o ?seconds=T secondi e ritorna
+                         il report (?mode=cprofile: pstats; ?mode=sample: stack collassati
+                         per flamegraph, ?format=top: funzioni più campionate). Solo con
+                         DEBUG_TOKEN impostato e passato nell'header X-Debug-Token.
 """
 from __future__ import annotations
 
 import os
+import hmac
+import json
 import logging
+import time
 from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional, Tuple
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.responses import Response as StarletteResponse
 
 from telegram import Update
@@ -26,12 +39,19 @@ from telegram import Update
 from anacleto_bot import (
     build_application,
     build_and_store_index,
+    start_reindex,
     list_pdfs,
+    list_sources,
+    book_name,
     BOT_DISPLAY,
     PDF_DIR,
     HAVE_PYPDF,
 )
 import anacleto_bot as _bot
+import metrics
+import profiler
+from update_dedup import RecentUpdateIds, peek_update_id
+from update_queue import UpdateQueue
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
@@ -40,8 +60,52 @@ LOG = logging.getLogger("ANACLETO_WEB")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
 WEBHOOK_URL = f"{PUBLIC_BASE_URL}{WEBHOOK_PATH}" if PUBLIC_BASE_URL else ""
+# Se impostato, Telegram lo manda in X-Telegram-Bot-Api-Secret-Token e gli
+# update senza (o con un valore diverso) vengono rifiutati.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+
+# Coda tra webhook e handler (update_queue.py): consumer concorrenti e
+# massimo di update in attesa prima di rispondere 503.
+UPDATE_WORKERS = _bot._env_int("UPDATE_WORKERS", 4)
+UPDATE_QUEUE_SIZE = _bot._env_int("UPDATE_QUEUE_SIZE", 256)
+
+# update_id già accettati (update_dedup.py). Con UPDATE_DEDUP_PATH vengono
+# salvati allo shutdown e ricaricati all'avvio. Il filtro è per processo.
+UPDATE_DEDUP_SIZE = _bot._env_int("UPDATE_DEDUP_SIZE", 4096)
+UPDATE_DEDUP_PATH = os.getenv("UPDATE_DEDUP_PATH", "").strip()
+_recent_ids = RecentUpdateIds(UPDATE_DEDUP_SIZE, Path(UPDATE_DEDUP_PATH) if UPDATE_DEDUP_PATH else None)
+
+# Token per /debug/profile: senza, l'endpoint non esiste (404).
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "").strip()
+PROFILE_MAX_SECONDS = _bot._env_int("PROFILE_MAX_SECONDS", 120)
 
 _application = None
+_updates: Optional[UpdateQueue] = None
+
+WEBHOOK_SECONDS = metrics.Histogram(
+    "anacleto_webhook_seconds", "Durata di POST al webhook (fino alla risposta a Telegram), per esito", ["outcome"],
+)
+
+
+def _queue_metric(name: str, help: str, attr: str, kind: str = "gauge") -> None:
+    metrics.Computed(name, help, lambda: getattr(_updates, attr) if _updates else None, kind=kind)
+
+
+_queue_metric("anacleto_update_queue_depth", "Update in attesa nella coda", "depth")
+_queue_metric("anacleto_update_queue_in_flight", "Update in lavorazione", "in_flight")
+_queue_metric("anacleto_updates_processed_total", "Update processati dalla coda", "processed", "counter")
+_queue_metric("anacleto_update_errors_total", "Update finiti con un'eccezione negli handler", "errors", "counter")
+metrics.Computed(
+    "anacleto_update_duplicates_total", "Ritentativi di Telegram scartati per update_id",
+    lambda: _recent_ids.duplicates, kind="counter",
+)
+
+
+async def _process_update(update: Update) -> None:
+    try:
+        await _application.process_update(update)
+    finally:
+        profiler.update_done()
 
 
 async def _set_webhook(app) -> bool:
@@ -49,7 +113,11 @@ async def _set_webhook(app) -> bool:
         LOG.warning("PUBLIC_BASE_URL non settata: webhook NON impostato.")
         return False
     try:
-        ok = await app.bot.set_webhook(url=WEBHOOK_URL, allowed_updates=Update.ALL_TYPES)
+        ok = await app.bot.set_webhook(
+            url=WEBHOOK_URL,
+            allowed_updates=Update.ALL_TYPES,
+            secret_token=WEBHOOK_SECRET or None,
+        )
         LOG.info("✅ webhook impostato: %s | ok=%s", WEBHOOK_URL, ok)
         return bool(ok)
     except Exception:
@@ -59,7 +127,7 @@ async def _set_webhook(app) -> bool:
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    global _application
+    global _application, _updates
 
     LOG.info("═" * 60)
     LOG.info("🚀 startup %s", BOT_DISPLAY)
@@ -71,6 +139,10 @@ async def lifespan(_: FastAPI):
     _application = build_application()
     await _application.initialize()
     await _application.start()
+    _updates = UpdateQueue(_process_update, maxsize=UPDATE_QUEUE_SIZE, workers=UPDATE_WORKERS)
+    _updates.start()
+    if _recent_ids.load():
+        LOG.info("📥 %d update_id recenti ricaricati da %s", len(_recent_ids), _recent_ids.path)
 
     # Safety net: se post_init non ha costruito INDEX, lo facciamo qui.
     if _bot.INDEX is None or _bot.INDEX.books == 0:
@@ -85,6 +157,9 @@ async def lifespan(_: FastAPI):
 
     LOG.info("🧯 shutdown…")
     try:
+        if _updates:
+            await _updates.stop()
+        _recent_ids.save()
         if _application:
             await _application.stop()
             await _application.shutdown()
@@ -112,16 +187,46 @@ async def health_head():
 
 @app.post(WEBHOOK_PATH)
 async def telegram_webhook(request: Request):
-    if _application is None:
-        return JSONResponse({"ok": False, "error": "bot not ready"}, status_code=503)
+    t0 = time.perf_counter()
+    outcome, response = await _accept_update(request)
+    WEBHOOK_SECONDS.observe(time.perf_counter() - t0, outcome)
+    return response
+
+
+async def _accept_update(request: Request) -> Tuple[str, object]:
+    if _application is None or _updates is None:
+        return "not_ready", JSONResponse({"ok": False, "error": "bot not ready"}, status_code=503)
+    if WEBHOOK_SECRET and not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), WEBHOOK_SECRET.encode(),
+    ):
+        return "forbidden", JSONResponse({"ok": False, "error": "forbidden"}, status_code=403)
+    body = await request.body()
+    update_id = peek_update_id(body)
+    if update_id is not None and update_id in _recent_ids:
+        # Ritentativo di Telegram di un update già in coda o già processato: 200 e basta.
+        _recent_ids.duplicates += 1
+        LOG.info("♻️ update %d duplicato scartato", update_id)
+        return "duplicate", {"ok": True, "duplicate": True}
     try:
-        data = await request.json()
-        update = Update.de_json(data, _application.bot)
-        await _application.process_update(update)
-        return {"ok": True}
+        update = Update.de_json(json.loads(body), _application.bot)
     except Exception:
-        LOG.exception("Errore process_update")
-        return JSONResponse({"ok": False, "error": "internal error"}, status_code=500)
+        LOG.warning("⚠ update non valido scartato")
+        update = None
+    if update is None:
+        return "bad_update", JSONResponse({"ok": False, "error": "bad update"}, status_code=400)
+    # Niente process_update qui: lo fanno i consumer della coda, la risposta è immediata.
+    if not _updates.offer(update):
+        LOG.warning("⚠ coda update piena (%d): 503 a Telegram, riproverà", _updates.depth)
+        return "queue_full", JSONResponse(
+            {"ok": False, "error": "queue full"}, status_code=503, headers={"Retry-After": "1"},
+        )
+    _recent_ids.add(update.update_id)
+    return "queued", {"ok": True}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return StarletteResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/debug/pdfs")
@@ -144,12 +249,15 @@ async def debug_pdfs():
         "pdf_dir_exists": PDF_DIR.exists(),
         "count": len(files),
         "files": files,
+        "ocr_dir": str(_bot.OCR_DIR),
+        "sources": [{"book": book_name(p), "file": p.name} for p in list_sources(PDF_DIR, _bot.OCR_DIR)],
     }
 
 
 @app.get("/debug/index")
 async def debug_index():
     idx = _bot.INDEX
+    job = _bot.latest_job()
     return {
         "PDF_DIR": str(_bot.PDF_DIR),
         "have_pypdf": HAVE_PYPDF,
@@ -159,16 +267,87 @@ async def debug_index():
         "text_pages": idx.text_pages if idx else 0,
         "chars": idx.chars if idx else 0,
         "chunks": len(idx.chunks) if idx else 0,
+        "generation": idx.generation if idx else 0,
+        "index_cache": str(_bot.INDEX_CACHE_PATH),
+        "index_cache_exists": _bot.INDEX_CACHE_PATH.exists(),
+        "query_cache": _bot.QUERY_CACHE.stats(),
+        "inline_cache": _bot.INLINE_QUERY_CACHE.stats(),
+        "rate_limit": _bot.RATE_LIMITER.stats(),
+        "update_queue": _updates.stats() if _updates else None,
+        "update_dedup": _recent_ids.stats(),
+        "reindex": job.as_dict() if job else None,
+    }
+
+
+async def _reindex(full: bool, wait: bool):
+    job = start_reindex(full=full)
+    if wait:
+        await job.wait()
+        while job.state == "merged" and _bot.get_job(job.merged_into):
+            job = _bot.get_job(job.merged_into)
+            await job.wait()
+    idx = _bot.INDEX
+    return {
+        "ok": job.state != "failed",
+        "job": job.as_dict(),
+        "status_url": f"/debug/reindex/{job.id}",
+        "generation": idx.generation if idx else 0,
     }
 
 
 @app.post("/debug/reindex")
-async def reindex_post():
-    idx = await build_and_store_index()
-    return {"ok": True, "books": idx.books, "pages": idx.pages, "text_pages": idx.text_pages, "chars": idx.chars, "chunks": len(idx.chunks)}
+async def reindex_post(full: bool = False, wait: bool = False):
+    return await _reindex(full, wait)
 
 
 @app.get("/debug/reindex")
-async def reindex_get():
-    idx = await build_and_store_index()
-    return {"ok": True, "books": idx.books, "pages": idx.pages, "text_pages": idx.text_pages, "chars": idx.chars, "chunks": len(idx.chunks)}
+async def reindex_get(full: bool = False, wait: bool = False):
+    return await _reindex(full, wait)
+
+
+@app.get("/debug/reindex/{job_id}")
+async def reindex_job(job_id: str):
+    job = _bot.get_job(job_id)
+    if job is None:
+        return JSONResponse({"ok": False, "error": "job sconosciuto"}, status_code=404)
+    return {"ok": True, "job": job.as_dict()}
+
+
+@app.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    mode: str = "cprofile",
+    seconds: float = 10.0,
+    updates: int = 0,
+    interval_ms: float = 5.0,
+    format: str = "collapsed",
+    sort: str = "cumulative",
+    limit: int = 50,
+    idle: bool = False,
+):
+    if not DEBUG_TOKEN:
+        return JSONResponse({"ok": False, "error": "not found"}, status_code=404)
+    if not hmac.compare_digest(request.headers.get("X-Debug-Token", "").encode(), DEBUG_TOKEN.encode()):
+        return JSONResponse({"ok": False, "error": "forbidden"}, status_code=403)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or updates < 0 or not 0.5 <= interval_ms <= 1000:
+        return JSONResponse(
+            {"ok": False, "error": f"seconds in (0, {PROFILE_MAX_SECONDS}], updates >= 0, interval_ms in [0.5, 1000]"},
+            status_code=400,
+        )
+    if sort not in profiler.SORT_KEYS or format not in profiler.FORMATS:
+        return JSONResponse(
+            {"ok": False, "error": f"sort tra {', '.join(profiler.SORT_KEYS)}; format tra {', '.join(profiler.FORMATS)}"},
+            status_code=400,
+        )
+    try:
+        session = profiler.ProfileSession(mode, seconds, updates, interval_ms / 1000, include_idle=idle)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+    LOG.warning("🔬 profiling %s: %.0fs / %s update", mode, seconds, updates or "∞")
+    try:
+        await session.run()
+    except profiler.ProfileBusy as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=409)
+    report = session.report(format, sort, max(1, limit))
+    LOG.warning("🔬 profiling finito: %.1fs, %d update", session.elapsed, session.updates_seen)
+    return PlainTextResponse(report)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — analizzatore italiano condiviso da /ask e da CF77Rag.
+
+Pipeline (uguale per le pagine indicizzate e per le domande):
+  1. token     : run di lettere/cifre e apostrofi
+  2. normalize : minuscolo, apostrofi tipografici (’ ‘ ` ´) -> '
+  3. elisioni  : "dell'anima" -> dell + anima, "perche'" -> perche
+  4. folding   : accenti rimossi (verità -> verita, perché -> perche)
+  5. stopword  : articoli, preposizioni, pronomi, ausiliari…
+  6. stemming  : stemmer "light" di Savoy (lo stesso di Lucene
+                 ItalianLightStemmer): toglie solo le desinenze di genere e
+                 numero, solo sulle parole di almeno 6 lettere.
+
+I passi 2-6 dipendono solo dal token, quindi sono memoizzati: su un testo
+reale la stragrande maggioranza dei token è già in cache e l'analisi costa
+una regex più un lookup per token (niente lower()/translate sull'intera pagina).
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+from typing import List, Tuple
+
+# Abbastanza per il vocabolario dell'intero corpus (qualche decina di migliaia
+# di forme) più le domande.
+TOKEN_CACHE_SIZE = 262_144
+MIN_TOKEN_LEN = 2
+
+TOKEN_RE = re.compile(r"[^\W_]+(?:['’‘`´ʼ][^\W_]*)*")
+_APOSTROPHES = str.maketrans({"’": "'", "‘": "'", "`": "'", "´": "'", "ʼ": "'"})
+
+# Forme elise ("l'", "dell'", "quest'"…): solo la parte dopo l'apostrofo conta.
+ELISIONS = frozenset("""
+    l d c s m t v n un all dall dell nell sull coll quell quest bell sant tutt
+    senz anch com dov ch
+""".split())
+
+# Lista snowball italiana ridotta alle forme senza accento (lo stopword filter
+# gira dopo il folding) più qualche forma colloquiale frequente negli OCR.
+STOPWORDS = frozenset("""
+    ad al allo ai agli all agl alla alle con col coi da dal dallo dai dagli dall
+    dagl dalla dalle di del dello dei degli dell degl della delle in nel nello
+    nei negli nell negl nella nelle su sul sullo sui sugli sull sugl sulla sulle
+    per tra fra contro io tu lui lei noi voi loro mio mia miei mie tuo tua tuoi
+    tue suo sua suoi sue nostro nostra nostri nostre vostro vostra vostri vostre
+    mi ti ci ce vi ve si se lo la li le gli ne il un uno una ma ed se perche
+    anche come dov dove che chi cui non piu quale quanto quanti quanta quante
+    quello quelli quella quelle questo questi questa queste si tutto tutti
+    tutta tutte a c e i l o ho hai ha abbiamo avete hanno abbia abbiate abbiano
+    avro avrai avra avremo avrete avranno avrei avresti avrebbe avremmo avreste
+    avrebbero avevo avevi aveva avevamo avevate avevano ebbi avesti ebbe
+    avemmo aveste ebbero avessi avesse avessimo avessero avendo avuto avuta
+    avuti avute sono sei siamo siete sia siate siano saro sarai sara saremo
+    sarete saranno sarei saresti sarebbe saremmo sareste sarebbero ero eri era
+    eravamo eravate erano fui fosti fu fummo foste furono fossi fosse fossimo
+    fossero essendo faccio fai facciamo fanno faccia facciate facciano faro
+    farai fara faremo farete faranno farei faresti farebbe faremmo fareste
+    farebbero facevo facevi faceva facevamo facevate facevano feci facesti
+    fece facemmo faceste fecero facessi facesse facessimo facessero facendo
+    sto stai sta stiamo stanno stia stiate stiano staro starai stara staremo
+    starete staranno starei staresti starebbe staremmo stareste starebbero
+    stavo stavi stava stavamo stavate stavano stetti stesti stette stemmo
+    steste stettero stessi stesse stessimo stessero stando essere avere
+    cosi gia poi pero ancora allora sempre molto molti molta molte poco
+    proprio solo quindi oppure ossia cioe ecc pag
+""".split())
+
+
+def normalize(text: str) -> str:
+    return text.lower().translate(_APOSTROPHES)
+
+
+def fold(word: str) -> str:
+    """Toglie gli accenti (e ogni altro segno diacritico)."""
+    if word.isascii():
+        return word
+    decomposed = unicodedata.normalize("NFD", word)
+    return unicodedata.normalize("NFC", "".join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def stem(word: str) -> str:
+    """Stemmer light di Savoy per l'italiano (parola già in minuscolo e senza accenti)."""
+    n = len(word)
+    if n < 6:
+        return word
+    last, prev = word[-1], word[-2]
+    if last == "e":
+        return word[:-2] if prev in "ih" else word[:-1]
+    if last == "i":
+        return word[:-2] if prev in "hi" else word[:-1]
+    if last in "ao":
+        return word[:-2] if prev == "i" else word[:-1]
+    return word
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def token_words(token: str) -> Tuple[str, ...]:
+    """Parole di un token grezzo dopo i passi 2-5 (senza stemming): quelle da suggerire."""
+    parts = normalize(token).split("'")
+    out = []
+    last = len(parts) - 1
+    for i, part in enumerate(parts):
+        if not part:
+            continue
+        word = fold(part)
+        if i < last and word in ELISIONS:
+            continue
+        if len(word) < MIN_TOKEN_LEN or word in STOPWORDS:
+            continue
+        out.append(word)
+    return tuple(out)
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def analyze_token(token: str) -> Tuple[str, ...]:
+    """Termini indicizzabili di un singolo token grezzo."""
+    return tuple(stem(w) for w in token_words(token))
+
+
+def analyze(text: str) -> List[str]:
+    return list(chain.from_iterable(map(analyze_token, TOKEN_RE.findall(text))))
+
+
+def analyze_positions(text: str) -> List[Tuple[int, str]]:
+    """(posizione, termine): la posizione è l'indice del token grezzo, quindi anche
+    stopword ed elisioni scartate "occupano" il loro posto (frasi e prossimità)."""
+    return [(i, t) for i, tok in enumerate(TOKEN_RE.findall(text)) for t in analyze_token(tok)]
+
+
+def words(text: str) -> List[str]:
+    return list(chain.from_iterable(map(token_words, TOKEN_RE.findall(text))))
+
+
+def cache_info():
+    return analyze_token.cache_info()
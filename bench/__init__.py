@@ -0,0 +1 @@
+"""Script di benchmark per MAESTRO ANACLETO (non usati a runtime)."""
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark di analyzer.py: token al secondo sulle pagine dei sidecar OCR.
+
+Confronta i due vecchi tokenizer (regex di /ask e di rag_cf77) con l'analisi
+completa a cache vuota e a cache calda. Uso:
+
+    python -m bench.analyzer [--repeat 3]
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import analyzer
+import anacleto_bot as bot
+
+_ASK_RE = re.compile(r"[a-zàèéìòù0-9']+", flags=re.IGNORECASE)
+_RAG_RE = re.compile(r"[^\wàèéìòù]+", flags=re.UNICODE)
+
+
+def old_ask_tokens(text: str) -> List[str]:
+    return [t for t in _ASK_RE.findall(text.lower()) if len(t) >= 4]
+
+
+def old_rag_tokens(text: str) -> List[str]:
+    return [t for t in _RAG_RE.sub(" ", text.lower()).split() if len(t) > 1]
+
+
+def load_pages() -> List[str]:
+    ocr_dir = bot.BASE_DIR / "data" / "pdfs_ocr"
+    pages: List[str] = []
+    for path in bot.list_sources(Path("/nonexistent"), ocr_dir):
+        pages.extend(bot._split_sidecar_pages(path.read_text(encoding="utf-8")))
+    return pages
+
+
+def _run(name: str, fn: Callable[[str], List[str]], pages: List[str], raw_tokens: int, repeat: int,
+         cold: bool = False) -> None:
+    best = float("inf")
+    out = 0
+    for _ in range(repeat):
+        if cold:
+            analyzer.analyze_token.cache_clear()
+        t0 = time.perf_counter()
+        out = sum(len(fn(p)) for p in pages)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{name:<22} {best * 1e3:8.1f} ms | {raw_tokens / best / 1e6:5.2f} M token/s | {out} termini")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pages = load_pages()
+    raw_tokens = sum(len(analyzer.TOKEN_RE.findall(p)) for p in pages)
+    print(f"{len(pages)} pagine / {sum(map(len, pages))} chars / {raw_tokens} token grezzi")
+
+    _run("vecchio /ask (regex)", old_ask_tokens, pages, raw_tokens, args.repeat)
+    _run("vecchio rag (regex)", old_rag_tokens, pages, raw_tokens, args.repeat)
+    _run("analyze, cache vuota", analyzer.analyze, pages, raw_tokens, args.repeat, cold=True)
+    _run("analyze, cache calda", analyzer.analyze, pages, raw_tokens, args.repeat)
+    info = analyzer.cache_info()
+    print(f"cache token: {info.currsize} forme, hit {info.hits} / miss {info.misses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Corpus sintetico per i test di scala: N libri di testo finto in italiano,
+come PDF (letti con pypdf, come i libri veri) o come sidecar OCR
+<libro>_clean.txt con le pagine separate da form-feed.
+
+Il vocabolario è fatto di parole vere (parole funzionali, lessico comune e
+del CF77) seguite da parole inventate; le frequenze seguono una legge di Zipf,
+quindi più libri portano anche parole nuove (coda lunga) come succede in una
+biblioteca vera. Ogni libro ha il suo seme: testi
+diversi, vocabolario condiviso. Uso:
+
+    python -m bench.corpus OUT_DIR [--books 50] [--pages 200] [--words 350] [--format txt|pdf]
+
+I PDF vanno in OUT_DIR/pdfs, i sidecar in OUT_DIR/pdfs_ocr.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from itertools import accumulate
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+FUNCTION_WORDS = """
+di e il la che a in un per non è una si con da le del i della gli al lo come
+ma più ci anche se sono nel alla questo ha ne o cui quando dei nella tutto
+essere delle perché così poi noi voi loro io tu lui lei suo sua mio quello
+""".split()
+
+WORDS = """
+anima spirito corpo astrale piano mentale coscienza evoluzione incarnazione
+reincarnazione karma maestro entità sentire amore dolore comprensione realtà
+illusione tempo spazio materia energia vibrazione percezione individualità
+esperienza insegnamento verità assoluto divenire essere cerchio fratelli vita
+morte trapasso sogno ricordo desiderio volontà libertà scelta legge causa
+effetto armonia equilibrio ricerca domanda risposta parola silenzio luce
+uomo donna figlio padre madre mondo terra cielo natura storia giorno notte
+anno momento modo cosa parte mano occhio cuore mente pensiero idea senso
+fede religione dio creatura umanità società famiglia lavoro pace guerra
+dire fare vedere sapere potere volere dovere venire andare capire pensare
+credere vivere morire nascere conoscere imparare insegnare amare soffrire
+cercare trovare diventare rimanere sentirsi accettare comprendere spiegare
+grande piccolo nuovo vecchio vero falso giusto buono cattivo profondo alto
+interiore esteriore fisico divino umano eterno infinito limitato relativo
+""".split()
+
+SYLLABLES = "ra ma ni to se lu ve ca di no pe sti gre fo la mi co ri ta ne".split()
+# Quota dei token che sono parole funzionali (articoli, preposizioni…): circa
+# metà delle parole di un testo italiano, scartate da analyze come stopword.
+FUNCTION_SHARE = 0.45
+
+
+class Vocabulary:
+    """
+    Parole funzionali (FUNCTION_SHARE dei token, Zipf tra di loro) e parole piene
+    con frequenze Zipf-Mandelbrot 1/(rango + offset)^exponent. Parametri tarati
+    sui sidecar CF77: le parole distinte (dopo analyze) crescono col numero di
+    token come nel corpus vero (legge di Heaps), ~3k su 10k token, ~19k su 300k.
+    """
+
+    def __init__(self, size: int = 400_000, exponent: float = 1.7, offset: float = 150, seed: int = 77):
+        rng = random.Random(seed)
+        self.function = list(dict.fromkeys(FUNCTION_WORDS))
+        real = [w for w in dict.fromkeys(WORDS) if w not in set(self.function)]
+        taken = set(real) | set(self.function)
+        invented: List[str] = []
+        while len(real) + len(invented) < size:
+            w = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 5)))
+            if w not in taken:
+                taken.add(w)
+                invented.append(w)
+        self.words = real + invented
+        self.cum = list(accumulate(1 / (rank + offset) ** exponent for rank in range(len(self.words))))
+        self.function_cum = list(accumulate(1 / (rank + 1) for rank in range(len(self.function))))
+
+    def sample(self, rng: random.Random, k: int) -> List[str]:
+        n_function = sum(rng.random() < FUNCTION_SHARE for _ in range(k))
+        out = rng.choices(self.function, cum_weights=self.function_cum, k=n_function)
+        out += rng.choices(self.words, cum_weights=self.cum, k=k - n_function)
+        rng.shuffle(out)
+        return out
+
+
+def page_text(rng: random.Random, vocab: Vocabulary, words: int) -> str:
+    """Una pagina: frasi di 6-24 parole con maiuscola e punto, paragrafi di 3-7 frasi."""
+    tokens = vocab.sample(rng, words)
+    paragraphs: List[str] = []
+    sentences: List[str] = []
+    i = 0
+    while i < len(tokens):
+        n = rng.randint(6, 24)
+        s = " ".join(tokens[i:i + n])
+        i += n
+        sentences.append(s[:1].upper() + s[1:] + rng.choice("....?;"))
+        if len(sentences) >= rng.randint(3, 7) or i >= len(tokens):
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+    return "\n\n".join(paragraphs)
+
+
+def _wrap(text: str, width: int = 90) -> List[str]:
+    lines: List[str] = []
+    for para in text.split("\n\n"):
+        line = ""
+        for w in para.split():
+            if line and len(line) + 1 + len(w) > width:
+                lines.append(line)
+                line = w
+            else:
+                line = f"{line} {w}" if line else w
+        lines.append(line)
+        lines.append("")
+    return lines[:-1]
+
+
+def write_sidecar(path: Path, pages: int, words: int = 350, seed: int = 77, vocab: Optional[Vocabulary] = None) -> int:
+    """Sidecar OCR (pagine separate da form-feed) scritto pagina per pagina; ritorna i caratteri."""
+    rng = random.Random(seed)
+    vocab = vocab or Vocabulary()
+    chars = 0
+    with path.open("w", encoding="utf-8") as f:
+        for i in range(pages):
+            text = page_text(rng, vocab, words)
+            f.write(("\f" if i else "") + text)
+            chars += len(text)
+    return chars
+
+
+def _pdf_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: int, seed: int = 77, words: int = 480, vocab: Optional[Vocabulary] = None) -> int:
+    """PDF minimo (Helvetica, un content stream per pagina) scritto pagina per pagina; ritorna i caratteri."""
+    rng = random.Random(seed)
+    vocab = vocab or Vocabulary()
+    chars = 0
+    offsets: List[int] = []
+    first_page = 4
+    with path.open("wb") as f:
+        def obj(num: int, body: bytes) -> None:
+            while len(offsets) < num:
+                offsets.append(0)
+            offsets[num - 1] = f.tell()
+            f.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        for i in range(pages):
+            lines = _wrap(page_text(rng, vocab, words))
+            chars += sum(len(line) + 1 for line in lines)
+            text = " Tj T* ".join(f"({_pdf_escape(line)})" for line in lines)
+            stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} Tj ET".encode("cp1252")
+            page_num, content_num = first_page + 2 * i, first_page + 2 * i + 1
+            obj(page_num, (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_num
+            ))
+            obj(content_num, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids = b" ".join(b"%d 0 R" % (first_page + 2 * i) for i in range(pages))
+        obj(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages)
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        for off in offsets:
+            f.write(b"%010d 00000 n \n" % off)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+    return chars
+
+
+def generate(
+    out_dir: Path, books: int, pages: int, words: int = 350, fmt: str = "txt", seed: int = 77,
+    vocab: Optional[Vocabulary] = None,
+) -> Tuple[Path, Path, int]:
+    """Scrive il corpus; ritorna (cartella PDF, cartella sidecar, caratteri totali)."""
+    pdf_dir, ocr_dir = out_dir / "pdfs", out_dir / "pdfs_ocr"
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    ocr_dir.mkdir(parents=True, exist_ok=True)
+    vocab = vocab or Vocabulary(seed=seed)
+    chars = 0
+    for b in range(books):
+        name = f"sintetico{b:04d}"
+        if fmt == "pdf":
+            chars += write_pdf(pdf_dir / f"{name}.pdf", pages, seed + b, words, vocab)
+        else:
+            chars += write_sidecar(ocr_dir / f"{name}_clean.txt", pages, words, seed + b, vocab)
+    return pdf_dir, ocr_dir, chars
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out_dir", type=Path)
+    ap.add_argument("--books", type=int, default=50)
+    ap.add_argument("--pages", type=int, default=200, help="pagine per libro")
+    ap.add_argument("--words", type=int, default=350, help="parole per pagina")
+    ap.add_argument("--format", choices=("txt", "pdf"), default="txt")
+    ap.add_argument("--seed", type=int, default=77)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    pdf_dir, ocr_dir, chars = generate(args.out_dir, args.books, args.pages, args.words, args.format, args.seed)
+    print(f"{args.books} libri x {args.pages} pagine ({chars / 1024 / 1024:.1f} MB di testo) "
+          f"in {pdf_dir if args.format == 'pdf' else ocr_dir} | {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Memoria di build_index su un PDF sintetico grande: l'estrazione è in streaming,
+quindi il picco deve crescere con l'indice, non con il testo estratto.
+
+Genera (in una cartella temporanea, con bench.corpus) PDF di N pagine di testo
+finto, poi misura con tracemalloc il picco durante build_index e quanto resta
+allocato alla fine. La differenza ("extra build") è la memoria di passaggio del
+build: deve restare quasi la stessa al crescere delle pagine. Se tra la misura
+più piccola e la più grande cresce più di --tolerance-mb lo script esce con
+codice 1 (come bench.suite). Un po' di crescita è attesa: pypdf carica
+l'albero delle pagine di tutto il PDF (~3 KB a pagina) a ogni PdfReader.
+Con --workers > 1 i blocchi arrivano dal pool (la memoria dei processi figli
+non è contata da tracemalloc).
+
+Controlla anche che il ChunkStore colonnare, costruito con lo stesso builder
+di build_index, non occupi più di List[PageChunk] sulle pagine OCR vere
+(bench.memory): oltre --max-store-ratio esce con codice 1. Il testo finto è
+tutto ASCII e non serve per questo confronto. Uso:
+
+    python -m bench.extract [--pages 300,1200] [--workers 1] [--tolerance-mb 4] [--max-store-ratio 1.0]
+"""
+from __future__ import annotations
+
+import argparse
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict
+
+import anacleto_bot as bot
+
+from bench import memory
+from bench.corpus import write_pdf
+
+MB = 1024 * 1024
+
+
+def measure(pages: int, workers: int) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_dir = Path(tmp)
+        chars = write_pdf(pdf_dir / "sintetico.pdf", pages)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        idx = bot.build_index(pdf_dir, workers=workers)
+        seconds = time.perf_counter() - t0
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(
+        f"{pages:>6} pag | testo {chars / MB:6.1f} MB | indice {current / MB:6.1f} MB | "
+        f"picco {peak / MB:6.1f} MB | extra build {(peak - current) / MB:5.1f} MB | "
+        f"{seconds:6.1f} s | chunks={len(idx.chunks)} passaggi={len(idx.passages or [])}"
+    )
+    return {"pages": pages, "text_mb": chars / MB, "index_mb": current / MB, "extra_mb": (peak - current) / MB}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", default="300,1200", help="dimensioni da provare, separate da virgola")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--tolerance-mb", type=float, default=4.0,
+                    help="crescita massima dell'extra build tra la misura più piccola e la più grande")
+    ap.add_argument("--max-store-ratio", type=float, default=1.0,
+                    help="rapporto massimo ChunkStore / List[PageChunk] sulle pagine OCR")
+    args = ap.parse_args()
+
+    if not bot.HAVE_PYPDF:
+        raise SystemExit("pypdf non disponibile")
+    runs = [measure(n, args.workers) for n in sorted(int(x) for x in args.pages.split(","))]
+    print(f"ru_maxrss processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    failed = False
+    small, large = runs[0], runs[-1]
+    if small is not large:
+        growth = large["extra_mb"] - small["extra_mb"]
+        text = large["text_mb"] - small["text_mb"]
+        print(f"extra build {small['pages']} -> {large['pages']} pag: {growth:+.1f} MB "
+              f"(testo {text:+.1f} MB, tolleranza {args.tolerance_mb:.1f} MB)")
+        if growth > args.tolerance_mb:
+            print("❌ la memoria di passaggio cresce con le pagine: l'estrazione non è più in streaming")
+            failed = True
+        else:
+            print("✅ memoria di passaggio limitata")
+
+    n, legacy_bytes, store_bytes, _ = memory.compare(memory._pages)
+    if not n:
+        print("⚠️ nessun sidecar OCR: confronto ChunkStore / List[PageChunk] saltato")
+    else:
+        ratio = store_bytes / legacy_bytes
+        print(f"ChunkStore {store_bytes / MB:.2f} MB / List[PageChunk] {legacy_bytes / MB:.2f} MB "
+              f"su {n} pagine OCR: {ratio:.2f}x (massimo {args.max_store_ratio:.2f}x)")
+        if ratio > args.max_store_ratio:
+            print("❌ lo store colonnare occupa più della lista di pagine")
+            failed = True
+        else:
+            print("✅ store colonnare compatto")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Load test del webhook: quanti update al secondo regge anacleto_web prima che
+la latenza esploda. Tutto in locale, senza rete.
+
+Genera update Telegram realistici (soprattutto /ask nel gruppo, poi /quote,
+/help, /status, testo libero nel gruppo e in privato, e ritentativi dello
+stesso update_id) e li manda a POST /telegram a ritmo costante (open loop:
+il ritmo non rallenta se il bot rallenta). Le chiamate del bot verso la Bot
+API finiscono in uno stub HTTP locale che le registra: la latenza end-to-end
+è dal POST dell'update alla risposta (sendMessage) arrivata allo stub.
+
+Per ogni ritmo: throughput delle risposte, p50/p95/p99 di ack HTTP ed
+end-to-end, errori (HTTP non 2xx, risposte mancanti, eccezioni negli
+handler) e RSS del processo.
+
+    python -m bench.load [--rates 20,50,100] [--duration 10] [--stub-delay-ms 0]
+
+Di default l'app gira nello stesso processo (httpx + ASGITransport, con il
+lifespan vero). Con --url si carica un server già avviato, per esempio:
+
+    python -m bench.load --stub-only --stub-port 8081
+    TELEGRAM_TOKEN=123:load TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 \\
+        uvicorn anacleto_web:app --port 8000
+    python -m bench.load --url http://127.0.0.1:8000/telegram --stub-port 8081 --server-pid <pid>
+
+Rate limiting disattivato di default (RATE_*_PER_MIN=0) per misurare il
+bot, non il limitatore: impostare le env a mano per provarlo.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+TOKEN = "123456:load-test"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Anacleto", "username": "MaestroAnacletoBot"}
+GROUP_ID = -1001234567890
+
+ASK_QUERIES = [
+    "piano astrale", "reincarnazione", "karma", "corpo astrale", "trapasso",
+    "coscienza", "sentire", "amore", "dolore", "meditazione", "evoluzione",
+    "libero arbitrio", "piano mentale", "maestro", "morte", '"corpo astrale"',
+    "reincarnazoine", "coscenza", "che cosa succede dopo la morte", "il senso del dolore",
+]
+CHATTER = ["ciao a tutti", "grazie!", "bellissimo passaggio", "qualcuno ha il libro?", "buonanotte"]
+
+# (tipo, peso): i ritentativi si aggiungono a parte (--retry).
+MIX = [("ask", 70), ("quote", 5), ("help", 3), ("status", 2), ("group_text", 12), ("private_text", 8)]
+
+
+def _percentile(xs: List[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """RSS corrente da /proc (Linux); None se non disponibile."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# ─────────────────────────────────────────
+# Stub Bot API
+# ─────────────────────────────────────────
+class BotApiStub:
+    """
+    Server HTTP locale al posto di api.telegram.org. Risponde a getMe,
+    sendMessage ed editMessageText con oggetti validi per PTB, a tutto il
+    resto con true, e registra (metodo, istante, chat_id, messaggio citato).
+    """
+
+    def __init__(self, port: int = 0, delay: float = 0.0):
+        self.delay = delay
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.on_reply: Optional[Callable[[int, Optional[int], float], None]] = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Header e corpo sono due write: con Nagle attivo e keep-alive il
+            # corpo aspetta l'ACK ritardato del client (~40 ms a chiamata).
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = self.path.rsplit("/", 1)[-1]
+                ctype = self.headers.get("Content-Type", "")
+                if ctype.startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = dict(parse_qsl(body.decode("utf-8")))
+                result = stub.handle(method, params)
+                out = json.dumps({"ok": True, "result": result}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            do_GET = do_POST
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="bot-api-stub", daemon=True)
+
+    def start(self) -> "BotApiStub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        t = time.perf_counter()
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            message_id = self._message_id
+        if method == "getMe":
+            return BOT_USER
+        if method not in ("sendMessage", "editMessageText"):
+            return True
+        chat_id = int(params.get("chat_id", 0))
+        if method == "sendMessage" and self.on_reply is not None:
+            reply = params.get("reply_parameters")
+            if isinstance(reply, str):
+                reply = json.loads(reply)
+            self.on_reply(chat_id, reply.get("message_id") if reply else None, t)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+
+# ─────────────────────────────────────────
+# Update sintetici
+# ─────────────────────────────────────────
+@dataclass
+class Synthetic:
+    body: bytes
+    chat_id: int
+    message_id: int
+    expect_reply: bool
+    retry: bool = False
+
+
+class UpdateFactory:
+    def __init__(self, seed: int = 77, users: int = 50, retry: float = 0.03):
+        self.rng = random.Random(seed)
+        self.users = [1000 + i for i in range(users)]
+        self.retry = retry
+        self.update_id = 500_000_000
+        self.message_id = 0
+        self._recent: Deque[Synthetic] = deque(maxlen=64)
+        kinds, weights = zip(*MIX)
+        self._kinds, self._weights = list(kinds), list(weights)
+
+    def _message(self, uid: int, chat: Dict[str, Any], text: str) -> Dict[str, Any]:
+        self.message_id += 1
+        msg: Dict[str, Any] = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": chat,
+            "from": {"id": uid, "is_bot": False, "first_name": "Utente", "username": f"utente{uid}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return msg
+
+    def next(self) -> Synthetic:
+        rng = self.rng
+        if self._recent and rng.random() < self.retry:
+            # Telegram ritenta lo stesso update (stesso update_id): va scartato, nessuna risposta.
+            old = rng.choice(self._recent)
+            return Synthetic(old.body, old.chat_id, old.message_id, expect_reply=False, retry=True)
+        kind = rng.choices(self._kinds, weights=self._weights)[0]
+        uid = rng.choice(self.users)
+        group = {"id": GROUP_ID, "type": "supergroup", "title": "Cerchio Firenze 77"}
+        private = {"id": uid, "type": "private", "first_name": "Utente"}
+        if kind == "ask":
+            chat, text = group, f"/ask {rng.choice(ASK_QUERIES)}"
+        elif kind == "group_text":
+            chat, text = group, rng.choice(CHATTER)
+        elif kind == "private_text":
+            chat, text = private, rng.choice(CHATTER)
+        else:
+            chat, text = group, f"/{kind}"
+        self.update_id += 1
+        msg = self._message(uid, chat, text)
+        body = json.dumps({"update_id": self.update_id, "message": msg}).encode("utf-8")
+        s = Synthetic(body, chat["id"], msg["message_id"], expect_reply=kind != "group_text")
+        self._recent.append(s)
+        return s
+
+
+# ─────────────────────────────────────────
+# Misura
+# ─────────────────────────────────────────
+@dataclass
+class StepResult:
+    rate: int
+    sent: int = 0
+    retries: int = 0
+    status: Counter = field(default_factory=Counter)
+    ack: List[float] = field(default_factory=list)
+    e2e: List[float] = field(default_factory=list)
+    expected: int = 0
+    missing: int = 0
+    handler_errors: int = 0
+    seconds: float = 0.0
+    rss: Optional[float] = None
+
+    def line(self) -> str:
+        http_err = sum(n for code, n in self.status.items() if not 200 <= code < 300)
+        errors = http_err + self.missing + self.handler_errors
+        ms = lambda xs, q: _percentile(xs, q) * 1e3  # noqa: E731
+        rss = f"{self.rss:6.0f} MB" if self.rss is not None else "     ? MB"
+        return (
+            f"{self.rate:>5}/s | inviati {self.sent:>6} (ritentativi {self.retries:>4}) | "
+            f"risposte {len(self.e2e) / self.seconds:7.1f}/s | "
+            f"ack p50 {ms(self.ack, .5):6.1f} p95 {ms(self.ack, .95):6.1f} p99 {ms(self.ack, .99):6.1f} ms | "
+            f"e2e p50 {ms(self.e2e, .5):7.1f} p95 {ms(self.e2e, .95):7.1f} p99 {ms(self.e2e, .99):7.1f} ms | "
+            f"errori {errors / max(1, self.sent):6.2%} (http {http_err}, senza risposta {self.missing}, "
+            f"handler {self.handler_errors}) | RSS {rss}"
+        )
+
+
+class ReplyTracker:
+    """Abbina le sendMessage registrate dallo stub agli update inviati."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (chat, messaggio) -> istante di invio; in privato PTB non cita il
+        # messaggio: si abbina al più vecchio in attesa della stessa chat (la
+        # coda update processa ogni chat in ordine).
+        self._pending: Dict[Tuple[int, int], float] = {}
+        self._by_chat: Dict[int, Deque[int]] = {}
+        self.e2e: List[float] = []
+
+    def expect(self, chat_id: int, message_id: int, t: float) -> None:
+        with self._lock:
+            self._pending[(chat_id, message_id)] = t
+            self._by_chat.setdefault(chat_id, deque()).append(message_id)
+
+    def on_reply(self, chat_id: int, reply_to: Optional[int], t: float) -> None:
+        with self._lock:
+            fifo = self._by_chat.get(chat_id)
+            if not fifo:
+                return
+            if reply_to is None or (chat_id, reply_to) not in self._pending:
+                reply_to = fifo[0]
+            fifo.remove(reply_to)
+            self.e2e.append(t - self._pending.pop((chat_id, reply_to)))
+
+    def cancel(self, chat_id: int, message_id: int) -> None:
+        """Update rifiutato dal webhook (503, 400…): nessuna risposta da aspettare."""
+        with self._lock:
+            if self._pending.pop((chat_id, message_id), None) is not None:
+                self._by_chat[chat_id].remove(message_id)
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def take(self) -> Tuple[List[float], int]:
+        with self._lock:
+            e2e, missing = self.e2e, len(self._pending)
+            self.e2e, self._pending, self._by_chat = [], {}, {}
+        return e2e, missing
+
+
+Post = Callable[[bytes], Awaitable[int]]
+
+
+async def run_step(
+    post: Post, factory: UpdateFactory, tracker: ReplyTracker, rate: int, duration: float, drain: float,
+    handler_errors: Callable[[], int], rss: Callable[[], Optional[float]], idle: Callable[[], bool],
+) -> StepResult:
+    res = StepResult(rate=rate)
+    errors0 = handler_errors()
+
+    async def send(s: Synthetic) -> None:
+        t = time.perf_counter()
+        if s.expect_reply:
+            tracker.expect(s.chat_id, s.message_id, t)
+        try:
+            code = await post(s.body)
+        except Exception:
+            code = 599
+        res.ack.append(time.perf_counter() - t)
+        res.status[code] += 1
+        if s.expect_reply and not 200 <= code < 300:
+            tracker.cancel(s.chat_id, s.message_id)
+
+    n = int(rate * duration)
+    tasks = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        delay = t0 + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        s = factory.next()
+        res.sent += 1
+        res.retries += s.retry
+        res.expected += s.expect_reply
+        tasks.append(asyncio.create_task(send(s)))
+    await asyncio.gather(*tasks)
+    deadline = time.perf_counter() + drain
+    while tracker.outstanding() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.02)
+    res.seconds = time.perf_counter() - t0
+    res.e2e, res.missing = tracker.take()
+    res.handler_errors = handler_errors() - errors0
+    res.rss = rss()
+    # Quello che resta in coda non deve rallentare lo step successivo.
+    while not idle() and time.perf_counter() < deadline + drain:
+        await asyncio.sleep(0.05)
+    return res
+
+
+def _loadtest_env(stub_url: str) -> None:
+    """Env per l'app in-process: stub al posto di Telegram, niente webhook né rate limiting."""
+    os.environ["TELEGRAM_TOKEN"] = TOKEN
+    os.environ["TELEGRAM_API_BASE_URL"] = stub_url
+    os.environ["PUBLIC_BASE_URL"] = ""
+    os.environ.pop("WEBHOOK_SECRET", None)
+    os.environ.pop("ALLOWED_GROUP_ID", None)
+    os.environ.pop("UPDATE_DEDUP_PATH", None)
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    for name in ("RATE_USER_PER_MIN", "RATE_CHAT_PER_MIN"):
+        os.environ.setdefault(name, "0")
+
+
+async def run(args: argparse.Namespace, stub: BotApiStub) -> None:
+    import httpx
+
+    tracker = ReplyTracker()
+    stub.on_reply = tracker.on_reply
+    rates = [int(x) for x in args.rates.split(",")]
+    headers = {"Content-Type": "application/json"}
+
+    async def sweep(
+        client: httpx.AsyncClient, url: str,
+        errors: Callable[[], int], rss: Callable[[], Optional[float]], idle: Callable[[], bool],
+    ) -> None:
+        async def post(body: bytes) -> int:
+            return (await client.post(url, content=body, headers=headers)).status_code
+
+        factory = UpdateFactory(seed=args.seed, users=args.users, retry=args.retry)
+        # Riscaldamento: cache, connessioni, primo accesso alle pagine mappate.
+        await run_step(post, factory, tracker, min(rates), 1.0, args.drain, errors, rss, idle)
+        for rate in rates:
+            res = await run_step(post, factory, tracker, rate, args.duration, args.drain, errors, rss, idle)
+            print(res.line(), flush=True)
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    if args.url:
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            await sweep(
+                client, args.url, lambda: 0,
+                lambda: rss_mb(args.server_pid) if args.server_pid else None, lambda: True,
+            )
+        return
+
+    _loadtest_env(stub.url)
+    import anacleto_web as web
+
+    async with web.lifespan(web.app):
+        idx = web._bot.INDEX
+        print(f"indice: {idx.books if idx else 0} libri, {len(idx.chunks) if idx else 0} pagine | stub {stub.url}")
+        transport = httpx.ASGITransport(app=web.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://anacleto", limits=limits, timeout=30) as client:
+            q = web._updates
+            await sweep(
+                client, web.WEBHOOK_PATH, lambda: q.errors if q else 0, rss_mb,
+                lambda: q is None or not (q.depth or q.in_flight),
+            )
+        print(f"coda update: {web._updates.stats() if web._updates else None}")
+    print(f"chiamate Bot API: {dict(stub.calls)}")
+    print(f"ru_maxrss processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rates", default="20,50,100", help="update al secondo da provare, separati da virgola")
+    ap.add_argument("--duration", type=float, default=10.0, help="secondi per ogni ritmo")
+    ap.add_argument("--drain", type=float, default=10.0, help="secondi massimi di attesa delle risposte a fine step")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--retry", type=float, default=0.03, help="frazione di update ritentati (stesso update_id)")
+    ap.add_argument("--seed", type=int, default=77)
+    ap.add_argument("--connections", type=int, default=32, help="connessioni HTTP verso il webhook")
+    ap.add_argument("--stub-port", type=int, default=0)
+    ap.add_argument("--stub-delay-ms", type=float, default=0.0, help="latenza simulata della Bot API")
+    ap.add_argument("--stub-only", action="store_true", help="avvia solo lo stub Bot API (per --url)")
+    ap.add_argument("--url", default="", help="webhook di un server già avviato (default: app in-process)")
+    ap.add_argument("--server-pid", type=int, default=0, help="con --url: pid del server di cui leggere l'RSS")
+    args = ap.parse_args()
+
+    stub = BotApiStub(args.stub_port, args.stub_delay_ms / 1e3).start()
+    try:
+        if args.stub_only:
+            print(f"stub Bot API su {stub.url} (TELEGRAM_API_BASE_URL={stub.url}, TELEGRAM_TOKEN={TOKEN}); Ctrl-C per uscire")
+            threading.Event().wait()
+        asyncio.run(run(args, stub))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
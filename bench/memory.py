@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Memoria delle pagine indicizzate: List[PageChunk] vs ChunkStore colonnare.
+
+Misura con tracemalloc quanto resta allocato dopo aver costruito ciascuna
+struttura sui sidecar OCR di data/pdfs_ocr. Uso:
+
+    python -m bench.memory
+"""
+from __future__ import annotations
+
+import gc
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import anacleto_bot as bot
+from chunk_store import ChunkStore
+
+
+def _pages() -> List[Tuple[str, int, str]]:
+    out = []
+    for path in bot.list_sources(Path("/nonexistent"), bot.BASE_DIR / "data" / "pdfs_ocr"):
+        texts = [bot._clean_ws(t) for t in bot._split_sidecar_pages(path.read_text(encoding="utf-8"))]
+        out.extend((bot.book_name(path), i, t) for i, t in enumerate(texts, start=1) if t)
+    return out
+
+
+def _measure(build: Callable[[], object]) -> Tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def compare(pages: Callable[[], List[Tuple[str, int, str]]]) -> Tuple[int, int, int, int]:
+    """(pagine, byte List[PageChunk], byte ChunkStore, nbytes dello store) per le pagine date."""
+    # I testi vengono ricaricati dentro ogni misura: conta anche la memoria delle str.
+    legacy, legacy_bytes = _measure(lambda: [bot.PageChunk(book=b, page=p, text=t) for b, p, t in pages()])
+    n = len(legacy)
+    del legacy
+    store, store_bytes = _measure(lambda: ChunkStore.from_chunks(bot.PageChunk(*x) for x in pages()))
+    return n, legacy_bytes, store_bytes, store.nbytes()
+
+
+def main() -> None:
+    n, legacy_bytes, store_bytes, nbytes = compare(_pages)
+    mb = 1024 * 1024
+    print(f"pagine: {n}")
+    print(f"List[PageChunk]: {legacy_bytes / mb:7.2f} MB (solo testo originale)")
+    print(f"ChunkStore:      {store_bytes / mb:7.2f} MB (testo + normalizzato, nbytes={nbytes / mb:.2f} MB)")
+    print(f"rapporto:        {store_bytes / legacy_bytes:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
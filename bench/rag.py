@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark CF77Rag.query: BM25Index (NumPy, CSR) vs rank_bm25.BM25Okapi.
+
+Il corpus sono le pagine dei sidecar OCR in data/pdfs_ocr, replicate --scale
+volte (default 10x). Verifica anche che il ranking coincida con rank_bm25,
+se installato. Uso:
+
+    python -m bench.rag [--scale 10] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+import anacleto_bot as bot
+from analyzer import analyze
+from rag_cf77 import BM25Index, CF77Rag, Chunk
+
+from bench.search import QUERIES
+
+try:
+    from rank_bm25 import BM25Okapi
+except ImportError:  # solo confronto, non necessario
+    BM25Okapi = None
+
+
+def load_chunks(scale: int) -> List[Chunk]:
+    ocr_dir = bot.BASE_DIR / "data" / "pdfs_ocr"
+    base: List[Chunk] = []
+    for path in bot.list_sources(Path("/nonexistent"), ocr_dir):
+        for n, raw in enumerate(bot._split_sidecar_pages(path.read_text(encoding="utf-8")), start=1):
+            txt = raw.strip()
+            tokens = analyze(txt)
+            if tokens:
+                base.append(Chunk(book=bot.book_name(path), page=n, text=txt, tokens=tokens))
+    out: List[Chunk] = []
+    for copy in range(scale):
+        out.extend(Chunk(book=f"{c.book}#{copy}", page=c.page, text=c.text, tokens=c.tokens) for c in base)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top-k", type=int, default=5)
+    args = ap.parse_args()
+
+    rag = CF77Rag(Path("."))
+    rag.chunks = load_chunks(args.scale)
+    t0 = time.perf_counter()
+    rag.index_chunks()
+    print(f"corpus x{args.scale}: {len(rag.chunks)} pagine / {len(rag.bm25.vocab)} termini | "
+          f"BM25Index build {time.perf_counter() - t0:.2f}s")
+
+    ref = None
+    if BM25Okapi is not None:
+        t0 = time.perf_counter()
+        ref = BM25Okapi([c.tokens for c in rag.chunks])
+        print(f"rank_bm25 build {time.perf_counter() - t0:.2f}s")
+
+    lat_np: List[float] = []
+    lat_ref: List[float] = []
+    mismatches = 0
+    for q in QUERIES:
+        toks = analyze(q)
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            got = BM25Index.top_k(rag.bm25.get_scores(toks), args.top_k)
+            lat_np.append(time.perf_counter() - t0)
+        if ref is not None:
+            t0 = time.perf_counter()
+            scores = ref.get_scores(toks)
+            want = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[: args.top_k]
+            lat_ref.append(time.perf_counter() - t0)
+            if list(got) != want:
+                mismatches += 1
+                print(f"  ranking diverso per {q!r}: {list(got)} vs {want}")
+
+    t0 = time.perf_counter()
+    batch = rag.query_batch(QUERIES, args.top_k)
+    t_batch = time.perf_counter() - t0
+    single = [rag.query(q, args.top_k) for q in QUERIES]
+    assert batch == single, "query_batch != query"
+
+    def pct(xs: List[float], p: float) -> float:
+        return float(np.percentile(xs, p)) * 1e3
+
+    print(f"BM25Index  p50 {pct(lat_np, 50):7.2f} ms | p95 {pct(lat_np, 95):7.2f} ms")
+    if lat_ref:
+        print(f"rank_bm25  p50 {pct(lat_ref, 50):7.2f} ms | p95 {pct(lat_ref, 95):7.2f} ms | "
+              f"ranking {'identico' if not mismatches else f'DIVERSO su {mismatches} query'}")
+    print(f"query_batch: {len(QUERIES)} query in {t_batch * 1e3:.2f} ms "
+          f"({t_batch / len(QUERIES) * 1e3:.2f} ms/query)")
+
+
+if __name__ == "__main__":
+    main()
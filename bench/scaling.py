@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Report di scala: tempo di build, RSS e latenza delle query al crescere del
+corpus, per ciascun motore di ricerca:
+  - inverted : search_index (passaggi + TermIndex), il motore di /ask
+  - scan     : _scan_index, scansione lineare delle pagine (stesso indice)
+  - bm25     : CF77Rag (BM25Index NumPy) costruito sulle stesse pagine
+
+Il corpus è sintetico (bench.corpus) e cresce per libri aggiunti: la misura
+N riusa i libri della misura precedente. Ogni misura gira in un processo
+nuovo, così l'RSS non si porta dietro quello delle misure più piccole. Uso:
+
+    python -m bench.scaling [--books 8,32,128,256] [--pages 200] [--words 350]
+                            [--format txt|pdf] [--out scaling.json] [--plot scaling.png]
+
+Il grafico richiede matplotlib (opzionale); senza, solo tabella e JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    HAVE_MPL = True
+except ImportError:
+    plt = None
+    HAVE_MPL = False
+
+from bench.corpus import Vocabulary, write_pdf, write_sidecar
+from bench.load import rss_mb
+
+# Parole vere del vocabolario sintetico (bench.corpus.WORDS), più un refuso.
+QUERIES = [
+    "piano astrale", "corpo", "reincarnazione karma", '"piano mentale"', "coscienza evoluzione",
+    "che cosa succede dopo la morte", "amore dolore sentire", "reincarnazoine",
+]
+ENGINES = ("inverted", "scan", "bm25")
+
+
+def _percentile(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+def _latency(fn: Callable[[str], Any], repeat: int) -> Dict[str, float]:
+    for q in QUERIES:  # riscaldamento
+        fn(q)
+    ts = []
+    for q in QUERIES:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(q)
+            ts.append(time.perf_counter() - t0)
+    return {"p50_ms": _percentile(ts, 0.5) * 1e3, "p95_ms": _percentile(ts, 0.95) * 1e3}
+
+
+# ─────────────────────────────────────────
+# Misura (processo figlio)
+# ─────────────────────────────────────────
+def measure(pdf_dir: Path, ocr_dir: Path, repeat: int, scan_max_pages: int) -> Dict[str, Any]:
+    import anacleto_bot as bot
+
+    rss0 = rss_mb() or 0.0
+    t0 = time.perf_counter()
+    idx = bot.build_index(pdf_dir, workers=1, ocr_dir=ocr_dir)
+    build_s = time.perf_counter() - t0
+    rss_index = rss_mb() or 0.0
+    out: Dict[str, Any] = {
+        "pages": idx.pages, "chars": idx.chars, "terms": len(idx.terms or []),
+        "build_s": build_s, "rss_mb": rss_index, "index_rss_mb": rss_index - rss0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    out["inverted"] = _latency(lambda q: bot.search_index(q, idx, 3), repeat)
+    if idx.pages <= scan_max_pages:
+        out["scan"] = _latency(lambda q: bot._scan_index(q, bot._query_terms(q), idx, 3), max(1, repeat // 10))
+
+    try:
+        from analyzer import analyze
+        from rag_cf77 import CF77Rag, Chunk
+    except ImportError:  # rag_cf77 richiede NumPy
+        return out
+    t0 = time.perf_counter()
+    rag = CF77Rag(pdf_dir)
+    for c in idx.chunks:
+        tokens = analyze(c.text)
+        if tokens:
+            rag.chunks.append(Chunk(book=c.book, page=c.page, text=c.text, tokens=tokens))
+    rag.index_chunks()
+    out["bm25"] = {
+        "build_s": time.perf_counter() - t0,
+        "rss_mb": (rss_mb() or 0.0) - rss_index,
+        **_latency(lambda q: rag.query(q, 3), repeat),
+    }
+    return out
+
+
+def _measure_in_child(pdf_dir: Path, ocr_dir: Path, repeat: int, scan_max_pages: int) -> Dict[str, Any]:
+    cmd = [
+        sys.executable, "-m", "bench.scaling", "--measure", str(pdf_dir), str(ocr_dir),
+        "--repeat", str(repeat), "--scan-max-pages", str(scan_max_pages),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True, env={**os.environ, "LOG_LEVEL": "WARNING"})
+    if proc.returncode != 0:
+        raise RuntimeError(f"misura fallita:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ─────────────────────────────────────────
+# Report
+# ─────────────────────────────────────────
+def _fmt(row: Dict[str, Any], engine: str) -> str:
+    e = row.get(engine)
+    if e is None:
+        return f"{'—':>17}"
+    return f"{e['p50_ms']:7.2f} /{e['p95_ms']:8.2f}"
+
+
+def print_row(row: Dict[str, Any]) -> None:
+    bm25 = row.get("bm25")
+    bm25_build = f"{bm25['build_s']:6.1f} s +{bm25['rss_mb']:5.0f} MB" if bm25 else f"{'—':>17}"
+    print(
+        f"{row['books']:>5} | {row['pages']:>7} | {row['chars'] / 1024 / 1024:7.1f} | {row['terms']:>8} | "
+        f"{row['build_s']:7.1f} | {row['rss_mb']:6.0f} ({row['peak_rss_mb']:6.0f}) | "
+        f"{_fmt(row, 'inverted')} | {_fmt(row, 'scan')} | {bm25_build} | {_fmt(row, 'bm25')}",
+        flush=True,
+    )
+
+
+HEADER = (
+    "libri |  pagine | testoMB |  termini | build s | RSS MB (picco) | "
+    "inverted p50/p95 |     scan p50/p95 | bm25 build / +RSS | bm25 p50/p95 ms"
+)
+
+
+def plot(rows: List[Dict[str, Any]], path: Path) -> None:
+    fig, (ax_build, ax_rss, ax_lat) = plt.subplots(1, 3, figsize=(15, 4.5))
+    pages = [r["pages"] for r in rows]
+    ax_build.plot(pages, [r["build_s"] for r in rows], "o-", label="inverted/scan (build_index)")
+    ax_rss.plot(pages, [r["rss_mb"] for r in rows], "o-", label="inverted/scan (processo)")
+    bm = [r for r in rows if "bm25" in r]
+    if bm:
+        ax_build.plot([r["pages"] for r in bm], [r["bm25"]["build_s"] for r in bm], "s-", label="bm25")
+        ax_rss.plot([r["pages"] for r in bm], [r["bm25"]["rss_mb"] for r in bm], "s-", label="bm25 (in più)")
+    for engine in ENGINES:
+        pts = [(r["pages"], r[engine]["p95_ms"]) for r in rows if engine in r]
+        if pts:
+            ax_lat.plot(*zip(*pts), "o-", label=f"{engine} p95")
+    for ax, title in ((ax_build, "build (s)"), (ax_rss, "RSS (MB)"), (ax_lat, "latenza query (ms)")):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("pagine")
+        ax.set_title(title)
+        ax.grid(True, which="both", alpha=0.3)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--books", default="8,32,128,256", help="dimensioni del corpus in libri, separate da virgola")
+    ap.add_argument("--pages", type=int, default=200, help="pagine per libro")
+    ap.add_argument("--words", type=int, default=350, help="parole per pagina")
+    ap.add_argument("--format", choices=("txt", "pdf"), default="txt", help="sidecar OCR o PDF (estratti con pypdf)")
+    ap.add_argument("--repeat", type=int, default=10, help="ripetizioni per query")
+    ap.add_argument("--scan-max-pages", type=int, default=20_000, help="oltre, la scansione lineare non viene misurata")
+    ap.add_argument("--out", default="", help="risultati JSON")
+    ap.add_argument("--plot", default="", help="grafico PNG (richiede matplotlib)")
+    ap.add_argument("--measure", nargs=2, metavar=("PDF_DIR", "OCR_DIR"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(Path(args.measure[0]), Path(args.measure[1]), args.repeat, args.scan_max_pages)))
+        return
+
+    rows: List[Dict[str, Any]] = []
+    vocab = Vocabulary()
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_dir, ocr_dir = Path(tmp) / "pdfs", Path(tmp) / "pdfs_ocr"
+        pdf_dir.mkdir()
+        ocr_dir.mkdir()
+        written = 0
+        print(HEADER)
+        for books in sorted(int(x) for x in args.books.split(",")):
+            for b in range(written, books):
+                if args.format == "pdf":
+                    write_pdf(pdf_dir / f"sintetico{b:04d}.pdf", args.pages, 77 + b, args.words, vocab)
+                else:
+                    write_sidecar(ocr_dir / f"sintetico{b:04d}_clean.txt", args.pages, args.words, 77 + b, vocab)
+            written = max(written, books)
+            row = {"books": books, **_measure_in_child(pdf_dir, ocr_dir, args.repeat, args.scan_max_pages)}
+            rows.append(row)
+            print_row(row)
+
+    if args.out:
+        meta = {"pages_per_book": args.pages, "words_per_page": args.words, "format": args.format}
+        Path(args.out).write_text(json.dumps({"meta": meta, "rows": rows}, indent=2) + "\n", encoding="utf-8")
+        print(f"risultati in {args.out}")
+    if args.plot:
+        if HAVE_MPL:
+            plot(rows, Path(args.plot))
+            print(f"grafico in {args.plot}")
+        else:
+            print("matplotlib non disponibile: grafico non generato (i dati sono nel JSON)")
+
+
+if __name__ == "__main__":
+    main()
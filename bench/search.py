@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark search_index: scansione lineare vs indice invertito.
+
+Usa i sidecar OCR in data/pdfs_ocr (niente pypdf). I risultati dell'indice
+invertito vengono confrontati con una classifica di riferimento a forza bruta
+(Reference): passaggi ricalcolati da zero pagina per pagina (split_page),
+varianti e punteggio riscritti dalla specifica, senza TermIndex né
+score_passage. Uso:
+
+    python -m bench.search [--repeat 20]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import anacleto_bot as bot
+from passages import TermPositions, split_page
+
+QUERIES = [
+    "piano astrale", "reincarnazione", "karma", "corpo astrale", "trapasso",
+    "coscienza", "sentire", "amore", "dolore", "meditazione", "evoluzione",
+    "libero arbitrio", "piano mentale", "maestro", "morte",
+]
+
+
+def load_ocr_index() -> bot.Cf77Index:
+    return bot.build_index(bot.PDF_DIR, ocr_dir=bot.BASE_DIR / "data" / "pdfs_ocr")
+
+
+# Frasi tra virgolette e combinazioni: verificano postings posizionali e prossimità.
+PHRASE_QUERIES = [
+    '"corpo astrale"', '"piano mentale"', '"libero arbitrio" karma', 'corpo "piano astrale" morte',
+]
+# Refusi: trovano i passaggi solo tramite le varianti fuzzy del vocabolario.
+TYPO_QUERIES = ["reincarnazoine", "coscenza", "medtazione", "evoluizone spirituale"]
+# Domande vere, con molti termini frequenti: tanti passaggi candidati da classificare.
+NATURAL_QUERIES = [
+    "che cosa succede dopo la morte", "il senso del dolore", "come si evolve la coscienza",
+    "amore dolore sentire", "essere vita morte dolore amore anima",
+]
+
+
+# Profondità del confronto con il riferimento: oltre le 3 pagine mostrate, così
+# anche frasi e varianti rare finiscono nei passaggi confrontati.
+CHECK_TOP_K = 20
+
+
+def osa_distance(a: str, b: str) -> int:
+    """Distanza di Damerau (optimal string alignment), tabella completa."""
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+class Reference:
+    """
+    Classifica di riferimento scritta dalla specifica, senza usare TermIndex
+    né le funzioni di punteggio del bot: vocabolario e df dai passaggi
+    ricalcolati con split_page, varianti per confronto con tutto il vocabolario.
+
+    Varianti di t: t stesso (distanza 0) e i termini a distanza 1..max_edits
+    (0 fino a 2 lettere, 1 fino a 5, poi 2); se t esiste, solo quelli con
+    df <= max(1, df(t) * FUZZY_DF_RATIO). Punteggio di un passaggio:
+    somma su t di peso(t) * FUZZY_WEIGHTS[d] * tf(variante), più
+    PROXIMITY_BOOST * k² / max(k, span) con k termini presenti (k > 1) e span
+    la finestra più corta con una posizione di ciascuno; 0 se manca una frase
+    (termini esatti a offset consecutivi).
+    """
+
+    def __init__(self, units: List[Tuple[int, TermPositions]]):
+        self.units = units
+        self.df: Counter = Counter(t for _, positions in units for t in positions)
+        self._variants: Dict[str, List[Tuple[str, int]]] = {}
+
+    def variants(self, t: str) -> List[Tuple[str, int]]:
+        if t not in self._variants:
+            max_edits = min(0 if len(t) <= 2 else 1 if len(t) <= 5 else 2, bot.FUZZY_MAX_EDITS)
+            limit = max(1, int(self.df[t] * bot.FUZZY_DF_RATIO)) if t in self.df else None
+            out = [(t, 0)] if t in self.df else []
+            for w in self.df if max_edits else ():
+                if w != t and abs(len(w) - len(t)) <= max_edits and (limit is None or self.df[w] <= limit):
+                    d = osa_distance(t, w)
+                    if d <= max_edits:
+                        out.append((w, d))
+            self._variants[t] = out
+        return self._variants[t]
+
+    @staticmethod
+    def span(lists: List[List[int]]) -> int:
+        """Finestra più corta: parte da una delle posizioni e arriva alla più vicina di ogni lista."""
+        spans = []
+        for lo in {p for ps in lists for p in ps}:
+            nxt = [min((p for p in ps if p >= lo), default=None) for ps in lists]
+            if None not in nxt:
+                spans.append(max(nxt) - lo + 1)
+        return min(spans)
+
+    def score(self, pq: bot.ParsedQuery, weights: Counter, positions: TermPositions) -> float:
+        for ph in pq.phrases:
+            first_off, first = ph[0]
+            if not any(all(p + off - first_off in positions.get(t, ()) for off, t in ph)
+                       for p in positions.get(first, ())):
+                return 0.0
+        score = 0.0
+        present: List[List[int]] = []
+        for t, w in weights.items():
+            ps: List[int] = []
+            for v, d in self.variants(t):
+                if v in positions:
+                    score += w * bot.FUZZY_WEIGHTS[d] * len(positions[v])
+                    ps.extend(positions[v])
+            if ps:
+                present.append(ps)
+        k = len(present)
+        if k > 1:
+            score += bot.PROXIMITY_BOOST * k * k / max(k, self.span(present))
+        return score
+
+    def rank(self, q: str, top_k: int) -> List[Tuple[int, float]]:
+        """Miglior passaggio per pagina, ordinati per punteggio (poi per id)."""
+        pq = bot.parse_query(q)
+        weights = Counter(pq.terms)
+        best: Dict[int, Tuple[float, int]] = {}
+        for pid, (cid, positions) in enumerate(self.units):
+            sc = self.score(pq, weights, positions)
+            if sc > 0 and (cid not in best or sc > best[cid][0]):
+                best[cid] = (sc, pid)
+        ranked = sorted(best.values(), key=lambda x: (-x[0], x[1]))[:top_k]
+        return [(pid, round(sc, 9)) for sc, pid in ranked]
+
+
+def _timed(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    idx = load_ocr_index()
+    print(f"corpus: {idx.books} libri / {len(idx.chunks)} pagine / {idx.chars} chars / "
+          f"{len(idx.passages)} passaggi / {len(idx.terms)} termini | build {time.perf_counter() - t0:.2f}s")
+
+    units = [
+        (cid, terms)
+        for cid in range(len(idx.chunks))
+        for _, _, terms in split_page(idx.chunks.text(cid), bot.PASSAGE_TOKENS, bot.PASSAGE_STRIDE)
+    ]
+    ref = Reference(units)
+    tot_scan = tot_inv = 0.0
+    for q in QUERIES + PHRASE_QUERIES + TYPO_QUERIES + NATURAL_QUERIES:
+        terms = bot._query_terms(q)
+        same = ref.rank(q, CHECK_TOP_K) == [(c.id, round(s, 9)) for c, s in bot.search_index(q, idx, CHECK_TOP_K)]
+        t_scan = _timed(lambda: bot._scan_index(q, terms, idx, 3), args.repeat)
+        t_inv = _timed(lambda: bot.search_index(q, idx, 3), args.repeat)
+        tot_scan += t_scan
+        tot_inv += t_inv
+        print(f"{q:<38} scan {t_scan * 1e3:8.2f} ms | inverted {t_inv * 1e3:7.3f} ms | "
+              f"x{t_scan / t_inv:6.1f} | {'identici' if same else 'DIVERSI'}")
+    print(f"{'TOTALE':<38} scan {tot_scan * 1e3:8.2f} ms | inverted {tot_inv * 1e3:7.3f} ms | "
+          f"x{tot_scan / tot_inv:6.1f}")
+
+    # Lookup fuzzy a cache vuota, su tutti i termini delle domande.
+    lookups = []
+    for q in QUERIES + TYPO_QUERIES:
+        for t in bot._query_terms(q):
+            idx.terms._fuzzy_cache.clear()
+            t0 = time.perf_counter()
+            bot._term_variants(idx.terms, t)
+            lookups.append(time.perf_counter() - t0)
+    print(f"fuzzy lookup: {len(lookups)} termini | media {sum(lookups) / len(lookups) * 1e6:.0f} us | "
+          f"max {max(lookups) * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Suite di benchmark con soglie di regressione, sul corpus distribuito
+(data/pdfs + data/pdfs_ocr) e su un insieme fisso di domande in italiano.
+
+Misura:
+  - estrazione dei PDF di data/pdfs (pypdf, pagina per pagina)
+  - build_index: tempo, picco di memoria (tracemalloc), memoria che resta
+  - snapshot: dimensione del file mappato
+  - search_index sullo snapshot mappato (come in produzione): percentili per query
+  - resa dei risultati trovati (estratto + blocco HTML, come answer_blocks)
+  - CF77Rag: index_chunks (BM25) e query, su pagine dei sidecar OCR
+
+I risultati vanno in un JSON; con --compare la suite confronta con un JSON
+precedente ed esce con codice 1 se una metrica peggiora oltre la soglia
+(relativa, più un minimo assoluto per non inseguire il rumore). Uso:
+
+    python -m bench.suite --out bench/baseline.json
+    python -m bench.suite --compare bench/baseline.json [--threshold 0.2]
+
+Tutte le metriche sono "più basso è meglio"; i conteggi (pagine, termini…)
+finiscono in "info" e non vengono confrontati.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import anacleto_bot as bot
+
+from bench.search import NATURAL_QUERIES, PHRASE_QUERIES, QUERIES, TYPO_QUERIES
+
+try:
+    import numpy  # noqa: F401
+    from bench.rag import load_chunks
+    from rag_cf77 import CF77Rag
+    HAVE_RAG = True
+except ImportError:  # rag_cf77 richiede NumPy
+    HAVE_RAG = False
+
+OCR_DIR = bot.BASE_DIR / "data" / "pdfs_ocr"
+SUITE_QUERIES = QUERIES + PHRASE_QUERIES + TYPO_QUERIES + NATURAL_QUERIES
+
+# Sotto queste differenze assolute un peggioramento è rumore, qualunque sia il rapporto.
+MIN_DELTA = {"ms": 0.05, "s": 0.1, "MB": 0.5}
+MB = 1024 * 1024
+
+
+def _percentile(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+class Results:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self.info: Dict[str, Any] = {}
+
+    def add(self, name: str, value: float, unit: str) -> None:
+        self.metrics[name] = {"value": round(value, 4), "unit": unit}
+        print(f"  {name:<28} {value:10.3f} {unit}")
+
+    def latencies(self, name: str, seconds: List[float]) -> None:
+        for label, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            self.add(f"{name}.{label}_ms", _percentile(seconds, q) * 1e3, "ms")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"meta": _meta(), "info": self.info, "metrics": self.metrics}
+
+
+def _meta() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=bot.BASE_DIR, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def _timings(fn: Callable[[], Any], repeat: int) -> List[float]:
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+# ─────────────────────────────────────────
+# Gruppi di misure
+# ─────────────────────────────────────────
+def bench_extract(res: Results) -> None:
+    pdfs = bot.list_pdfs(bot.PDF_DIR)
+    if not bot.HAVE_PYPDF or not pdfs:
+        print("  (estrazione saltata: pypdf o PDF assenti)")
+        return
+    t0 = time.perf_counter()
+    pages = sum(1 for pdf in pdfs for _ in bot._iter_pdf_book(pdf))
+    seconds = time.perf_counter() - t0
+    res.info["extract_pages"] = pages
+    res.add("extract.seconds", seconds, "s")
+    res.add("extract.per_page_ms", seconds / max(1, pages) * 1e3, "ms")
+
+
+def bench_build(res: Results) -> bot.Cf77Index:
+    gc.collect()
+    t0 = time.perf_counter()
+    idx = bot.build_index(bot.PDF_DIR, workers=1, ocr_dir=OCR_DIR)
+    res.add("build.seconds", time.perf_counter() - t0, "s")
+    del idx
+    gc.collect()
+    # Seconda build sotto tracemalloc (che la rallenta): solo per la memoria.
+    tracemalloc.start()
+    idx = bot.build_index(bot.PDF_DIR, workers=1, ocr_dir=OCR_DIR)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res.add("build.peak_mb", peak / MB, "MB")
+    res.add("build.retained_mb", current / MB, "MB")
+    res.info.update(
+        books=idx.books, pages=idx.pages, chars=idx.chars,
+        passages=len(idx.passages or []), terms=len(idx.terms or []),
+    )
+    return idx
+
+
+def bench_snapshot(res: Results, idx: bot.Cf77Index, tmp: Path) -> bot.Cf77Index:
+    path = tmp / "suite.index.bin"
+    fps = [bot._fingerprint(p) for p in bot.list_sources(bot.PDF_DIR, OCR_DIR)]
+    t0 = time.perf_counter()
+    mapped = bot._write_snapshot(path, fps, idx)
+    res.add("snapshot.write_seconds", time.perf_counter() - t0, "s")
+    if path.exists():
+        res.add("snapshot.size_mb", path.stat().st_size / MB, "MB")
+    return mapped
+
+
+def bench_search(res: Results, idx: bot.Cf77Index, repeat: int) -> None:
+    for q in SUITE_QUERIES:  # riscaldamento: cache fuzzy, pagine mappate
+        bot.search_index(q, idx, 3)
+    per_query: List[float] = []
+    medians: Dict[str, float] = {}
+    for q in SUITE_QUERIES:
+        ts = _timings(lambda: bot.search_index(q, idx, 3), repeat)
+        per_query.extend(ts)
+        medians[q] = round(_percentile(ts, 0.5) * 1e3, 3)
+    # Mediana per query: per capire quale domanda ha causato una regressione dei percentili.
+    res.info["search_ms_by_query"] = medians
+    res.latencies("search", per_query)
+    res.add("search.max_ms", max(per_query) * 1e3, "ms")
+
+    # Come answer_blocks per ogni hit: estratto (PassageView.excerpt, o snippet
+    # per le pagine intere del fallback) con i termini della domanda, poi blocco HTML.
+    hits = [(hit, bot._query_terms(q)) for q in SUITE_QUERIES for hit, _ in bot.search_index(q, idx, 3)]
+    res.info["render_calls"] = len(hits)
+    res.latencies("render", [
+        s for hit, terms in hits
+        for s in _timings(lambda: bot._render_block(hit, bot._hit_excerpt(hit, terms)), repeat)
+    ])
+
+
+def bench_rag(res: Results, repeat: int) -> None:
+    if not HAVE_RAG:
+        print("  (CF77Rag saltato: NumPy non disponibile)")
+        return
+    rag = CF77Rag(bot.PDF_DIR)
+    rag.chunks = load_chunks(1)
+    res.add("rag.build_seconds", min(_timings(rag.index_chunks, 5)), "s")
+    per_query = [s for q in SUITE_QUERIES for s in _timings(lambda: rag.query(q, 5), repeat)]
+    res.latencies("rag.query", per_query)
+
+
+# ─────────────────────────────────────────
+# Confronto
+# ─────────────────────────────────────────
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Le metriche peggiorate oltre la soglia (vuota = nessuna regressione)."""
+    failures = []
+    print(f"\nconfronto con {baseline['meta'].get('commit') or '?'} ({baseline['meta'].get('date', '?')}), "
+          f"soglia +{threshold:.0%}")
+    for name, now in current["metrics"].items():
+        old = baseline["metrics"].get(name)
+        if old is None:
+            print(f"  {name:<28} {now['value']:10.3f} {now['unit']:<3} (nuova)")
+            continue
+        a, b = old["value"], now["value"]
+        ratio = b / a if a else float("inf") if b else 1.0
+        worse = b > a * (1 + threshold) and b - a > MIN_DELTA.get(now["unit"], 0.0)
+        mark = "❌ REGRESSIONE" if worse else ("✅" if b <= a else "")
+        print(f"  {name:<28} {a:10.3f} -> {b:10.3f} {now['unit']:<3} x{ratio:5.2f} {mark}")
+        if worse:
+            failures.append(name)
+    return failures
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=20, help="ripetizioni per ogni query")
+    ap.add_argument("--out", default="", help="dove scrivere i risultati JSON")
+    ap.add_argument("--compare", default="", help="JSON di riferimento: esce con 1 se c'è una regressione")
+    ap.add_argument("--threshold", type=float, default=0.20, help="peggioramento relativo tollerato")
+    args = ap.parse_args()
+
+    res = Results()
+    with tempfile.TemporaryDirectory() as tmp:
+        print("estrazione PDF")
+        bench_extract(res)
+        print("build_index")
+        idx = bench_build(res)
+        print("snapshot")
+        mapped = bench_snapshot(res, idx, Path(tmp))
+        del idx
+        print("search_index / resa")
+        bench_search(res, mapped, args.repeat)
+        print("CF77Rag")
+        bench_rag(res, args.repeat)
+        del mapped
+    out = res.as_dict()
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(out, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"\nrisultati in {args.out}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        failures = compare(out, baseline, args.threshold)
+        if failures:
+            print(f"\n❌ {len(failures)} regressioni: {', '.join(failures)}")
+            sys.exit(1)
+        print("\n✅ nessuna regressione")
+
+
+if __name__ == "__main__":
+    main()
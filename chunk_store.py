@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — archivio colonnare delle pagine indicizzate.
+
+Invece di un PageChunk (oggetto + str) per pagina, tutte le pagine stanno in
+due buffer UTF-8 concatenati:
+  - testo originale (per le risposte)
+  - testo normalizzato in minuscolo (per ricerca/snippet), con un separatore
+    \\x00 dopo ogni pagina così nessuna occorrenza scavalca due pagine
+più colonne `array` con offset, id libro e numero di pagina. Buffer e colonne
+possono anche essere viste sullo snapshot mappato (vedi index_cache.py).
+
+In UTF-8 il testo italiano occupa ~1 byte per carattere, contro 2 di una str
+Python appena compare un carattere come ’ o «.
+"""
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+_SEP = b"\x00"
+
+
+class ChunkView:
+    """Vista di una pagina dell'archivio, con la stessa interfaccia di PageChunk."""
+
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store: "ChunkStore", i: int):
+        self._store = store
+        self._i = i
+
+    @property
+    def id(self) -> int:
+        return self._i
+
+    @property
+    def book(self) -> str:
+        return self._store.books[self._store.book_ids[self._i]]
+
+    @property
+    def page(self) -> int:
+        return self._store.pages[self._i]
+
+    @property
+    def text(self) -> str:
+        return self._store.text(self._i)
+
+    @property
+    def norm(self) -> str:
+        return self._store.norm(self._i)
+
+    def __eq__(self, other: object) -> bool:
+        if not hasattr(other, "book") or not hasattr(other, "text"):
+            return NotImplemented
+        return (self.book, self.page, self.text) == (other.book, other.page, other.text)  # type: ignore[attr-defined]
+
+    def __hash__(self) -> int:
+        return hash((self.book, self.page))
+
+    def __repr__(self) -> str:
+        return f"ChunkView(book={self.book!r}, page={self.page}, chars={len(self.text)})"
+
+
+class ChunkStore:
+    __slots__ = ("books", "book_ids", "pages", "text_buf", "text_off", "norm_buf", "norm_off")
+
+    def __init__(
+        self,
+        books: Optional[List[str]] = None,
+        book_ids: Optional[Any] = None,
+        pages: Optional[Any] = None,
+        text_buf: Any = b"",
+        text_off: Optional[Any] = None,
+        norm_buf: Any = b"",
+        norm_off: Optional[Any] = None,
+    ):
+        self.books: List[str] = books if books is not None else []
+        self.book_ids = book_ids if book_ids is not None else array("H")
+        self.pages = pages if pages is not None else array("I")
+        self.text_buf = text_buf
+        self.text_off = text_off if text_off is not None else array("I", [0])
+        self.norm_buf = norm_buf
+        self.norm_off = norm_off if norm_off is not None else array("I", [0])
+
+    # ── accesso ──────────────────────────────
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def __bool__(self) -> bool:
+        return len(self.pages) > 0
+
+    def __getitem__(self, i: int) -> ChunkView:
+        n = len(self.pages)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("chunk id fuori intervallo")
+        return ChunkView(self, i)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        for i in range(len(self.pages)):
+            yield ChunkView(self, i)
+
+    def text(self, i: int) -> str:
+        return self.text_buf[self.text_off[i]:self.text_off[i + 1]].decode("utf-8")
+
+    def norm(self, i: int) -> str:
+        # l'ultimo byte è il separatore
+        return self.norm_buf[self.norm_off[i]:self.norm_off[i + 1] - 1].decode("utf-8")
+
+    def book_of(self, i: int) -> str:
+        return self.books[self.book_ids[i]]
+
+    def nbytes(self) -> int:
+        cols = (self.book_ids, self.pages, self.text_off, self.norm_off)
+        return len(self.text_buf) + len(self.norm_buf) + sum(a.itemsize * len(a) for a in cols)
+
+    # ── ricerca sul testo normalizzato ───────
+    def count_norm(self, needles: Iterable[str]) -> Dict[int, int]:
+        """
+        chunk id -> occorrenze totali dei `needles` nel testo normalizzato
+        (equivalente a sum(text.lower().count(n)) pagina per pagina, ma con una
+        sola scansione in C dell'intero buffer).
+        """
+        out: Dict[int, int] = {}
+        buf, off = self.norm_buf, self.norm_off
+        for needle in needles:
+            nb = needle.encode("utf-8")
+            if not nb:
+                continue
+            i = buf.find(nb)
+            while i != -1:
+                cid = bisect_right(off, i) - 1
+                out[cid] = out.get(cid, 0) + 1
+                i = buf.find(nb, i + len(nb))
+        return out
+
+    # ── snapshot ─────────────────────────────
+    def sections(self) -> Dict[str, Any]:
+        return {f"chunks.{name}": getattr(self, name) for name in self.__slots__ if name != "books"}
+
+    @classmethod
+    def from_sections(cls, books: List[str], get) -> "ChunkStore":
+        return cls(books=books, **{name: get(f"chunks.{name}") for name in cls.__slots__ if name != "books"})
+
+    # ── costruzione ──────────────────────────
+    @classmethod
+    def from_chunks(cls, chunks: Iterable) -> "ChunkStore":
+        b = ChunkStoreBuilder()
+        for ch in chunks:
+            b.append(ch.book, ch.page, ch.text)
+        return b.build()
+
+
+class ChunkStoreBuilder:
+    """Accumula pagine (nuove o copiate da un altro store) e produce un ChunkStore."""
+
+    def __init__(self) -> None:
+        self._books: List[str] = []
+        self._book_idx: Dict[str, int] = {}
+        self._book_ids = array("H")
+        self._pages = array("I")
+        # I buffer crescono sul posto (niente lista di pagine + join, che
+        # raddoppierebbe il picco); build() li copia a misura esatta.
+        self._text = bytearray()
+        self._text_off = array("I", [0])
+        self._norm = bytearray()
+        self._norm_off = array("I", [0])
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def _book_id(self, book: str) -> int:
+        bid = self._book_idx.get(book)
+        if bid is None:
+            bid = self._book_idx[book] = len(self._books)
+            self._books.append(book)
+        return bid
+
+    def _push(self, book: str, page: int, raw: bytes, norm: bytes) -> None:
+        self._book_ids.append(self._book_id(book))
+        self._pages.append(page)
+        self._text += raw
+        self._text_off.append(len(self._text))
+        self._norm += norm
+        self._norm_off.append(len(self._norm))
+
+    def append(self, book: str, page: int, text: str) -> int:
+        self._push(book, page, text.encode("utf-8"), text.lower().encode("utf-8") + _SEP)
+        return len(self._pages) - 1
+
+    def append_from(self, store: ChunkStore, i: int) -> int:
+        """Copia la pagina i di `store` senza decodificarla."""
+        self._push(
+            store.book_of(i),
+            store.pages[i],
+            store.text_buf[store.text_off[i]:store.text_off[i + 1]],
+            store.norm_buf[store.norm_off[i]:store.norm_off[i + 1]],
+        )
+        return len(self._pages) - 1
+
+    def build(self) -> ChunkStore:
+        # bytearray e array tengono capacità di riserva per gli append: lo
+        # store resta in memoria per tutta la vita dell'indice, quindi prende
+        # copie della lunghezza giusta (una colonna alla volta, il builder si
+        # svuota man mano).
+        text, self._text = bytes(self._text), bytearray()
+        norm, self._norm = bytes(self._norm), bytearray()
+        return ChunkStore(
+            books=self._books,
+            book_ids=self._book_ids[:],
+            pages=self._pages[:],
+            text_buf=text,
+            text_off=self._text_off[:],
+            norm_buf=norm,
+            norm_off=self._norm_off[:],
+        )
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — snapshot su disco dell'indice (file binario + mmap).
+
+Formato del file:
+  MAGIC (8 byte) | lunghezza header (u32 LE) | header JSON | sezioni
+L'header contiene versione, impronta dei PDF, metadati dell'indice e, per
+ogni sezione, (offset, nbytes, typecode). Le sezioni sono array (typecode
+"I", "H", …) o blob di byte ("B"), allineate a 8 byte.
+
+Il file viene aperto con mmap in sola lettura: con più worker uvicorn tutti
+condividono le stesse pagine della page cache, e testo e postings vengono
+letti senza copie. Aprire lo snapshot = open + parse dell'header.
+
+Lo snapshot è valido solo se l'impronta dei PDF (nome, dimensione, mtime,
+sha256) coincide con quella salvata. Qualsiasi errore in lettura (file
+troncato, versione diversa, header rotto) viene trattato come "snapshot
+assente": il chiamante ricostruisce l'indice da zero.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import logging
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente lock tra processi
+    fcntl = None  # type: ignore
+
+log = logging.getLogger("ANACLETO")
+
+MAGIC = b"CF77IDX\x00"
+# Da incrementare ogni volta che cambia il contenuto dello snapshot.
+SNAPSHOT_VERSION = 9
+_ALIGN = 8
+
+Section = Union[bytes, array]
+
+
+def fingerprint_file(path: Path) -> Dict[str, Any]:
+    st = path.stat()
+    with path.open("rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return {
+        "name": path.name,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": digest,
+    }
+
+
+def fingerprints(paths: List[Path]) -> List[Dict[str, Any]]:
+    return [fingerprint_file(p) for p in paths]
+
+
+class MappedBlob:
+    """
+    Blob di byte dentro il file mappato, con l'interfaccia di `bytes` che serve
+    all'indice (len, slicing, find). Gli offset restituiti sono relativi al blob.
+    """
+
+    __slots__ = ("_mm", "_off", "_len")
+
+    def __init__(self, mm: mmap.mmap, off: int, length: int):
+        self._mm = mm
+        self._off = off
+        self._len = length
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, key: slice) -> bytes:
+        start, stop, _ = key.indices(self._len)
+        return self._mm[self._off + start:self._off + max(start, stop)]
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        end = self._len if end is None else min(end, self._len)
+        i = self._mm.find(sub, self._off + start, self._off + end)
+        return -1 if i == -1 else i - self._off
+
+
+class IndexFile:
+    """Snapshot aperto: metadati dall'header, sezioni come viste sul mmap."""
+
+    def __init__(self, path: Path, mm: mmap.mmap, header: Dict[str, Any]):
+        self.path = path
+        self.meta: Dict[str, Any] = header["meta"]
+        self._mm = mm
+        self._sections: Dict[str, List[Any]] = header["sections"]
+
+    def section(self, name: str) -> Any:
+        off, nbytes, typecode = self._sections[name]
+        if typecode == "B":
+            return MappedBlob(self._mm, off, nbytes)
+        return memoryview(self._mm)[off:off + nbytes].cast(typecode)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mm)
+
+
+@contextmanager
+def build_lock(path: Path) -> Iterator[None]:
+    """
+    Lock esclusivo tra processi (più worker uvicorn): il primo che trova lo
+    snapshot vecchio lo ricostruisce, gli altri aspettano e poi lo aprono.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = path.with_name(path.name + ".lock")
+    try:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    except OSError as e:
+        log.warning("💾 lock snapshot non disponibile (%s): %s", lock_path, e)
+        yield
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+def _itemsizes() -> Dict[str, int]:
+    return {tc: array(tc).itemsize for tc in "HIQ"}
+
+
+def _read_header(mm: mmap.mmap) -> Dict[str, Any]:
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("magic errato")
+    (hlen,) = struct.unpack_from("<I", mm, len(MAGIC))
+    start = len(MAGIC) + 4
+    header = json.loads(mm[start:start + hlen].decode("utf-8"))
+    for name, (off, nbytes, typecode) in header["sections"].items():
+        if off + nbytes > len(mm):
+            raise ValueError(f"sezione {name} oltre la fine del file (troncato?)")
+        if typecode != "B" and nbytes % array(typecode).itemsize:
+            raise ValueError(f"sezione {name} di lunghezza non valida")
+    return header
+
+
+def load_snapshot(path: Path, fps: List[Dict[str, Any]]) -> Optional[IndexFile]:
+    """Apre (mmap) lo snapshot se esiste ed è aggiornato, altrimenti None."""
+    try:
+        with path.open("rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        log.info("💾 snapshot indice assente: %s", path)
+        return None
+    except (OSError, ValueError) as e:  # ValueError: file vuoto
+        log.warning("💾 snapshot indice illeggibile (%s): %s — lo ricostruisco", path, e)
+        return None
+
+    try:
+        header = _read_header(mm)
+    except Exception as e:
+        log.warning("💾 snapshot indice illeggibile (%s): %s — lo ricostruisco", path, e)
+        mm.close()
+        return None
+
+    if (
+        header.get("version") != SNAPSHOT_VERSION
+        or header.get("byteorder") != sys.byteorder
+        or header.get("itemsizes") != _itemsizes()
+    ):
+        log.info("💾 snapshot indice di versione/piattaforma diversa — lo ricostruisco")
+        mm.close()
+        return None
+    if header.get("fingerprints") != fps:
+        log.info("💾 snapshot indice non aggiornato (PDF cambiati) — lo ricostruisco")
+        mm.close()
+        return None
+    return IndexFile(path, mm, header)
+
+
+def save_snapshot(
+    path: Path,
+    fps: List[Dict[str, Any]],
+    meta: Dict[str, Any],
+    sections: Dict[str, Section],
+) -> bool:
+    # Scrittura atomica: un crash a metà non lascia mai uno snapshot troncato, e i
+    # processi che hanno ancora mappato il file precedente continuano a leggerlo.
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    try:
+        layout: Dict[str, Tuple[int, int, str]] = {}
+        pos = 0
+        for name, data in sections.items():
+            pos = -(-pos // _ALIGN) * _ALIGN
+            if isinstance(data, array):
+                typecode, nbytes = data.typecode, data.itemsize * len(data)
+            else:
+                typecode, nbytes = "B", len(data)
+            layout[name] = (pos, nbytes, typecode)
+            pos += nbytes
+
+        def encode_header(base: int) -> bytes:
+            return json.dumps({
+                "version": SNAPSHOT_VERSION,
+                "byteorder": sys.byteorder,
+                "itemsizes": _itemsizes(),
+                "fingerprints": fps,
+                "meta": meta,
+                "sections": {n: (base + o, nb, tc) for n, (o, nb, tc) in layout.items()},
+            }, ensure_ascii=False).encode("utf-8")
+
+        # Gli offset assoluti dipendono dalla lunghezza dell'header, che dipende
+        # dagli offset: si ricalcola finché l'inizio (allineato) delle sezioni è stabile.
+        base = 0
+        while True:
+            header = encode_header(base)
+            new_base = -(-(len(MAGIC) + 4 + len(header)) // _ALIGN) * _ALIGN
+            if new_base == base:
+                break
+            base = new_base
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for name, data in sections.items():
+                f.write(b"\x00" * (base + layout[name][0] - f.tell()))
+                f.write(data)
+        os.replace(tmp, path)
+        log.info("💾 snapshot indice salvato: %s (%d bytes)", path, path.stat().st_size)
+        return True
+    except Exception:
+        log.exception("💾 impossibile salvare lo snapshot indice in %s", path)
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
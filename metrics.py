@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — metriche in formato Prometheus (GET /metrics).
+
+Contatori e istogrammi per processo, senza lock: gli handler girano tutti
+nel loop asyncio, quindi un incremento è un'operazione su un dict e un
+intero. I pochi incrementi fatti da thread (build nell'executor) restano
+corretti grazie al GIL, al massimo con un'osservazione persa in una gara
+rarissima: accettabile per delle metriche.
+
+Le metriche "calcolate" (dimensione dell'indice, profondità della coda…) si
+registrano con una funzione letta solo al momento dello scrape: zero costi
+sul percorso caldo.
+
+Niente prometheus_client: il formato di testo 0.0.4 è poche righe.
+"""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Secondi: da 0.5 ms (lookup in cache) a 60 s (build dell'indice).
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+Labels = Tuple[str, ...]
+Sample = Union[float, Dict[Labels, float]]
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        _REGISTRY.append(self)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in list(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # etichette -> [conteggi per bucket (non cumulativi) + overflow, somma, conteggio]
+        self._series: Dict[Labels, List[Any]] = {}
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect_left(self.buckets, seconds)] += 1
+        s[1] += seconds
+        s[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def _samples(self) -> List[str]:
+        out = []
+        for labels, (counts, total, n) in list(self._series.items()):
+            cum = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le = _fmt_labels(self.labelnames, labels, f'le="{_fmt_value(bound)}"')
+                out.append(f"{self.name}_bucket{le} {cum}")
+            lbl = _fmt_labels(self.labelnames, labels)
+            out.append(f"{self.name}_sum{lbl} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{lbl} {n}")
+        return out
+
+
+class _Timer:
+    """`with HIST.time("ask"):` — osserva la durata del blocco, anche se solleva."""
+
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: Labels):
+        self.hist = hist
+        self.labels = labels
+        self.t0 = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+
+
+class Computed(_Metric):
+    """Gauge (o counter) letto da `fn` solo allo scrape: un numero, o {etichette: valore}."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Optional[Sample]], labels: Sequence[str] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        v = self.fn()
+        if v is None:
+            return []
+        if not isinstance(v, dict):
+            return [f"{self.name} {_fmt_value(v)}"]
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(x)}" for k, x in v.items()]
+
+
+def _rss_bytes() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:  # non Linux
+        pass
+    return None
+
+
+Computed("process_resident_memory_bytes", "RSS del processo", _rss_bytes)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _REGISTRY:
+        try:
+            lines.extend(m.render())
+        except Exception as e:  # una metrica rotta non deve far fallire lo scrape
+            lines.append(f"# {m.name} non disponibile: {type(e).__name__}")
+    return "\n".join(lines) + "\n"
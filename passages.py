@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — passaggi: finestre di token dentro le pagine.
+
+Ogni pagina viene divisa, al momento dell'indicizzazione, in finestre
+sovrapposte di `window` token grezzi che avanzano di `stride` token. Per
+ogni passaggio si salvano solo tre colonne:
+  - chunk : id della pagina nel ChunkStore
+  - start : offset in byte (nel testo UTF-8 della pagina) del primo token
+  - end   : offset in byte della fine dell'ultimo token
+Le postings del TermIndex puntano ai passaggi, non alle pagine (con le
+posizioni dei termini dentro il passaggio, per frasi e prossimità): si ordinano
+unità di poche centinaia di caratteri e la risposta taglia il passaggio
+esatto dal buffer del ChunkStore, senza cercare niente a render time.
+"""
+from __future__ import annotations
+
+from array import array
+from typing import Any, Dict, Iterator, List, Tuple
+
+from analyzer import TOKEN_RE, analyze_token
+from chunk_store import ChunkStore
+
+_SECTIONS = ("chunk", "start", "end")
+
+
+# Posizioni salvate come uint16: nessun passaggio può superare questi token.
+MAX_WINDOW = 65535
+
+# {termine: posizioni nel passaggio}
+TermPositions = Dict[str, List[int]]
+
+
+def split_page(text: str, window: int, stride: int) -> List[Tuple[int, int, TermPositions]]:
+    """(start, end, termini con posizioni) di ogni passaggio; offset in byte UTF-8."""
+    spans = [(m.start(), m.end(), analyze_token(m.group())) for m in TOKEN_RE.finditer(text)]
+    n = len(spans)
+    if not n:
+        return []
+    firsts = list(range(0, max(n - window, 0) + 1, stride))
+    if firsts[-1] + window < n:
+        firsts.append(n - window)
+
+    bounds = [(spans[i][0], spans[min(i + window, n) - 1][1]) for i in firsts]
+    if text.isascii():
+        to_byte = {p: p for b in bounds for p in b}
+    else:
+        # char -> byte in un solo passaggio, solo sui confini dei passaggi
+        to_byte = {}
+        pos = nbytes = 0
+        for p in sorted({p for b in bounds for p in b}):
+            nbytes += len(text[pos:p].encode("utf-8"))
+            pos = p
+            to_byte[p] = nbytes
+
+    out = []
+    for i, (a, z) in zip(firsts, bounds):
+        terms: TermPositions = {}
+        for k, (_, _, toks) in enumerate(spans[i:i + window]):
+            for t in toks:
+                terms.setdefault(t, []).append(k)
+        out.append((to_byte[a], to_byte[z], terms))
+    return out
+
+
+class Passages:
+    __slots__ = _SECTIONS
+
+    def __init__(self, chunk: Any = None, start: Any = None, end: Any = None):
+        self.chunk = chunk if chunk is not None else array("I")
+        self.start = start if start is not None else array("I")
+        self.end = end if end is not None else array("I")
+
+    def __len__(self) -> int:
+        return len(self.chunk)
+
+    def text(self, store: ChunkStore, pid: int) -> str:
+        base = store.text_off[self.chunk[pid]]
+        return store.text_buf[base + self.start[pid]:base + self.end[pid]].decode("utf-8")
+
+    # ── costruzione ──────────────────────────
+    def _push(self, cid: int, start: int, end: int) -> int:
+        self.chunk.append(cid)
+        self.start.append(start)
+        self.end.append(end)
+        return len(self.chunk) - 1
+
+    def add_page(self, cid: int, text: str, window: int, stride: int) -> Iterator[Tuple[int, TermPositions]]:
+        """Divide una pagina appena aggiunta allo store: (id passaggio, termini) per ogni passaggio."""
+        for a, z, terms in split_page(text, window, stride):
+            yield self._push(cid, a, z), terms
+
+    def copy_page(self, cid: int, src: "Passages", pids: List[int]) -> List[int]:
+        """
+        Copia i passaggi `pids` di un altro indice sulla pagina `cid` (reindex
+        incrementale: offset invariati, niente ri-analisi). Ritorna i nuovi id.
+        """
+        return [self._push(cid, src.start[p], src.end[p]) for p in pids]
+
+    def by_chunk(self) -> Dict[int, List[int]]:
+        out: Dict[int, List[int]] = {}
+        for pid, cid in enumerate(self.chunk):
+            out.setdefault(cid, []).append(pid)
+        return out
+
+    # ── snapshot ─────────────────────────────
+    def sections(self) -> Dict[str, Any]:
+        return {f"passages.{name}": getattr(self, name) for name in _SECTIONS}
+
+    @classmethod
+    def from_sections(cls, get) -> "Passages":
+        return cls(*(get(f"passages.{name}") for name in _SECTIONS))
+
+
+class PassageView:
+    """Un passaggio come risultato di ricerca: libro, pagina e testo del passaggio."""
+
+    __slots__ = ("_store", "_passages", "_i")
+
+    def __init__(self, store: ChunkStore, passages: Passages, i: int):
+        self._store = store
+        self._passages = passages
+        self._i = i
+
+    @property
+    def id(self) -> int:
+        return self._i
+
+    @property
+    def chunk_id(self) -> int:
+        return self._passages.chunk[self._i]
+
+    @property
+    def book(self) -> str:
+        return self._store.book_of(self.chunk_id)
+
+    @property
+    def page(self) -> int:
+        return self._store.pages[self.chunk_id]
+
+    @property
+    def text(self) -> str:
+        return self._passages.text(self._store, self._i)
+
+    def excerpt(self) -> str:
+        """Testo del passaggio, con "…" dove taglia la pagina."""
+        cid = self.chunk_id
+        page_len = self._store.text_off[cid + 1] - self._store.text_off[cid]
+        head = "…" if self._passages.start[self._i] > 0 else ""
+        tail = "…" if self._passages.end[self._i] < page_len else ""
+        return f"{head}{self.text}{tail}"
+
+    def __repr__(self) -> str:
+        return f"PassageView(book={self.book!r}, page={self.page}, id={self._i})"
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — indice per prefisso delle parole del corpus (autocomplete inline).
+
+Le parole sono quelle che l'utente scrive (minuscolo, senza accenti, senza
+stopword, NON stemmate: si suggerisce "reincarnazione", non "reincarnazion"),
+con il numero di occorrenze nel corpus. Stesso layout colonnare di TermIndex:
+  - blob   : parole UTF-8 ordinate, ognuna seguita da "\\n"
+  - starts : offset di inizio di ogni parola nel blob (+ sentinella finale)
+  - counts : occorrenze di ogni parola
+Un prefisso corrisponde a un intervallo contiguo di parole, trovato con due
+ricerche binarie; i completamenti sono le parole più frequenti dell'intervallo.
+"""
+from __future__ import annotations
+
+import heapq
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from analyzer import fold, normalize, words
+from chunk_store import ChunkStore
+
+_SECTIONS = ("blob", "starts", "counts")
+MIN_WORD_LEN = 3
+
+
+class PrefixIndex:
+    __slots__ = _SECTIONS + ("_cache",)
+
+    def __init__(self, blob: Any, starts: Any, counts: Any):
+        self.blob = blob
+        self.starts = starts
+        self.counts = counts
+        self._cache: Dict[Tuple[str, int], List[Tuple[str, int]]] = {}
+
+    @classmethod
+    def from_store(cls, store: ChunkStore) -> "PrefixIndex":
+        b = PrefixIndexBuilder()
+        for cid in range(len(store)):
+            b.add(store.text(cid))
+        return b.build()
+
+    # ── snapshot ─────────────────────────────
+    def sections(self) -> Dict[str, Any]:
+        return {f"prefix.{name}": getattr(self, name) for name in _SECTIONS}
+
+    @classmethod
+    def from_sections(cls, get) -> "PrefixIndex":
+        return cls(*(get(f"prefix.{name}") for name in _SECTIONS))
+
+    # ── accesso ──────────────────────────────
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def word(self, i: int) -> str:
+        return self.blob[self.starts[i]:self.starts[i + 1] - 1].decode("utf-8")
+
+    def _lower_bound(self, key: bytes) -> int:
+        blob, starts = self.blob, self.starts
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blob[starts[mid]:starts[mid + 1] - 1] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def complete(self, prefix: str, n: int = 5) -> List[Tuple[str, int]]:
+        """Le `n` parole più frequenti che iniziano con `prefix` (già minuscolo o no)."""
+        prefix = fold(normalize(prefix.strip()))
+        key = (prefix, n)
+        hit = self._cache.get(key)
+        if hit is not None:
+            return hit
+        raw = prefix.encode("utf-8")
+        lo = self._lower_bound(raw)
+        # 0xFF non compare mai in UTF-8: è maggiore di ogni parola col prefisso.
+        hi = self._lower_bound(raw + b"\xff")
+        counts = self.counts
+        best = heapq.nlargest(n, range(lo, hi), key=lambda i: (counts[i], -i)) if raw else []
+        out = [(self.word(i), counts[i]) for i in best]
+        if len(self._cache) < 4096:
+            self._cache[key] = out
+        return out
+
+
+class PrefixIndexBuilder:
+    """Conta le parole pagina per pagina (build in streaming, vedi build_index)."""
+
+    def __init__(self) -> None:
+        self._freq: Counter = Counter()
+
+    def add(self, text: str) -> None:
+        self._freq.update(w for w in words(text) if len(w) >= MIN_WORD_LEN and not w.isdigit())
+
+    def build(self) -> PrefixIndex:
+        freq = self._freq
+        parts: List[bytes] = []
+        starts = array("I", [0])
+        counts = array("I")
+        for w in sorted(freq):
+            raw = w.encode("utf-8") + b"\n"
+            parts.append(raw)
+            starts.append(starts[-1] + len(raw))
+            counts.append(freq[w])
+        return PrefixIndex(b"".join(parts), starts, counts)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — profiling a richiesta (GET /debug/profile).
+
+Una sessione alla volta, per T secondi o per i prossimi N update processati
+(quello che arriva prima). Due modi:
+  - cprofile : cProfile sul thread del loop asyncio, dove girano
+               process_update, gli handler e search_index (da Python 3.12
+               cProfile vede tutti i thread). Report pstats.
+  - sample   : un thread che ogni `interval` secondi legge lo stack di tutti
+               gli altri thread (sys._current_frames), compresi i rebuild di
+               build_index nell'executor. Report in formato "collapsed stack"
+               (una riga "thread;f1;f2;… conteggio", pronta per flamegraph.pl
+               o speedscope) oppure le funzioni con più campioni.
+
+A sessione spenta non c'è nessun hook attivo: update_done() legge una
+variabile globale e ritorna.
+"""
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+MODES = ("cprofile", "sample")
+FORMATS = ("collapsed", "top")  # solo per mode=sample
+SORT_KEYS = tuple(pstats.Stats.sort_arg_dict_default)  # solo per mode=cprofile
+
+# Foglie di stack "in attesa" (loop senza lavoro, thread del pool fermi,
+# socket in lettura):
+# scartate dal campionamento salvo include_idle.
+_IDLE_LEAVES = {
+    ("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker"),
+    ("queue.py", "get"), ("socketserver.py", "serve_forever"), ("socket.py", "readinto"),
+}
+
+_SESSION: Optional["ProfileSession"] = None
+
+
+class ProfileBusy(RuntimeError):
+    pass
+
+
+def update_done() -> None:
+    """Chiamata dopo ogni update processato (coda update)."""
+    s = _SESSION
+    if s is not None:
+        s.update_done()
+
+
+def active() -> Optional["ProfileSession"]:
+    return _SESSION
+
+
+class _StackSampler:
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, f"thread-{tid}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class ProfileSession:
+    def __init__(
+        self, mode: str, seconds: float, updates: int = 0, interval: float = 0.005, include_idle: bool = False,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode deve essere uno tra {', '.join(MODES)}")
+        self.mode = mode
+        self.seconds = seconds
+        self.updates = updates
+        self.interval = interval
+        self.include_idle = include_idle
+        self.updates_seen = 0
+        self.elapsed = 0.0
+        self._done = asyncio.Event()
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_StackSampler] = None
+
+    def update_done(self) -> None:
+        self.updates_seen += 1
+        if self.updates and self.updates_seen >= self.updates:
+            self._done.set()
+
+    async def run(self) -> "ProfileSession":
+        """Profila fino a `seconds` secondi o `updates` update. Una sessione per processo."""
+        global _SESSION
+        if _SESSION is not None:
+            raise ProfileBusy("profiling già in corso")
+        _SESSION = self
+        t0 = time.perf_counter()
+        try:
+            if self.mode == "cprofile":
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+            else:
+                self._sampler = _StackSampler(self.interval, self.include_idle)
+                self._sampler.start()
+            try:
+                await asyncio.wait_for(self._done.wait(), self.seconds)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            if self._profile is not None:
+                self._profile.disable()
+            if self._sampler is not None:
+                self._sampler.stop()
+            self.elapsed = time.perf_counter() - t0
+            _SESSION = None
+        return self
+
+    def report(self, fmt: str = "collapsed", sort: str = "cumulative", limit: int = 50) -> str:
+        head = f"# {self.mode}: {self.elapsed:.2f}s, {self.updates_seen} update processati\n"
+        if self._profile is not None:
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats(sort).print_stats(limit)
+            return head + out.getvalue()
+        sampler = self._sampler
+        if sampler is None:
+            return head
+        head += f"# {sampler.samples} campioni ogni {self.interval * 1e3:g} ms\n"
+        if fmt == "top":
+            # Campioni per funzione in cima allo stack (tempo "self").
+            leaves: Counter = Counter()
+            for stack, n in sampler.stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += n
+            total = sum(leaves.values()) or 1
+            return head + "".join(f"{n:8d} {n / total:6.1%}  {leaf}\n" for leaf, n in leaves.most_common(limit))
+        return head + "".join(f"{stack} {n}\n" for stack, n in sampler.stacks.most_common())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — cache delle risposte a /ask.
+
+Nei gruppi tornano sempre le stesse domande ("piano astrale", "karma", …):
+la cache tiene, per domanda normalizzata, i blocchi HTML già pronti
+(libro, pagina, snippet), così una domanda ripetuta non rifà né la ricerca
+né gli snippet.
+
+Limiti: numero di voci, byte totali (lunghezza UTF-8 dei blocchi) e TTL.
+Le voci sono legate alla generazione dell'indice: quando INDEX viene
+sostituito (reindex) la cache si svuota da sola al primo accesso.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 256, max_bytes: int = 2_000_000, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = Lock()
+        # chiave -> (scadenza, byte, blocchi); l'ordine è quello LRU (ultimo = più recente)
+        self._data: "OrderedDict[str, Tuple[float, int, List[str]]]" = OrderedDict()
+        self._generation = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _sync_generation(self, generation: int) -> None:
+        if generation != self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str, generation: int) -> Optional[List[str]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._sync_generation(generation)
+            hit = self._data.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            if hit[0] < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hit[2]
+
+    def put(self, key: str, generation: int, blocks: List[str]) -> None:
+        if not self.enabled:
+            return
+        size = len(key.encode("utf-8")) + sum(len(b.encode("utf-8")) for b in blocks)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._sync_generation(generation)
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, list(blocks))
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
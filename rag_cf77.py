@@ -1,21 +1,131 @@
 from __future__ import annotations
 
-import re
+import math
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Sequence, Tuple
 
-import fitz  # PyMuPDF
-from rank_bm25 import BM25Okapi
+import numpy as np
+
+from analyzer import analyze
 
 log = logging.getLogger("ANACLETO")
 
+try:
+    import fitz  # PyMuPDF
+    HAVE_FITZ = True
+except ImportError as e:  # il motore BM25 resta usabile su chunk già estratti
+    fitz = None  # type: ignore
+    HAVE_FITZ = False
+    log.warning("PyMuPDF non disponibile: %s — CF77Rag non potrà leggere PDF", e)
+
+
+class BM25Index:
+    """
+    BM25 Okapi con NumPy, stessi parametri e stessa formula di rank_bm25.BM25Okapi
+    (idf negativi portati a epsilon * idf medio).
 
-def _tokenize(text: str) -> List[str]:
-    text = text.lower()
-    text = re.sub(r"[^\wàèéìòù]+", " ", text, flags=re.UNICODE)
-    return [t for t in text.split() if len(t) > 1]
+    In costruzione il contributo di ogni coppia (termine, documento) viene
+    precalcolato in una matrice CSR termine x documento: a query time lo score è
+    solo una somma delle righe dei termini della domanda, e il top-k usa
+    argpartition invece di ordinare tutti i documenti.
+    """
+
+    def __init__(self, corpus: Sequence[Sequence[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(corpus)
+
+        # termine -> riga; postings (riga, doc, tf) raccolti per documento
+        vocab: Dict[str, int] = {}
+        rows: List[int] = []
+        docs: List[int] = []
+        tfs: List[int] = []
+        doc_len = np.zeros(self.corpus_size, dtype=np.int64)
+        for d, tokens in enumerate(corpus):
+            doc_len[d] = len(tokens)
+            freqs: Dict[str, int] = {}
+            for t in tokens:
+                freqs[t] = freqs.get(t, 0) + 1
+            for t, tf in freqs.items():
+                rows.append(vocab.setdefault(t, len(vocab)))
+                docs.append(d)
+                tfs.append(tf)
+        self.vocab = vocab
+        self.avgdl = float(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0
+
+        row_arr = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(row_arr, kind="stable")      # doc crescenti dentro ogni riga
+        counts = np.bincount(row_arr, minlength=len(vocab))
+        self.indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = np.asarray(docs, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float64)[order]
+
+        # idf come rank_bm25: log(N - n + 0.5) - log(n + 0.5), floor a eps * media
+        idf = np.array(
+            [math.log(self.corpus_size - n + 0.5) - math.log(n + 0.5) for n in counts.tolist()],
+            dtype=np.float64,
+        )
+        # Somma con += come rank_bm25: sum() dalla 3.12 usa la somma compensata
+        # e darebbe una media diversa nelle ultime cifre.
+        idf_sum = 0.0
+        for v in idf.tolist():
+            idf_sum += v
+        self.average_idf = idf_sum / len(idf) if len(idf) else 0.0
+        idf[idf < 0] = self.epsilon * self.average_idf
+        self.idf = idf
+
+        # Stesse operazioni, nello stesso ordine, di BM25Okapi.get_scores: i punteggi
+        # coincidono bit a bit e così anche il ranking.
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl) if self.corpus_size else doc_len
+        term_of = np.repeat(np.arange(len(vocab)), counts)
+        self.data = idf[term_of] * (tf * (self.k1 + 1) / (tf + norm[self.indices]))
+
+    def _rows(self, tokens: Sequence[str]) -> List[int]:
+        return [r for r in (self.vocab.get(t) for t in tokens) if r is not None]
+
+    def get_scores(self, tokens: Sequence[str]) -> np.ndarray:
+        scores = np.zeros(self.corpus_size)
+        for r in self._rows(tokens):
+            a, z = self.indptr[r], self.indptr[r + 1]
+            scores[self.indices[a:z]] += self.data[a:z]
+        return scores
+
+    def get_batch_scores(self, queries: Sequence[Sequence[str]]) -> np.ndarray:
+        """Matrice (n_query x n_doc) in una sola passata: gather di tutte le righe + np.add.at."""
+        q_ids: List[np.ndarray] = []
+        spans: List[np.ndarray] = []
+        for qi, tokens in enumerate(queries):
+            for r in self._rows(tokens):
+                a, z = int(self.indptr[r]), int(self.indptr[r + 1])
+                spans.append(np.arange(a, z))
+                q_ids.append(np.full(z - a, qi))
+        scores = np.zeros((len(queries), self.corpus_size))
+        if spans:
+            pos = np.concatenate(spans)
+            # add.at è unbuffered e segue l'ordine degli indici: stessa somma di get_scores
+            np.add.at(scores, (np.concatenate(q_ids), self.indices[pos]), self.data[pos])
+        return scores
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        Indici dei k punteggi migliori, in ordine decrescente; a parità di punteggio
+        vince l'indice più basso (come sorted(..., reverse=True) sull'intero vettore).
+        """
+        n = len(scores)
+        k = min(max(1, k), n)
+        if k < n:
+            thr = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            above = np.flatnonzero(scores > thr)
+            ties = np.flatnonzero(scores == thr)[: k - len(above)]
+            cand = np.concatenate([above, ties])
+        else:
+            cand = np.arange(n)
+        return cand[np.lexsort((cand, -scores[cand]))]
 
 
 @dataclass
@@ -31,17 +141,19 @@ class CF77Rag:
     RAG super semplice:
     - carica PDF
     - spezza per pagina
-    - indicizza con BM25
+    - indicizza con BM25 (BM25Index, NumPy)
     - restituisce top-k estratti con citazione (file + pagina)
     """
 
     def __init__(self, pdf_dir: Path):
         self.pdf_dir = pdf_dir
         self.chunks: List[Chunk] = []
-        self.bm25: Optional[BM25Okapi] = None
+        self.bm25: Optional[BM25Index] = None
         self._corpus_tokens: List[List[str]] = []
 
     def _load_pdf_pages(self, pdf_path: Path) -> int:
+        if not HAVE_FITZ:
+            raise RuntimeError("PyMuPDF non disponibile")
         pages_count = 0
         doc = fitz.open(str(pdf_path))
         try:
@@ -49,7 +161,7 @@ class CF77Rag:
                 txt = (page.get_text("text") or "").strip()
                 if not txt:
                     continue
-                tokens = _tokenize(txt)
+                tokens = analyze(txt)
                 if not tokens:
                     continue
                 self.chunks.append(
@@ -84,25 +196,35 @@ class CF77Rag:
             except Exception as e:
                 log.exception("CF77: errore leggendo %s: %s", pdf.name, e)
 
+        self.index_chunks()
+        return (books, pages)
+
+    def index_chunks(self) -> None:
+        """(Ri)costruisce l'indice BM25 sui chunk correnti."""
         self._corpus_tokens = [c.tokens for c in self.chunks]
         if self._corpus_tokens:
-            self.bm25 = BM25Okapi(self._corpus_tokens)
+            self.bm25 = BM25Index(self._corpus_tokens)
         else:
             self.bm25 = None
 
-        return (books, pages)
-
     def query(self, question: str, top_k: int = 5) -> List[Chunk]:
         if not self.bm25 or not self.chunks:
             return []
 
-        q_tokens = _tokenize(question)
+        q_tokens = analyze(question)
         if not q_tokens:
             return []
 
         scores = self.bm25.get_scores(q_tokens)
-        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
-        out: List[Chunk] = []
-        for idx in ranked[: max(1, top_k)]:
-            out.append(self.chunks[idx])
-        return out
\ No newline at end of file
+        return [self.chunks[i] for i in BM25Index.top_k(scores, top_k)]
+
+    def query_batch(self, questions: Sequence[str], top_k: int = 5) -> List[List[Chunk]]:
+        """Come query(), ma tutte le domande vengono valutate in un'unica chiamata NumPy."""
+        if not self.bm25 or not self.chunks:
+            return [[] for _ in questions]
+        q_tokens = [analyze(q) for q in questions]
+        scores = self.bm25.get_batch_scores(q_tokens)
+        return [
+            [self.chunks[i] for i in BM25Index.top_k(row, top_k)] if toks else []
+            for toks, row in zip(q_tokens, scores)
+        ]
\ No newline at end of file
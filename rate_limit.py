@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — rate limiting a token bucket.
+
+Ogni chiave (utente, chat, comando) ha un secchio di `burst` gettoni che si
+riempie di `rate` gettoni al secondo; una richiesta costa `cost` gettoni
+(/reindex costa molto più di /ask). Una richiesta passa solo se TUTTI i secchi
+coinvolti hanno abbastanza gettoni, e solo allora vengono scalati.
+
+Memoria limitata: i secchi stanno in un OrderedDict in ordine LRU. Un secchio
+rimasto fermo abbastanza da tornare pieno equivale a un secchio mai creato,
+quindi viene eliminato; oltre `max_keys` si elimina comunque il meno recente.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float     # gettoni al secondo
+    burst: float    # capienza del secchio
+
+    @classmethod
+    def per_minute(cls, n: float, burst: float) -> "Limit":
+        return cls(rate=n / 60.0, burst=burst)
+
+
+class TokenBuckets:
+    """Secchi con lo stesso Limit, uno per chiave."""
+
+    def __init__(self, limit: Limit, max_keys: int = 10_000):
+        self.limit = limit
+        self.max_keys = max(1, max_keys)
+        # chiave -> (gettoni, istante dell'ultimo aggiornamento)
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _level(self, key: Hashable, now: float) -> float:
+        hit = self._buckets.get(key)
+        if hit is None:
+            return self.limit.burst
+        tokens, t = hit
+        return min(self.limit.burst, tokens + (now - t) * self.limit.rate)
+
+    def wait(self, key: Hashable, cost: float, now: float) -> float:
+        """Secondi da aspettare prima che `cost` gettoni siano disponibili (0 = subito)."""
+        missing = cost - self._level(key, now)
+        if missing <= 0:
+            return 0.0
+        if self.limit.rate <= 0 or cost > self.limit.burst:
+            return float("inf")
+        return missing / self.limit.rate
+
+    def spend(self, key: Hashable, cost: float, now: float) -> None:
+        self._buckets[key] = (self._level(key, now) - cost, now)
+        self._buckets.move_to_end(key)
+        self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        full_after = self.limit.burst / self.limit.rate if self.limit.rate > 0 else float("inf")
+        buckets = self._buckets
+        while buckets:
+            key, (_, t) = next(iter(buckets.items()))
+            if len(buckets) > self.max_keys or now - t >= full_after:
+                del buckets[key]
+                self.evicted += 1
+            else:
+                break
+
+
+class RateLimiter:
+    """
+    Secchi per utente, per chat e per comando (globali), con un costo per
+    comando. check() scala i gettoni da tutti i secchi o da nessuno.
+    Un Limit a None (o un comando senza Limit) = nessun limite su quel livello.
+    """
+
+    def __init__(
+        self,
+        user: Optional[Limit],
+        chat: Optional[Limit],
+        commands: Optional[Dict[str, Optional[Limit]]] = None,
+        costs: Optional[Dict[str, float]] = None,
+        notify_every: float = 30.0,
+        max_keys: int = 10_000,
+    ):
+        self.user = TokenBuckets(user, max_keys) if user else None
+        self.chat = TokenBuckets(chat, max_keys) if chat else None
+        self.commands = {name: TokenBuckets(limit, 1) for name, limit in (commands or {}).items() if limit}
+        self.costs = dict(costs or {})
+        # Un avviso "rallenta" per utente ogni notify_every secondi, gli altri si scartano.
+        self.notices = TokenBuckets(Limit(rate=1.0 / notify_every, burst=1.0), max_keys)
+        self.allowed = 0
+        self.throttled: Dict[str, int] = {"user": 0, "chat": 0, "command": 0}
+        self.notified = 0
+
+    def cost(self, command: str) -> float:
+        return self.costs.get(command, 1.0)
+
+    def check(self, command: str, user_id: Optional[int], chat_id: Optional[int], now: Optional[float] = None) -> float:
+        """0 se la richiesta passa (gettoni scalati), altrimenti i secondi da aspettare."""
+        now = time.monotonic() if now is None else now
+        cost = self.cost(command)
+        targets: List[Tuple[str, TokenBuckets, Hashable, float]] = []
+        if self.user is not None and user_id is not None:
+            targets.append(("user", self.user, user_id, cost))
+        # In privato chat e utente coincidono: basta il secchio dell'utente.
+        if self.chat is not None and chat_id is not None and chat_id != user_id:
+            targets.append(("chat", self.chat, chat_id, cost))
+        if command in self.commands:
+            targets.append(("command", self.commands[command], command, 1.0))
+
+        worst, scope = 0.0, ""
+        for name, buckets, key, c in targets:
+            w = buckets.wait(key, c, now)
+            if w > worst:
+                worst, scope = w, name
+        if worst > 0:
+            self.throttled[scope] += 1
+            return worst
+        for _, buckets, key, c in targets:
+            buckets.spend(key, c, now)
+        self.allowed += 1
+        return 0.0
+
+    def should_notify(self, user_id: Optional[int], now: Optional[float] = None) -> bool:
+        """True se all'utente throttled conviene rispondere (al massimo una volta ogni notify_every)."""
+        now = time.monotonic() if now is None else now
+        key = user_id if user_id is not None else 0
+        if self.notices.wait(key, 1.0, now) > 0:
+            return False
+        self.notices.spend(key, 1.0, now)
+        self.notified += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "allowed": self.allowed,
+            "throttled": dict(self.throttled),
+            "notified": self.notified,
+            # limitate senza avviso: scartate in silenzio
+            "dropped": sum(self.throttled.values()) - self.notified,
+            "user_buckets": len(self.user) if self.user else None,
+            "chat_buckets": len(self.chat) if self.chat else None,
+            "evicted": sum(b.evicted for b in (self.user, self.chat) if b),
+            "costs": dict(self.costs),
+        }
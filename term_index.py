@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — indice invertito termine -> postings (passage_id, tf).
+
+Struttura CSR, tutta in colonne piatte così da poter stare sia in memoria
+(`array`) sia dentro lo snapshot mappato (memoryview / MappedBlob):
+  - blob    : termini UTF-8 ordinati, ognuno seguito da "\\n"
+  - starts  : offset di inizio di ogni termine nel blob (+ sentinella finale)
+  - ptr     : postings del termine k = ids/tfs[ptr[k]:ptr[k+1]]
+  - ids,tfs : id crescenti dei passaggi (vedi passages.py) e frequenze
+  - pos_ptr : posizioni della posting j = pos[pos_ptr[j]:pos_ptr[j+1]]
+  - pos     : posizioni (in token grezzi dall'inizio del passaggio) crescenti
+  - fz_keys : crc32 delle cancellazioni (SymSpell) dei termini, ordinati
+  - fz_tids : termine a cui appartiene ogni cancellazione
+
+I termini sono quelli prodotti da analyzer.py (già piegati e stemmati), una
+sola volta per passaggio al momento dell'indicizzazione. lookup() trova
+l'id di un termine esatto per ricerca binaria sul blob; span() e positions()
+danno le sue postings e le posizioni di ognuna; fuzzy() trova i termini a
+distanza di edit 1-2 (errori OCR, refusi) con l'indice a cancellazioni di
+SymSpell: ogni termine è registrato sotto tutte le stringhe ottenute togliendo
+fino a FUZZY_MAX_EDITS caratteri dai suoi primi FUZZY_PREFIX; una domanda genera
+le sue cancellazioni, i termini che ne condividono una sono i candidati, la
+distanza vera (Damerau, OSA) si calcola solo su quelli.
+"""
+from __future__ import annotations
+
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, islice
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+
+_SECTIONS = ("blob", "starts", "ptr", "ids", "tfs", "pos_ptr", "pos", "fz_keys", "fz_tids")
+
+FUZZY_MAX_EDITS = 2
+FUZZY_PREFIX = 7
+
+
+def _deletes(word: str, max_edits: int = FUZZY_MAX_EDITS) -> set:
+    """La parola (tagliata a FUZZY_PREFIX) e tutte le sue cancellazioni fino a max_edits."""
+    out = frontier = {word[:FUZZY_PREFIX]}
+    for _ in range(max_edits):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out = out | frontier
+    return out
+
+
+def _hash(s: str) -> int:
+    return zlib.crc32(s.encode("utf-8"))
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Distanza di Damerau (optimal string alignment), al massimo limit+1.
+    Algoritmo bit-parallelo di Myers con l'estensione di Hyyrö per le
+    trasposizioni: una colonna della tabella per carattere di `b`, in un int.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Prefisso e suffisso comuni non cambiano la distanza: i candidati condividono
+    # quasi sempre l'inizio, quindi restano pochi caratteri.
+    n = min(len(a), len(b))
+    k = 0
+    while k < n and a[k] == b[k]:
+        k += 1
+    a, b = a[k:], b[k:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    m = len(a)
+    if not m or not b:
+        return min(max(m, len(b)), limit + 1)
+
+    peq: Dict[str, int] = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    full = (1 << m) - 1
+    top = 1 << (m - 1)
+    vp, vn, d0, pm_prev, score = full, 0, 0, 0, m
+    for c in b:
+        pm = peq.get(c, 0)
+        tr = (((~d0) & pm) << 1) & pm_prev
+        x = pm | vn
+        d0 = ((((x & vp) + vp) ^ vp) | x | tr) & full
+        hp = (vn | ~(d0 | vp)) & full
+        hn = d0 & vp
+        if hp & top:
+            score += 1
+        elif hn & top:
+            score -= 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        vp = (hn | ~(d0 | hp)) & full
+        vn = d0 & hp
+        pm_prev = pm
+    return min(score, limit + 1)
+
+
+class TermIndex:
+    __slots__ = _SECTIONS + ("_fuzzy_cache",)
+
+    def __init__(
+        self, blob: Any, starts: Any, ptr: Any, ids: Any, tfs: Any, pos_ptr: Any, pos: Any,
+        fz_keys: Any, fz_tids: Any,
+    ):
+        self.blob = blob
+        self.starts = starts
+        self.ptr = ptr
+        self.ids = ids
+        self.tfs = tfs
+        self.pos_ptr = pos_ptr
+        self.pos = pos
+        self.fz_keys = fz_keys
+        self.fz_tids = fz_tids
+        self._fuzzy_cache: Dict[Tuple[str, int], List[Tuple[int, int]]] = {}
+
+    # ── costruzione ──────────────────────────
+    @classmethod
+    def _from_columns(cls, columns: Iterable[Tuple[str, Sequence[int], Sequence[int], Sequence[int]]]) -> "TermIndex":
+        """CSR da (termine, ids, tfs, posizioni concatenate), con i termini già in ordine."""
+        parts: List[bytes] = []
+        starts = array("I", [0])
+        ptr = array("I", [0])
+        ids = array("I")
+        tfs = array("I")
+        pos_ptr = array("I", [0])
+        pos = array("H")
+        vocab: List[str] = []
+        for term, t_ids, t_tfs, t_pos in columns:
+            vocab.append(term)
+            raw = term.encode("utf-8") + b"\n"
+            parts.append(raw)
+            starts.append(starts[-1] + len(raw))
+            ids.extend(t_ids)
+            tfs.extend(t_tfs)
+            pos.extend(t_pos)
+            pos_ptr.extend(islice(accumulate(t_tfs, initial=pos_ptr[-1]), 1, None))
+            ptr.append(len(ids))
+        # (hash << 32 | tid) in un solo intero: un sort di interi invece che di tuple.
+        # Prima si smistano in 256 secchi per byte alto dell'hash (array compatti),
+        # poi si ordina un secchio alla volta: mai tutte le chiavi come int Python.
+        buckets = [array("Q") for _ in range(256)]
+        for tid, term in enumerate(vocab):
+            for d in _deletes(term):
+                h = _hash(d)
+                buckets[h >> 24].append((h << 32) | tid)
+        fz_keys = array("I")
+        fz_tids = array("I")
+        for i, bucket in enumerate(buckets):
+            packed = sorted(bucket)
+            buckets[i] = None  # type: ignore[call-overload]
+            fz_keys.extend(k >> 32 for k in packed)
+            fz_tids.extend(k & 0xFFFFFFFF for k in packed)
+        return cls(b"".join(parts), starts, ptr, ids, tfs, pos_ptr, pos, fz_keys, fz_tids)
+
+    def patched(self, remap: List[int], added: "TermIndexBuilder") -> "TermIndex":
+        """
+        Nuovo TermIndex dopo un reindex incrementale: remap[vecchio id] è il nuovo
+        id del passaggio (-1 = eliminato), `added` le postings dei passaggi nuovi.
+        Niente viene ri-tokenizzato.
+        """
+        fresh = added.columns()
+        old_tids = {self.term(tid): tid for tid in range(len(self))}
+
+        def merged(term: str) -> Tuple[str, List[int], List[int], List[int]]:
+            rows = []
+            tid = old_tids.get(term, -1)
+            if tid >= 0:
+                a, z = self.span(tid)
+                for j in range(a, z):
+                    pid = remap[self.ids[j]]
+                    if pid >= 0:
+                        rows.append((pid, self.positions(j)))
+            if term in fresh:
+                f_ids, f_tfs, f_pos = fresh[term]
+                k = 0
+                for pid, tf in zip(f_ids, f_tfs):
+                    rows.append((pid, f_pos[k:k + tf]))
+                    k += tf
+            # remap è monotono: basta ordinare quando si mescolano vecchie e nuove.
+            rows.sort(key=lambda r: r[0])
+            return term, [r[0] for r in rows], [len(r[1]) for r in rows], [p for r in rows for p in r[1]]
+
+        columns = (merged(term) for term in sorted(old_tids.keys() | fresh.keys()))
+        return TermIndex._from_columns(c for c in columns if c[1])
+
+    # ── snapshot ─────────────────────────────
+    def sections(self) -> Dict[str, Any]:
+        return {f"terms.{name}": getattr(self, name) for name in _SECTIONS}
+
+    @classmethod
+    def from_sections(cls, get) -> "TermIndex":
+        return cls(*(get(f"terms.{name}") for name in _SECTIONS))
+
+    # ── accesso ──────────────────────────────
+    def __len__(self) -> int:
+        return len(self.ptr) - 1
+
+    def term(self, tid: int) -> str:
+        return self.blob[self.starts[tid]:self.starts[tid + 1] - 1].decode("utf-8")
+
+    def span(self, tid: int) -> Tuple[int, int]:
+        """Intervallo [a, z) delle posting del termine (indici in ids/tfs/pos_ptr)."""
+        return self.ptr[tid], self.ptr[tid + 1]
+
+    def positions(self, j: int) -> Sequence[int]:
+        return self.pos[self.pos_ptr[j]:self.pos_ptr[j + 1]]
+
+    def lookup(self, term: str) -> int:
+        """Id del termine (già analizzato), -1 se non è nel vocabolario."""
+        needle = term.encode("utf-8") + b"\n"
+        blob, starts = self.blob, self.starts
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blob[starts[mid]:starts[mid + 1]] < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and blob[starts[lo]:starts[lo + 1]] == needle:
+            return lo
+        return -1
+
+    def df(self, tid: int) -> int:
+        """Numero di passaggi che contengono il termine."""
+        return self.ptr[tid + 1] - self.ptr[tid]
+
+    def fuzzy(self, term: str, max_edits: int) -> List[Tuple[int, int]]:
+        """(id, distanza) dei termini a distanza 1..max_edits da `term` (lui escluso)."""
+        max_edits = min(max_edits, FUZZY_MAX_EDITS)
+        key = (term, max_edits)
+        hit = self._fuzzy_cache.get(key)
+        if hit is not None:
+            return hit
+        keys, tids = self.fz_keys, self.fz_tids
+        n = len(keys)
+        cands = set()
+        for d in _deletes(term, max_edits):
+            h = _hash(d)
+            i = bisect_left(keys, h)
+            while i < n and keys[i] == h:
+                cands.add(tids[i])
+                i += 1
+        out = []
+        for tid in cands:
+            dist = edit_distance(term, self.term(tid), max_edits)
+            if 0 < dist <= max_edits:
+                out.append((tid, dist))
+        out.sort(key=lambda x: (x[1], x[0]))
+        if len(self._fuzzy_cache) < 4096:
+            self._fuzzy_cache[key] = out
+        return out
+
+
+class TermIndexBuilder:
+    """
+    Postings accumulate un passaggio alla volta (id crescenti), direttamente in
+    colonne `array` per termine: durante un build non esiste mai la mappa
+    completa {passaggio: {termine: posizioni}} né liste di int Python.
+    """
+
+    def __init__(self) -> None:
+        # termine -> (ids, tfs, posizioni concatenate)
+        self._terms: Dict[str, Tuple[array, array, array]] = {}
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, pid: int, terms: Dict[str, List[int]]) -> None:
+        cols = self._terms
+        for term, positions in terms.items():
+            c = cols.get(term)
+            if c is None:
+                c = cols[term] = (array("I"), array("I"), array("H"))
+            c[0].append(pid)
+            c[1].append(len(positions))
+            c[2].extend(positions)
+
+    def columns(self) -> Dict[str, Tuple[array, array, array]]:
+        return self._terms
+
+    def build(self) -> TermIndex:
+        """TermIndex finale; consuma il builder."""
+        cols = self._terms
+        # L'ordine dei code point coincide con l'ordine dei byte UTF-8.
+        # Le colonne vengono liberate man mano che finiscono nel CSR: il builder si svuota.
+        return TermIndex._from_columns((t, *cols.pop(t)) for t in sorted(cols))
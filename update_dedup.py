@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — scarto degli update Telegram già ricevuti.
+
+Se il webhook è lento o risponde con un errore, Telegram ri-consegna lo
+stesso update_id: senza questo filtro la ricerca gira due volte e nel gruppo
+arrivano due risposte. Gli ultimi `capacity` update_id accettati stanno in un
+ring buffer (ordine di arrivo, per sapere chi eliminare) più un set (per il
+controllo): inserimento, controllo ed eliminazione sono O(1).
+
+L'update_id viene letto dal corpo grezzo della richiesta con una regex, prima
+di json.loads e di Update.de_json: un duplicato costa una ricerca nei byte.
+Dentro le stringhe JSON le virgolette sono sempre escapate, quindi l'unico
+`"update_id"` con virgolette vere è la chiave dell'update.
+
+Persistenza opzionale: save()/load() su un file di int64, per non
+riprocessare dopo un riavvio gli update che Telegram ritenta nel frattempo.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+log = logging.getLogger("ANACLETO")
+
+_UPDATE_ID_RE = re.compile(rb'"update_id"\s*:\s*(-?\d+)')
+
+
+def peek_update_id(body: bytes) -> Optional[int]:
+    m = _UPDATE_ID_RE.search(body)
+    return int(m.group(1)) if m else None
+
+
+class RecentUpdateIds:
+    def __init__(self, capacity: int = 4096, path: Optional[Path] = None):
+        self.capacity = max(1, capacity)
+        self.path = path
+        self._ring = array("q", [0] * self.capacity)
+        self._next = 0      # prossima posizione da scrivere nel ring
+        self._count = 0     # posizioni occupate (<= capacity)
+        self._ids: Set[int] = set()
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._ids
+
+    def add(self, update_id: int) -> None:
+        if update_id in self._ids:
+            return
+        if self._count == self.capacity:
+            self._ids.discard(self._ring[self._next])
+        else:
+            self._count += 1
+        self._ring[self._next] = update_id
+        self._ids.add(update_id)
+        self._next = (self._next + 1) % self.capacity
+
+    def _ordered(self) -> array:
+        """Gli id dal più vecchio al più recente."""
+        if self._count < self.capacity:
+            return self._ring[:self._count]
+        return self._ring[self._next:] + self._ring[:self._next]
+
+    # ── persistenza ──────────────────────────
+    def save(self) -> bool:
+        if self.path is None:
+            return False
+        tmp = self.path.with_name(self.path.name + f".tmp{os.getpid()}")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("wb") as f:
+                self._ordered().tofile(f)
+            os.replace(tmp, self.path)
+            return True
+        except Exception:
+            log.exception("❌ salvataggio update_id recenti fallito: %s", self.path)
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            return False
+
+    def load(self) -> int:
+        """Ricarica gli id salvati (i più recenti, fino a capacity); ritorna quanti."""
+        if self.path is None or not self.path.exists():
+            return 0
+        ids = array("q")
+        try:
+            raw = self.path.read_bytes()
+            ids.frombytes(raw[: len(raw) - len(raw) % ids.itemsize])
+        except Exception:
+            log.exception("❌ lettura update_id recenti fallita: %s", self.path)
+            return 0
+        for uid in ids[-self.capacity:]:
+            self.add(uid)
+        return len(self)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "size": len(self),
+            "duplicates": self.duplicates,
+            "persisted": str(self.path) if self.path else None,
+        }
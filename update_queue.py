@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+MAESTRO ANACLETO — coda degli update Telegram tra webhook e handler.
+
+Il webhook mette l'update in coda e risponde subito 200: una ricerca lenta o
+una reply lenta verso Telegram non tengono più aperta la richiesta HTTP (che
+Telegram altrimenti ritenta, duplicando il lavoro).
+
+Ordine per chat: ogni chat ha la sua fila FIFO di update; in un asyncio.Queue
+entrano le chat che hanno lavoro pronto, al massimo una volta ciascuna. Un
+consumer prende una chat, processa il suo update più vecchio e, se la fila non
+è vuota, la rimette in fondo. Così gli update della stessa chat non vengono mai
+processati in parallelo né fuori ordine, e una chat molto attiva non blocca le
+altre (i consumer girano a turno tra le chat).
+
+Backpressure: oltre `maxsize` update in attesa offer() rifiuta e il webhook
+risponde 503; Telegram riproverà più tardi.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Tuple
+
+log = logging.getLogger("ANACLETO")
+
+# Campioni recenti su cui si calcolano i percentili dei tempi.
+_SAMPLES = 1024
+
+
+def _percentile(sorted_xs: List[float], q: float) -> float:
+    if not sorted_xs:
+        return 0.0
+    return sorted_xs[min(len(sorted_xs) - 1, int(q * len(sorted_xs)))]
+
+
+class _Timings:
+    """Conteggio, somma, massimo e percentili (sugli ultimi _SAMPLES) di una durata in secondi."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent: Deque[float] = deque(maxlen=_SAMPLES)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        xs = sorted(self._recent)
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total * 1e3, 3),
+            "p50_ms": round(_percentile(xs, 0.50) * 1e3, 3),
+            "p95_ms": round(_percentile(xs, 0.95) * 1e3, 3),
+            "max_ms": round(self.max * 1e3, 3),
+        }
+
+
+def chat_key(update: Any) -> Hashable:
+    """Chat dell'update (o utente, per le inline query); senza nessuno dei due, l'update stesso."""
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    return ("update", getattr(update, "update_id", id(update)))
+
+
+class UpdateQueue:
+    def __init__(
+        self,
+        process: Callable[[Any], Awaitable[Any]],
+        maxsize: int = 256,
+        workers: int = 4,
+        key: Callable[[Any], Hashable] = chat_key,
+    ):
+        self.process = process
+        self.maxsize = max(1, maxsize)
+        self.workers = max(1, workers)
+        self.key = key
+        # chat -> update in attesa (update, istante di arrivo); una chat è qui
+        # finché ha update in attesa o in lavorazione.
+        self._pending: Dict[Hashable, Deque[Tuple[Any, float]]] = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.depth = 0          # update in attesa (non ancora presi da un consumer)
+        self.in_flight = 0      # update in lavorazione
+        self.max_depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.wait = _Timings()
+        self.run = _Timings()
+
+    # ── ciclo di vita ────────────────────────
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(), name=f"update-worker-{i}") for i in range(self.workers)]
+        log.info("📥 coda update: %d consumer, max %d in attesa", self.workers, self.maxsize)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Aspetta (al massimo `timeout` secondi) che la coda si svuoti, poi ferma i consumer."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("📥 coda update: %d update ancora in attesa allo shutdown", self.depth + self.in_flight)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ── produttore ───────────────────────────
+    def offer(self, update: Any) -> bool:
+        """Mette in coda senza attendere; False = coda piena (backpressure)."""
+        if self.depth >= self.maxsize:
+            self.rejected += 1
+            return False
+        k = self.key(update)
+        item = (update, time.perf_counter())
+        fifo = self._pending.get(k)
+        if fifo is None:
+            self._pending[k] = deque([item])
+            self._ready.put_nowait(k)
+        else:
+            # La chat è già in coda o in lavorazione: l'update aspetta il suo turno.
+            fifo.append(item)
+        self.depth += 1
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self._idle.clear()
+        return True
+
+    # ── consumer ─────────────────────────────
+    async def _worker(self) -> None:
+        while True:
+            k = await self._ready.get()
+            fifo = self._pending[k]
+            update, t_in = fifo.popleft()
+            self.depth -= 1
+            self.in_flight += 1
+            t0 = time.perf_counter()
+            self.wait.add(t0 - t_in)
+            try:
+                await self.process(update)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                log.exception("❌ errore processando l'update %s", getattr(update, "update_id", "?"))
+            finally:
+                self.run.add(time.perf_counter() - t0)
+                self.processed += 1
+                self.in_flight -= 1
+                if fifo:
+                    self._ready.put_nowait(k)
+                else:
+                    del self._pending[k]
+                if not self.depth and not self.in_flight:
+                    self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "depth": self.depth,
+            "in_flight": self.in_flight,
+            "max_depth": self.max_depth,
+            "chats": len(self._pending),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "wait": self.wait.as_dict(),
+            "run": self.run.as_dict(),
+        }